@@ -0,0 +1,51 @@
+import argparse
+import time
+
+import numpy as np
+from tslearn.metrics import dtw
+
+from utils.batched_dtw import BatchedDTW
+
+"""
+Micro-benchmark of the BatchedDTW against per-series calls of tslearn.metrics.dtw. The agreement of the distances
+with tslearn is tested in tests/test_batched_dtw.py.
+Run from the repository root:
+    python -m benchmarks.batched_dtw_benchmark --particles 100 1000 10000 --window 20
+"""
+
+
+def time_call(function, repetitions: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        function()
+    return (time.perf_counter() - start) / repetitions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark BatchedDTW against tslearn")
+    parser.add_argument("--particles", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--window", type=int, default=20)
+    parser.add_argument("--radius", type=int, default=None)
+    parser.add_argument("--repetitions", type=int, default=5)
+    arguments = parser.parse_args()
+
+    generator = np.random.default_rng(0)
+
+    batched_dtw = BatchedDTW(sakoe_chiba_radius=arguments.radius)
+    constraint = {} if arguments.radius is None \
+        else {"global_constraint": "sakoe_chiba", "sakoe_chiba_radius": arguments.radius}
+    # first call compiles tslearn's numba kernels
+    dtw(np.zeros(arguments.window), np.zeros(arguments.window), **constraint)
+    print(f'{"particles":>10} {"tslearn [ms]":>14} {"batched [ms]":>14} {"speedup":>8}')
+    for number_of_particles in arguments.particles:
+        series = generator.normal(size=arguments.window)
+        histories = generator.normal(size=(number_of_particles, arguments.window))
+        tslearn_time = time_call(lambda: [dtw(series, history, **constraint) for history in histories],
+                                 arguments.repetitions)
+        batched_time = time_call(lambda: batched_dtw.distances(series, histories), arguments.repetitions)
+        print(f'{number_of_particles:>10} {tslearn_time * 1000:>14.2f} {batched_time * 1000:>14.2f} '
+              f'{tslearn_time / batched_time:>8.1f}')
+
+
+if __name__ == "__main__":
+    main()
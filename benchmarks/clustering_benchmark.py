@@ -0,0 +1,67 @@
+import argparse
+import time
+
+import numpy as np
+
+from filter.model3D import Model3D
+from utils.array_particle_set import ArrayParticleSet
+from utils.particle_filter_component_enums import ClusteringMethod
+
+"""
+Benchmark of the position estimate of Model3D with the GapClustering1D against the DBSCAN based clustering.
+Before timing, both estimates are checked to contain the same clusters in the same order.
+Run from the repository root:
+    python -m benchmarks.clustering_benchmark --particles 1000 10000 100000 --branches 11
+"""
+
+
+def generate_particles(generator: np.random.Generator, number_of_particles: int, number_of_branches: int):
+    branches = generator.integers(0, number_of_branches, size=number_of_particles)
+    centers = generator.uniform(0, 100, size=(number_of_branches, 3))
+    displacements = centers[branches, generator.integers(0, 3, size=number_of_particles)] \
+        + generator.normal(scale=2, size=number_of_particles)
+    return ArrayParticleSet(branches=branches, displacements=displacements)
+
+
+def describe(position_estimate) -> list:
+    return [(cluster.get_branch(), cluster.get_number_of_particles(), cluster.get_center(), cluster.get_error())
+            for branch in position_estimate.get_clusters() for cluster in position_estimate.get_clusters()[branch]]
+
+
+def check_equivalence(dbscan_model: Model3D, gap_model: Model3D):
+    dbscan_clusters = describe(dbscan_model.estimate_current_position())
+    gap_clusters = describe(gap_model.estimate_current_position())
+    if [cluster[:2] for cluster in dbscan_clusters] != [cluster[:2] for cluster in gap_clusters] \
+            or not np.allclose([cluster[2:] for cluster in dbscan_clusters], [cluster[2:] for cluster in gap_clusters]):
+        raise AssertionError("GapClustering1D deviates from DBSCAN")
+
+
+def time_call(function, repetitions: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        function()
+    return (time.perf_counter() - start) / repetitions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark GapClustering1D against DBSCAN")
+    parser.add_argument("--particles", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--branches", type=int, default=11)
+    parser.add_argument("--repetitions", type=int, default=3)
+    arguments = parser.parse_args()
+
+    generator = np.random.default_rng(0)
+    print(f'{"particles":>10} {"DBSCAN [ms]":>14} {"gap [ms]":>14} {"speedup":>8}')
+    for number_of_particles in arguments.particles:
+        particles = generate_particles(generator, number_of_particles, arguments.branches)
+        dbscan_model = Model3D(particles=particles, clustering_method=ClusteringMethod.DBSCAN)
+        gap_model = Model3D(particles=particles, clustering_method=ClusteringMethod.GAP_1D)
+        check_equivalence(dbscan_model, gap_model)
+        dbscan_time = time_call(dbscan_model.estimate_current_position, arguments.repetitions)
+        gap_time = time_call(gap_model.estimate_current_position, arguments.repetitions)
+        print(f'{number_of_particles:>10} {dbscan_time * 1000:>14.2f} {gap_time * 1000:>14.2f} '
+              f'{dbscan_time / gap_time:>8.1f}')
+
+
+if __name__ == "__main__":
+    main()
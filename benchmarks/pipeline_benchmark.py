@@ -0,0 +1,134 @@
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import platform
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic_data import generate_vessel_tree, save_vessel_tree, generate_measurement_stream
+from navigators.vessel_navigator import VesselNavigator
+from utils.particle_filter_component_enums import MeasurementType, ParticleSetType, DTWEngine, WeightingExecutorType
+from utils.timing_hooks import StepTimingRecorder, FILTER_STAGES
+
+"""
+Per-stage benchmark of the particle filter on synthetic vessel trees.
+For every combination of measurement type, particle set type and number of particles, a VesselNavigator is set up on
+a synthetic map and fed a synthetic sensor stream. The motion, weighting, resampling, injection and estimation
+stages are timed by a StepTimingRecorder attached to the particle filter, and the full VesselNavigator.update_step,
+including logging, is timed around each call. The results are written as JSON, so runs can be compared over time.
+Run from the repository root:
+    python -m benchmarks.pipeline_benchmark --particles 100 1000 10000 100000 --output pipeline_benchmark.json
+With --shards, every configuration is also run with the sharded particle filter on the given numbers of worker
+processes, and the throughput in particles per second shows how the filter scales with the cores:
+    python -m benchmarks.pipeline_benchmark --particles 1000000 --particle-set-types ARRAY --shards 1 2 4 8
+"""
+
+
+def summarize(durations: list) -> dict:
+    durations = np.asarray(durations) * 1000
+    return {"count": len(durations),
+            "mean_ms": float(np.mean(durations)),
+            "p50_ms": float(np.percentile(durations, 50)),
+            "p95_ms": float(np.percentile(durations, 95)),
+            "p100_ms": float(np.max(durations))}
+
+
+def setup_navigator(map_path: str, log_directory: str, measurement_type: MeasurementType,
+                    particle_set_type: ParticleSetType, dtw_engine: DTWEngine,
+                    number_of_particles: int, seed: int = None, number_of_shards: int = 1,
+                    weighting_executor: WeightingExecutorType = WeightingExecutorType.SERIAL) -> VesselNavigator:
+    navigator = VesselNavigator()
+    navigator.setup_navigator(reference_path=map_path,
+                              log_destination_path=log_directory,
+                              filename="pipeline_benchmark",
+                              measurement_type=measurement_type,
+                              number_of_particles=number_of_particles,
+                              loglevel=logging.WARNING,
+                              particle_set_type=particle_set_type,
+                              dtw_engine=dtw_engine,
+                              seed=seed,
+                              number_of_shards=number_of_shards,
+                              weighting_executor=weighting_executor)
+    return navigator
+
+
+def time_update_steps(navigator: VesselNavigator, stream: dict) -> tuple:
+    recorder = StepTimingRecorder(capacity=len(stream["displacements"]))
+    navigator.model.particle_filter.add_timing_hook(recorder)
+    durations = []
+    for displacement, impedance in zip(stream["displacements"], stream["impedances"]):
+        start = time.perf_counter()
+        navigator.update_step(displacement=displacement, impedance=impedance)
+        durations.append(time.perf_counter() - start)
+    navigator.model.particle_filter.remove_timing_hook(recorder)
+    return recorder.summary(percentiles=(50, 95, 100)), summarize(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="per-stage benchmark of the particle filter on synthetic data")
+    parser.add_argument("--particles", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--measurement-types", nargs="+", default=["AHISTORIC", "SLIDING_DTW"],
+                        choices=[measurement_type.name for measurement_type in MeasurementType])
+    parser.add_argument("--particle-set-types", nargs="+", default=["ARRAY"],
+                        choices=[particle_set_type.name for particle_set_type in ParticleSetType])
+    parser.add_argument("--dtw-engine", default="BATCHED", choices=[engine.name for engine in DTWEngine])
+    parser.add_argument("--vessels", type=int, default=15)
+    parser.add_argument("--branching-factor", type=int, default=2)
+    parser.add_argument("--vessel-length", type=int, default=80)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1],
+                        help="numbers of worker processes of the sharded particle filter, 1 runs the serial filter")
+    parser.add_argument("--weighting-executor", default="SERIAL",
+                        choices=[executor_type.name for executor_type in WeightingExecutorType])
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="pipeline_benchmark.json")
+    arguments = parser.parse_args()
+
+    generator = np.random.default_rng(arguments.seed)
+    map3D = generate_vessel_tree(arguments.vessels, arguments.branching_factor, arguments.vessel_length, generator)
+    stream = generate_measurement_stream(map3D, arguments.steps, generator)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        map_path = save_vessel_tree(map3D, directory)
+        for measurement_type in arguments.measurement_types:
+            for particle_set_type in arguments.particle_set_types:
+                for number_of_particles, number_of_shards in itertools.product(arguments.particles,
+                                                                               arguments.shards):
+                    if number_of_shards > 1 and particle_set_type != ParticleSetType.ARRAY.name:
+                        continue
+                    configuration = [directory + "/", MeasurementType[measurement_type],
+                                     ParticleSetType[particle_set_type], DTWEngine[arguments.dtw_engine],
+                                     number_of_particles, arguments.seed, number_of_shards,
+                                     WeightingExecutorType[arguments.weighting_executor]]
+                    navigator = setup_navigator(map_path, *configuration)
+                    stages, update_step = time_update_steps(navigator, stream)
+                    navigator.close()
+                    particles_per_second = number_of_particles / update_step["mean_ms"] * 1000
+                    results.append({"measurement_type": measurement_type,
+                                    "particle_set_type": particle_set_type,
+                                    "number_of_particles": number_of_particles,
+                                    "number_of_shards": number_of_shards,
+                                    "particles_per_second": particles_per_second,
+                                    "stages": stages,
+                                    "update_step": update_step})
+                    print(f'{measurement_type:>12} {particle_set_type:>7} {number_of_particles:>8} particles '
+                          f'{number_of_shards:>2} shards: '
+                          + " | ".join(f'{stage} {stages[stage]["p50_ms"]:.2f}' for stage in FILTER_STAGES)
+                          + f' | update_step {update_step["p50_ms"]:.2f} ms | {particles_per_second:.0f} particles/s')
+
+    report = {"timestamp": datetime.datetime.now().isoformat(),
+              "platform": platform.platform(),
+              "python": platform.python_version(),
+              "numpy": np.__version__,
+              "configuration": vars(arguments),
+              "results": results}
+    with open(arguments.output, "w") as outfile:
+        json.dump(report, outfile, indent=4)
+
+
+if __name__ == "__main__":
+    main()
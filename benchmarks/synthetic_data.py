@@ -0,0 +1,67 @@
+import json
+import os
+
+import numpy as np
+
+from utils.map3D import Map3D
+
+"""
+Synthetic vessel trees and sensor streams for the benchmarks.
+The vessel tree is built breadth first: vessel 0 is the root and every vessel receives branching_factor successors
+until the requested number of vessels is reached. Each vessel holds a smooth random impedance reference sampled per
+millimeter. The sensor stream follows a catheter that advances through the tree from the root, choosing a random
+successor at every bifurcation, and records the scaled displacement and the noisy reference at its true position.
+"""
+
+
+def generate_vessel_tree(number_of_vessels: int,
+                         branching_factor: int,
+                         vessel_length: int,
+                         generator: np.random.Generator) -> Map3D:
+    if number_of_vessels < 1 or branching_factor < 1 or vessel_length < 2:
+        raise ValueError("a vessel tree needs at least one vessel, one successor per vessel and two samples per vessel")
+    map3D = Map3D()
+    for index in range(number_of_vessels):
+        length = int(generator.integers(vessel_length // 2, vessel_length * 3 // 2 + 1))
+        positions = np.arange(max(length, 2))
+        frequencies = generator.uniform(0.01, 0.1, size=3)
+        phases = generator.uniform(0, 2 * np.pi, size=3)
+        reference = 5 + np.sum(np.sin(np.outer(positions, frequencies) + phases), axis=1) \
+            + generator.normal(scale=0.05, size=len(positions))
+        map3D.add_vessel_impedance_prediction_as_millimeter_list([float(value) for value in reference], index)
+    for index in range(1, number_of_vessels):
+        map3D.add_mapping([(index - 1) // branching_factor, index])
+    return map3D
+
+
+def save_vessel_tree(map3D: Map3D, directory: str, filename: str = "synthetic_map") -> str:
+    path = os.path.join(directory, filename + ".json")
+    with open(path, "w") as outfile:
+        json.dump({"vessels": map3D.get_vessels(), "mappings": map3D.get_mappings()}, outfile)
+    return path
+
+
+def generate_measurement_stream(map3D: Map3D,
+                                number_of_steps: int,
+                                generator: np.random.Generator,
+                                step_length: float = 1.0,
+                                alpha: float = 2.0,
+                                displacement_noise: float = 0.05,
+                                impedance_noise: float = 0.05) -> dict:
+    """
+    @return: displacement and impedance measurements as well as the true branch and displacement of each step
+    """
+    branch, displacement = 0, 0.0
+    stream = {name: np.empty(number_of_steps) for name in
+              ["displacements", "impedances", "true_branches", "true_displacements"]}
+    for step in range(number_of_steps):
+        displacement += step_length
+        while displacement > map3D.get_vessel_lengths()[branch] and map3D.get_indices_of_successors(branch):
+            displacement -= map3D.get_vessel_lengths()[branch]
+            branch = int(generator.choice(map3D.get_indices_of_successors(branch)))
+        stream["displacements"][step] = step_length / alpha + generator.normal(scale=displacement_noise)
+        stream["impedances"][step] = map3D.get_reference_value(branch, displacement) \
+            + generator.normal(scale=impedance_noise)
+        stream["true_branches"][step] = branch
+        stream["true_displacements"][step] = displacement
+    return stream
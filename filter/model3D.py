@@ -1,5 +1,6 @@
 from filter.model_interface import ModelInterface
 from filter.particle_filter import ParticleFilter
+from filter.sharded_particle_filter import ShardedParticleFilter
 from injectors.alpha_variance_injector import AlphaVariationInjector
 from injectors.random_particle_injector import RandomParticleInjector3D
 from measurement_models.ahistoric_measurement_model import AhistoricMeasurementModel3D
@@ -8,79 +9,206 @@ from measurement_models.sliding_dtw_measurement_model import SlidingCombinedDeri
 from motion_models.motion_model import MotionModel3D
 from particles.particle import Particle3D, SlidingParticle3D
 from particles.state import State3D
+from resamplers.kld_resampler import KLDResampler
 from resamplers.low_variance_resampler import LowVarianceResampler
+from utils.array_particle_set import ArrayParticleSet
 from utils.map3D import Map3D
-from utils.particle_filter_component_enums import MeasurementType, InjectorType
+from utils.particle_filter_component_enums import MeasurementType, InjectorType, ParticleSetType, DTWEngine, \
+    ResamplerType, WeightingMode, ClusteringMethod, WeightingExecutorType
+from utils.gap_clustering import GapClustering1D
+from utils.reference_cache import ReferenceCache
+from utils.weighting_executor import WeightingExecutor
 from utils.particle_set import ParticleSet
 from utils.position import Position3D
 from utils.position_estimate import PositionEstimate, ClusterPositionEstimate3D
 from scipy.stats import sem
 from statistics import mean
 import logging
+import time
 
 
 class Model3D(ModelInterface):
     def setup_particle_filter(self, map_path: str,
                               measurement_model: MeasurementType,
                               injector_type: InjectorType,
-                              alpha_center: float):
-        map3D = Map3D()
-        map3D.load_map(map_path)
+                              alpha_center: float,
+                              dtw_engine: DTWEngine = DTWEngine.TSLEARN,
+                              sakoe_chiba_radius: int = None,
+                              history_length: int = 20,
+                              resampling_threshold: float = None,
+                              resampler_type: ResamplerType = ResamplerType.LOW_VARIANCE,
+                              min_number_of_particles: int = 100,
+                              max_number_of_particles: int = 10_000,
+                              weighting_mode: WeightingMode = WeightingMode.INVERSE,
+                              likelihood_scale: float = 1.0,
+                              injection_fraction: float = 0.05,
+                              map3D: Map3D = None,
+                              seed=None,
+                              number_of_shards: int = 1,
+                              exchange_interval: int = 10,
+                              exchange_fraction: float = 0.05,
+                              weighting_executor: WeightingExecutorType = WeightingExecutorType.SERIAL,
+                              number_of_weighting_workers: int = None,
+                              reference_cache_resolution: float = None):
+        if map3D is None:
+            map3D = Map3D()
+            map3D.load_map(map_path)
 
         if injector_type == InjectorType.ALPHA_VARIANCE:
-            injection_strategy = AlphaVariationInjector(alpha_center=alpha_center)
+            injection_strategy = AlphaVariationInjector(alpha_center=alpha_center,
+                                                        injection_fraction=injection_fraction)
             logging.info("injector: alpha variance")
         elif injector_type == InjectorType.RANDOM_PARTICLE:
-            injection_strategy = RandomParticleInjector3D(map3D)
+            injection_strategy = RandomParticleInjector3D(map3D, injection_fraction=injection_fraction)
             logging.info("injector: random particle")
         else:
             raise ValueError("Select a valid injection strategy: alpha variance or random particle")
 
         if measurement_model == MeasurementType.AHISTORIC:
-            measurement_strategy = AhistoricMeasurementModel3D(map3D=map3D)
+            measurement_strategy = AhistoricMeasurementModel3D(map3D=map3D,
+                                                               weighting_mode=weighting_mode,
+                                                               likelihood_scale=likelihood_scale)
             logging.info("measurement model: ahistoric")
         elif measurement_model == MeasurementType.SLIDING_DTW:
-            measurement_strategy = SlidingCombinedDerivativeDTWMeasurementModel3D(map3D=map3D)
+            measurement_strategy = SlidingCombinedDerivativeDTWMeasurementModel3D(
+                map3D=map3D, dtw_engine=dtw_engine, sakoe_chiba_radius=sakoe_chiba_radius,
+                history_length=history_length, weighting_mode=weighting_mode, likelihood_scale=likelihood_scale)
             logging.info("measurement model: sliding_dtw")
         else:
             raise ValueError("Select a valid measurement strategy: ahistoric or sliding dtw")
+        if reference_cache_resolution is not None:
+            # the cache belongs to this model, a map shared with other models is left unchanged
+            measurement_strategy.set_reference_cache(ReferenceCache(resolution=reference_cache_resolution))
+            logging.info("reference cache with a resolution of " + str(reference_cache_resolution) + " mm")
+        if weighting_executor != WeightingExecutorType.SERIAL:
+            measurement_strategy.set_weighting_executor(
+                WeightingExecutor(executor_type=weighting_executor, number_of_workers=number_of_weighting_workers))
+            logging.info("weighting executor: " + weighting_executor.name.lower())
         motion_model = MotionModel3D(map3D=map3D)
-        resampling_strategy = LowVarianceResampler()
+        if resampler_type == ResamplerType.LOW_VARIANCE:
+            resampling_strategy = LowVarianceResampler()
+            logging.info("resampler: low variance")
+        elif resampler_type == ResamplerType.KLD:
+            resampling_strategy = KLDResampler(min_number_of_particles=min_number_of_particles,
+                                               max_number_of_particles=max_number_of_particles)
+            logging.info("resampler: KLD sampling with " + str(min_number_of_particles)
+                         + " to " + str(max_number_of_particles) + " particles")
+        else:
+            raise ValueError("Select a valid resampling strategy: low variance or KLD")
+        if number_of_shards > 1:
+            if map_path is None:
+                raise ValueError("The shards of the sharded particle filter load the map from the map path")
+            filter_config = dict(map_path=map_path, measurement_model=measurement_model, injector_type=injector_type,
+                                 alpha_center=alpha_center, dtw_engine=dtw_engine,
+                                 sakoe_chiba_radius=sakoe_chiba_radius, history_length=history_length,
+                                 resampler_type=resampler_type, weighting_mode=weighting_mode,
+                                 likelihood_scale=likelihood_scale, injection_fraction=injection_fraction,
+                                 reference_cache_resolution=reference_cache_resolution)
+            self.particle_filter = ShardedParticleFilter(motion_model=motion_model,
+                                                         measurement_strategy=measurement_strategy,
+                                                         resampler=resampling_strategy,
+                                                         injector=injection_strategy,
+                                                         filter_config=filter_config,
+                                                         number_of_shards=number_of_shards,
+                                                         exchange_interval=exchange_interval,
+                                                         exchange_fraction=exchange_fraction,
+                                                         resampling_threshold=resampling_threshold,
+                                                         seed=seed)
+            logging.info("sharded particle filter: " + str(number_of_shards) + " shards")
+            return
         self.particle_filter = ParticleFilter(motion_model=motion_model,
                                               measurement_strategy=measurement_strategy,
                                               resampler=resampling_strategy,
-                                              injector=injection_strategy)
+                                              injector=injection_strategy,
+                                              resampling_threshold=resampling_threshold,
+                                              seed=seed)
 
     def setup_particles(self, number_of_particles: int,
                         initial_position_center: float = 0.0,
                         initial_position_variance: float = 0.0,
                         alpha_center: float = 2.0,
                         alpha_variance: float = 0.1,
-                        initial_branch: int = 0):
+                        initial_branch: int = 0,
+                        particle_set_type: ParticleSetType = ParticleSetType.OBJECT):
         if self.particle_filter is None:
             raise ValueError("You must setup the particle filter before choosing the number of particles")
         self.particles = ParticleSet()
         logging.info("Number of particles = " + str(number_of_particles))
         logging.info("initial position =  " + str(initial_position_center) + " +/- " + str(initial_position_variance))
         logging.info("alpha = " + str(alpha_center) + " +/- " + str(alpha_variance) + "\n\n")
-        if isinstance(self.particle_filter.measurement_strategy, AhistoricMeasurementModel3D):
+        if isinstance(self.particle_filter, ShardedParticleFilter):
+            if particle_set_type != ParticleSetType.ARRAY:
+                raise ValueError("The sharded particle filter requires the array particle set")
+            self.particles = self.particle_filter.setup_particles(number_of_particles=number_of_particles,
+                                                                  initial_position_center=initial_position_center,
+                                                                  initial_position_variance=initial_position_variance,
+                                                                  alpha_center=alpha_center,
+                                                                  alpha_variance=alpha_variance,
+                                                                  initial_branch=initial_branch)
+            return
+        if particle_set_type == ParticleSetType.ARRAY:
+            self.particles = ArrayParticleSet.from_prior(
+                number_of_particles=number_of_particles,
+                initial_position_center=initial_position_center,
+                initial_position_variance=initial_position_variance,
+                alpha_center=alpha_center,
+                alpha_variance=alpha_variance,
+                initial_branch=initial_branch,
+                sliding=isinstance(self.particle_filter.measurement_strategy, SlidingDTWMeasurementModel3D),
+                history_length=getattr(self.particle_filter.measurement_strategy, "history_length", 20),
+                random_generator=self.particle_filter.random_generator)
+        elif isinstance(self.particle_filter.measurement_strategy, AhistoricMeasurementModel3D):
             for _ in range(number_of_particles):
                 state = State3D()
                 state.set_branch(initial_branch)
-                state.assign_random_position(center=initial_position_center, variance=initial_position_variance)
-                state.assign_random_alpha(center=alpha_center, variance=alpha_variance)
+                state.assign_random_position(center=initial_position_center, variance=initial_position_variance,
+                                             random_generator=self.particle_filter.random_generator)
+                state.assign_random_alpha(center=alpha_center, variance=alpha_variance,
+                                          random_generator=self.particle_filter.random_generator)
                 particle = Particle3D(state=state, weight=0)
                 self.particles.append(particle)
         elif isinstance(self.particle_filter.measurement_strategy, SlidingDTWMeasurementModel3D):
             for _ in range(number_of_particles):
                 state = State3D()
                 state.set_branch(initial_branch)
-                state.assign_random_position(center=initial_position_center, variance=initial_position_variance)
-                state.assign_random_alpha(center=alpha_center, variance=alpha_variance)
+                state.assign_random_position(center=initial_position_center, variance=initial_position_variance,
+                                             random_generator=self.particle_filter.random_generator)
+                state.assign_random_alpha(center=alpha_center, variance=alpha_variance,
+                                          random_generator=self.particle_filter.random_generator)
                 particle = SlidingParticle3D(state=state, weight=0)
                 self.particles.append(particle)
 
+    def get_reference_cache_statistics(self) -> dict:
+        if self.particle_filter is None or self.particle_filter.measurement_strategy.reference_cache is None:
+            return {}
+        return self.particle_filter.measurement_strategy.reference_cache.get_statistics()
+
+    def close(self) -> None:
+        """
+        releases the worker pools and shared memory of the weighting executor and the shard workers of a sharded
+        particle filter
+        """
+        if self.particle_filter is None:
+            return
+        self.particle_filter.measurement_strategy.weighting_executor.close()
+        if isinstance(self.particle_filter, ShardedParticleFilter):
+            self.particles = None
+            self.particle_filter.close()
+
     def estimate_current_position(self) -> PositionEstimate:
+        start = time.perf_counter()
+        if self.clustering_method == ClusteringMethod.GAP_1D:
+            position_estimate = self.estimate_current_position_by_gap_clustering()
+        else:
+            position_estimate = self.estimate_current_position_by_dbscan()
+        if self.particle_filter is not None:
+            self.particle_filter.record_stage_duration("estimation", time.perf_counter() - start)
+            self.particle_filter.end_timing_step()
+        if self.step_recorder is not None:
+            self.step_recorder.record_estimate(position_estimate)
+        return position_estimate
+
+    def estimate_current_position_by_dbscan(self) -> PositionEstimate:
         position_estimate = ClusterPositionEstimate3D()
         particles_per_branch = {}
         for particle in self.particles:
@@ -97,3 +225,17 @@ class Model3D(ModelInterface):
                                                          number_of_particles=len(clusters[i]),
                                                          branch=key))
         return position_estimate
+
+    def estimate_current_position_by_gap_clustering(self) -> PositionEstimate:
+        if isinstance(self.particles, ArrayParticleSet):
+            branches, displacements = self.particles.branches, self.particles.displacements
+        else:
+            branches = [particle.state.branch for particle in self.particles]
+            displacements = [particle.state.position for particle in self.particles]
+        position_estimate = ClusterPositionEstimate3D()
+        for branch, center, error, size in zip(*GapClustering1D(eps=3).cluster(branches, displacements)):
+            position_estimate.add_cluster(Position3D(center=float(center),
+                                                     error=float(error),
+                                                     number_of_particles=int(size),
+                                                     branch=int(branch)))
+        return position_estimate
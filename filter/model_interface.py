@@ -1,33 +1,61 @@
 from abc import abstractmethod
 import logging
 from collections import OrderedDict
-from statistics import mean
 import numpy as np
 from sklearn.cluster import DBSCAN
 from filter.particle_filter import ParticleFilter
+from utils.map3D import Map3D
 from utils.position_estimate import PositionEstimate
-from utils.particle_filter_component_enums import MeasurementType, InjectorType
+from utils.particle_filter_component_enums import MeasurementType, InjectorType, ParticleSetType, DTWEngine, \
+    ResamplerType, WeightingMode, ClusteringMethod, WeightingExecutorType
+from utils.array_particle_set import ArrayParticleSet
 from utils.particle_set import ParticleSet
+from utils.step_recorder import StepRecorder
+from utils.streaming_statistics import RunningStatistics
 
 
 class ModelInterface:
     def __init__(self, particle_filter: ParticleFilter = None,
-                 particles: ParticleSet = None) -> None:
+                 particles: ParticleSet = None,
+                 clustering_method: ClusteringMethod = ClusteringMethod.GAP_1D) -> None:
 
         self.particle_filter = particle_filter
         self.particles = particles
+        self.clustering_method = clustering_method
+        self.step_recorder = None
 
         self.update_steps = 1
 
     def reset_model(self):
         self.update_steps = 1
 
+    def set_step_recorder(self, step_recorder: StepRecorder = None) -> None:
+        self.step_recorder = step_recorder
+
     @abstractmethod
     def setup_particle_filter(self,
                               map_path: str,
                               measurement_model: MeasurementType,
                               injector_type: InjectorType,
-                              alpha_center: float
+                              alpha_center: float,
+                              dtw_engine: DTWEngine = DTWEngine.TSLEARN,
+                              sakoe_chiba_radius: int = None,
+                              history_length: int = 20,
+                              resampling_threshold: float = None,
+                              resampler_type: ResamplerType = ResamplerType.LOW_VARIANCE,
+                              min_number_of_particles: int = 100,
+                              max_number_of_particles: int = 10_000,
+                              weighting_mode: WeightingMode = WeightingMode.INVERSE,
+                              likelihood_scale: float = 1.0,
+                              injection_fraction: float = 0.05,
+                              map3D: Map3D = None,
+                              seed=None,
+                              number_of_shards: int = 1,
+                              exchange_interval: int = 10,
+                              exchange_fraction: float = 0.05,
+                              weighting_executor: WeightingExecutorType = WeightingExecutorType.SERIAL,
+                              number_of_weighting_workers: int = None,
+                              reference_cache_resolution: float = None
                               ):
         raise NotImplementedError
 
@@ -38,7 +66,8 @@ class ModelInterface:
                         initial_position_variance: float = 0.0,
                         alpha_center: float = 2.0,
                         alpha_variance: float = 0.1,
-                        initial_branch: int = 0):
+                        initial_branch: int = 0,
+                        particle_set_type: ParticleSetType = ParticleSetType.OBJECT):
         raise NotImplementedError
 
     @staticmethod
@@ -67,9 +96,16 @@ class ModelInterface:
             previous_particle_set=self.particles,
             displacement_measurement=displacement,
             impedance_measurement=impedance)
-        for particle in self.particles:
-            logging.debug("UpdatedParticle: " + str(particle))
+        if self.step_recorder is not None:
+            self.step_recorder.record_step(step=self.update_steps,
+                                           particles=self.particles,
+                                           displacement_measurement=displacement,
+                                           impedance_measurement=impedance,
+                                           effective_sample_size=self.particle_filter.effective_sample_size,
+                                           resampled=self.particle_filter.resampled)
         logging.info("Number of Particles: " + str(len(self.particles)))
+        logging.info("Effective sample size: " + str(self.particle_filter.effective_sample_size)
+                     + " | resampled: " + str(self.particle_filter.resampled))
         self.update_steps += 1
 
     @staticmethod
@@ -85,10 +121,9 @@ class ModelInterface:
         return self.particles
 
     def get_current_average_alpha(self) -> float:
-        alphas = []
-        for particle in self.particles:
-            alphas.append(particle.state.alpha)
-        return mean(alphas)
+        if isinstance(self.particles, ArrayParticleSet):
+            return float(np.mean(self.particles.alphas))
+        return RunningStatistics.from_values(particle.state.alpha for particle in self.particles).get_mean()
 
     def calculate_clusters_in_particle_set(self, positions) -> OrderedDict:
         reshaped_positions = np.reshape(positions, (-1, 1))
@@ -1,8 +1,12 @@
+import time
+import numpy as np
 from strategies.injection_strategy import InjectionStrategy
 from strategies.measurement_strategy import MeasurementStrategy
 from strategies.motion_strategy import MotionStrategy
 from strategies.resampling_strategy import ResamplingStrategy
 from utils.particle_set import ParticleSet
+from utils.random_streams import spawn_seeds
+from utils.timing_hooks import TimingHook
 
 """
 The ParticleFilter class actualizes the particle estimates with the sensor information.
@@ -10,6 +14,15 @@ The filter method expects the previous particle set and a displacement as well a
 measurement. The filter then applies the motion model and the measurement model to the particles,
 resamples the particles with the specified resampling strategy, and finally injects particles with
 the selected injection strategy.
+After weighting, the filter calculates the effective sample size (ESS) of the particle set. If a resampling
+threshold is given, the particles are only resampled and injected when the ESS falls below this fraction of
+the number of particles. Otherwise, the weights are carried forward and multiplied with the weights of the next
+measurement. After resampling, all particles carry the same weight.
+All random numbers are drawn from numpy Generators seeded from the seed of the filter: the random_generator of the
+filter serves the initial particles, and the motion model, the resampler and the injector each receive an independent
+child stream, so a run with a given seed is bit-reproducible.
+Timing hooks added with add_timing_hook receive the wall time of the motion, weighting, resampling and injection
+stages of each step. The stages are only timed while at least one hook is attached.
 """
 
 
@@ -18,27 +31,126 @@ class ParticleFilter:
                  motion_model: MotionStrategy,
                  measurement_strategy: MeasurementStrategy,
                  resampler: ResamplingStrategy,
-                 injector: InjectionStrategy) -> None:
+                 injector: InjectionStrategy,
+                 resampling_threshold: float = None,
+                 seed=None) -> None:
+        if resampling_threshold is not None and not 0 < resampling_threshold <= 1:
+            raise ValueError("resampling threshold must be a fraction of the number of particles in (0, 1]")
         self.motion_model = motion_model
         self.measurement_strategy = measurement_strategy
         self.resampler = resampler
         self.injector = injector
+        self.resampling_threshold = resampling_threshold
+        particle_seed, motion_seed, resampling_seed, injection_seed = spawn_seeds(seed, 4)
+        self.random_generator = np.random.default_rng(particle_seed)
+        self.motion_model.set_random_generator(np.random.default_rng(motion_seed))
+        self.resampler.set_random_generator(np.random.default_rng(resampling_seed))
+        self.injector.set_random_generator(np.random.default_rng(injection_seed))
+        self.effective_sample_size = 0.0
+        self.resampled = False
+        self.number_of_steps = 0
+        self.number_of_resampling_steps = 0
+        self.timing_hooks = []
+        self.timing_step_open = False
+        self.timing_step_duration = 0.0
+        self.lap_start = 0.0
 
     def get_reference(self):
         return self.measurement_strategy.get_reference()
 
+    @staticmethod
+    def calculate_effective_sample_size(weights: np.ndarray) -> float:
+        squared_sum = np.sum(weights ** 2)
+        if squared_sum == 0:
+            return 0.0
+        return float(np.sum(weights) ** 2 / squared_sum)
+
+    @staticmethod
+    def carry_weights_forward(prior_weights: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        if not np.sum(prior_weights) > 0:
+            return weights
+        posterior_weights = prior_weights * weights
+        normalizer = np.sum(posterior_weights)
+        if not normalizer > 0:
+            return weights
+        return posterior_weights / normalizer
+
+    def get_resampling_rate(self) -> float:
+        if self.number_of_steps == 0:
+            return 0.0
+        return self.number_of_resampling_steps / self.number_of_steps
+
+    def add_timing_hook(self, hook: TimingHook) -> None:
+        self.timing_hooks.append(hook)
+
+    def remove_timing_hook(self, hook: TimingHook) -> None:
+        self.end_timing_step()
+        self.timing_hooks.remove(hook)
+
+    def begin_timing_step(self) -> None:
+        self.end_timing_step()
+        self.timing_step_open = True
+        self.timing_step_duration = 0.0
+        for hook in self.timing_hooks:
+            hook.begin_step(self.number_of_steps)
+        self.lap_start = time.perf_counter()
+
+    def record_stage_duration(self, stage: str, duration: float) -> None:
+        if not self.timing_step_open:
+            return
+        self.timing_step_duration += duration
+        for hook in self.timing_hooks:
+            hook.record_stage(stage, duration)
+
+    def end_timing_step(self) -> None:
+        if not self.timing_step_open:
+            return
+        self.timing_step_open = False
+        for hook in self.timing_hooks:
+            hook.end_step(self.timing_step_duration)
+
+    def lap(self, stage: str) -> None:
+        if not self.timing_step_open:
+            return
+        now = time.perf_counter()
+        self.record_stage_duration(stage, now - self.lap_start)
+        self.lap_start = now
+
     def filter(self,
                previous_particle_set: ParticleSet,
                displacement_measurement: float,
                impedance_measurement: float) -> ParticleSet:
+        if self.timing_hooks:
+            self.begin_timing_step()
         prediction_particle_set = self.motion_model.move_particles(
             previous_particle_set=previous_particle_set,
             displacement_measurement=displacement_measurement)
+        self.lap("motion")
+
+        if self.resampling_threshold is not None:
+            prior_weights = prediction_particle_set.get_weights().copy()
 
         weighted_particle_set = self.measurement_strategy.weight_particles(
             particles=prediction_particle_set,
             measurement=impedance_measurement)
 
+        if self.resampling_threshold is not None:
+            weighted_particle_set.set_weights(self.carry_weights_forward(prior_weights,
+                                                                         weighted_particle_set.get_weights()))
+        self.lap("weighting")
+
+        self.number_of_steps += 1
+        self.effective_sample_size = self.calculate_effective_sample_size(weighted_particle_set.get_weights())
+        self.resampled = self.resampling_threshold is None \
+            or self.effective_sample_size < self.resampling_threshold * len(weighted_particle_set)
+        if not self.resampled:
+            return weighted_particle_set
+        self.number_of_resampling_steps += 1
+
         resampled_particle_set = self.resampler.resample(weighted_particle_set)
+        self.lap("resampling")
         injected_particle_set = self.injector.inject(resampled_particle_set)
+        self.lap("injection")
+        if self.resampling_threshold is not None:
+            injected_particle_set.set_weights(np.full(len(injected_particle_set), 1 / len(injected_particle_set)))
         return injected_particle_set
@@ -0,0 +1,389 @@
+import multiprocessing
+import traceback
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from filter.particle_filter import ParticleFilter
+from measurement_models.sliding_dtw_measurement_model import SlidingDTWMeasurementModel3D
+from resamplers.low_variance_resampler import LowVarianceResampler
+from strategies.injection_strategy import InjectionStrategy
+from strategies.measurement_strategy import MeasurementStrategy
+from strategies.motion_strategy import MotionStrategy
+from strategies.resampling_strategy import ResamplingStrategy
+from utils.array_particle_set import ArrayParticleSet
+from utils.history_buffer import HistoryBuffer
+from utils.particle_set import ParticleSet
+from utils.random_streams import spawn_seeds
+
+"""
+The ShardedParticleFilter splits the particle population into shards, each owned by one worker process, so the
+motion and measurement stages of very large particle sets run on all cores. The branch, displacement, alpha and
+weight columns of all particles are stored in one shared memory block; every worker steps its slice of the
+columns in place, and the coordinator reads the whole population without copying it.
+
+An update step runs in up to three phases:
+- weighting: each worker moves its particles, weights them and multiplies the weights with the weights carried from
+  the previous step. It returns the logarithm of the unnormalized weight mass of its shard, from which the
+  coordinator normalizes the weights of all shards globally and calculates the global effective sample size.
+- exchange: every exchange_interval steps, each shard passes its best particles to the next shard in a ring, where
+  they replace the worst particles. The migrant and its original split the weight of the original, so shards whose
+  particles lost track of the catheter recover without a global resampling.
+- resampling: if the filter resamples, each worker resamples its shard locally with the low variance resampler and
+  injects particles. The particles of a shard then carry equal weights that sum to the mass of the shard, so the
+  shards keep their relative weight until the next step.
+The seed of the filter is split into independent child seeds for the workers, so a seeded run is reproducible for a
+given number of shards. A single worker receives the seed of the filter itself and reproduces the ParticleFilter
+with the same seed. The workers build their strategies from the same configuration as Model3D, and the motion
+stage is timed as part of the weighting stage.
+"""
+
+PARTICLE_COLUMNS = [("branches", np.int64), ("displacements", np.float64), ("alphas", np.float64),
+                    ("weights", np.float64)]
+
+
+class SharedParticleColumns:
+    """
+    @param number_of_particles: number of particles of all shards
+    @param history_length: length of the reference histories stored with the particles, None without histories
+    @param name: name of an existing shared memory block to attach to, None creates a new block
+    """
+
+    def __init__(self, number_of_particles: int, history_length: int = None, name: str = None) -> None:
+        self.number_of_particles = number_of_particles
+        self.history_length = history_length
+        layout = [(column, dtype, (number_of_particles,)) for column, dtype in PARTICLE_COLUMNS]
+        if history_length is not None:
+            layout += [("history_data", np.float64, (number_of_particles, 2 * history_length)),
+                       ("history_lengths", np.int64, (number_of_particles,))]
+        size = sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for _, dtype, shape in layout)
+        self.shared_memory = shared_memory.SharedMemory(name=name, create=name is None, size=max(size, 1))
+        self.columns = []
+        offset = 0
+        for column, dtype, shape in layout:
+            setattr(self, column, np.ndarray(shape, dtype=dtype, buffer=self.shared_memory.buf, offset=offset))
+            self.columns.append(column)
+            offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+    def get_name(self) -> str:
+        return self.shared_memory.name
+
+    def get_particle_set(self, start: int = 0, stop: int = None,
+                         reference_histories: HistoryBuffer = None) -> ArrayParticleSet:
+        return ArrayParticleSet.from_columns(branches=self.branches[start:stop],
+                                             displacements=self.displacements[start:stop],
+                                             alphas=self.alphas[start:stop],
+                                             weights=self.weights[start:stop],
+                                             reference_histories=reference_histories)
+
+    def copy_rows(self, source_indices: np.ndarray, destination_indices: np.ndarray) -> None:
+        for column in self.columns:
+            values = getattr(self, column)
+            values[destination_indices] = values[source_indices]
+
+    def close(self, unlink: bool = False) -> None:
+        for column in self.columns:
+            setattr(self, column, None)
+        try:
+            self.shared_memory.close()
+        except BufferError:
+            # particle sets handed out by get_particle_set still reference the block, it is unmapped once they are
+            # garbage collected
+            pass
+        if unlink:
+            self.shared_memory.unlink()
+
+
+class ShardWorker:
+    """
+    @param filter_config: arguments of Model3D.setup_particle_filter for the strategies of the shard
+    @param seed: seed of the strategies of the shard
+    """
+
+    def __init__(self, filter_config: dict, seed) -> None:
+        from filter.model3D import Model3D
+        model = Model3D()
+        model.setup_particle_filter(**filter_config, seed=seed)
+        self.particle_filter = model.particle_filter
+        self.columns = None
+        self.start = 0
+        self.stop = 0
+        self.reference_histories = None
+
+    def initialize(self, name: str, number_of_particles: int, start: int, stop: int, history_length: int,
+                   prior: dict) -> None:
+        if self.columns is not None:
+            self.columns.close()
+        self.columns = SharedParticleColumns(number_of_particles, history_length=history_length, name=name)
+        self.start = start
+        self.stop = stop
+        particles = ArrayParticleSet.from_prior(number_of_particles=stop - start,
+                                                sliding=history_length is not None,
+                                                history_length=history_length or 20,
+                                                random_generator=self.particle_filter.random_generator,
+                                                **prior)
+        particles.weights = np.full(stop - start, 1 / number_of_particles)
+        self.store_particles(particles)
+
+    def get_particles(self) -> ArrayParticleSet:
+        return self.columns.get_particle_set(self.start, self.stop, self.reference_histories)
+
+    def store_particles(self, particles: ArrayParticleSet) -> None:
+        for column, _ in PARTICLE_COLUMNS:
+            getattr(self.columns, column)[self.start:self.stop] = getattr(particles, column)
+        self.reference_histories = particles.reference_histories
+
+    def weight(self, displacement_measurement: float, impedance_measurement: float) -> float:
+        particles = self.get_particles()
+        prior_weights = particles.weights.copy()
+        particles = self.particle_filter.motion_model.move_particles(
+            previous_particle_set=particles,
+            displacement_measurement=displacement_measurement)
+        measurement_strategy = self.particle_filter.measurement_strategy
+        particles = measurement_strategy.raw_weight_particles(particles=particles, measurement=impedance_measurement)
+        log_normalizer = measurement_strategy.calculate_log_normalizer(particles.weights)
+        weights = measurement_strategy.calculate_weights(particles.weights)
+        posterior_weights = prior_weights * weights
+        mass = np.sum(posterior_weights)
+        if mass > 0 and np.isfinite(log_normalizer):
+            particles.weights = posterior_weights / mass
+            log_mass = log_normalizer + float(np.log(mass))
+        else:
+            particles.weights = weights
+            log_mass = -np.inf
+        self.store_particles(particles)
+        return log_mass
+
+    def calculate_ancestor_indices(self, weights: np.ndarray) -> np.ndarray:
+        number_of_particles = len(weights)
+        random_root = self.particle_filter.resampler.get_random_generator().uniform(0, 1 / number_of_particles)
+        ancestor_indices = LowVarianceResampler.calculate_ancestor_indices(weights, random_root)
+        if len(ancestor_indices) < number_of_particles:
+            # pointers beyond the rounded cumulative weights belong to the last particle, the shard keeps its size
+            ancestor_indices = np.append(ancestor_indices[:-1],
+                                         np.full(number_of_particles - len(ancestor_indices) + 1,
+                                                 number_of_particles - 1))
+        return ancestor_indices
+
+    def resample(self) -> None:
+        particles = self.get_particles()
+        mass = float(np.sum(particles.weights))
+        if mass > 0:
+            particles.weights = particles.weights / mass
+        else:
+            particles.weights = np.full(len(particles), 1 / len(particles))
+        particles = particles.take(self.calculate_ancestor_indices(particles.weights))
+        particles = self.particle_filter.injector.inject(particles)
+        particles.weights = np.full(len(particles), mass / len(particles))
+        self.store_particles(particles)
+
+    def export_histories(self) -> None:
+        self.columns.history_data[self.start:self.stop] = self.reference_histories.data
+        self.columns.history_lengths[self.start:self.stop] = self.reference_histories.lengths
+
+    def import_histories(self) -> None:
+        self.reference_histories.data = self.columns.history_data[self.start:self.stop].copy()
+        self.reference_histories.lengths = self.columns.history_lengths[self.start:self.stop].copy()
+
+    def close(self) -> None:
+        if self.columns is not None:
+            self.columns.close()
+            self.columns = None
+
+
+class ShardError(Exception):
+    pass
+
+
+SHARD_COMMANDS = ["initialize", "weight", "resample", "export_histories", "import_histories"]
+
+
+def run_shard_worker(connection, filter_config: dict, seed) -> None:
+    try:
+        worker = ShardWorker(filter_config, seed)
+        connection.send(None)
+    except Exception:
+        connection.send(ShardError(traceback.format_exc()))
+        return
+    while True:
+        command, arguments = connection.recv()
+        if command not in SHARD_COMMANDS:
+            break
+        try:
+            connection.send(getattr(worker, command)(*arguments))
+        except Exception:
+            connection.send(ShardError(traceback.format_exc()))
+    worker.close()
+    connection.close()
+
+
+def stop_workers(connections: list, processes: list, columns: list) -> None:
+    for connection in connections:
+        try:
+            connection.send(("stop", ()))
+        except (BrokenPipeError, OSError):
+            pass
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+    for shared_columns in columns:
+        shared_columns.close(unlink=True)
+    columns.clear()
+
+
+class ShardedParticleFilter(ParticleFilter):
+    """
+    @param filter_config: arguments of Model3D.setup_particle_filter from which each worker builds its strategies
+    @param number_of_shards: number of worker processes, each owning one slice of the particles
+    @param exchange_interval: number of steps between two particle exchanges between the shards, None disables them
+    @param exchange_fraction: fraction of the particles of a shard passed to the next shard in an exchange
+    """
+
+    def __init__(self,
+                 motion_model: MotionStrategy,
+                 measurement_strategy: MeasurementStrategy,
+                 resampler: ResamplingStrategy,
+                 injector: InjectionStrategy,
+                 filter_config: dict,
+                 number_of_shards: int = 2,
+                 exchange_interval: int = 10,
+                 exchange_fraction: float = 0.05,
+                 resampling_threshold: float = None,
+                 seed=None) -> None:
+        if number_of_shards < 1:
+            raise ValueError("The number of shards must be at least 1")
+        if exchange_interval is not None and exchange_interval < 1:
+            raise ValueError("The exchange interval must be at least 1 step")
+        if not 0 <= exchange_fraction <= 0.5:
+            raise ValueError("exchange fraction must be between 0 and 0.5")
+        if not isinstance(resampler, LowVarianceResampler):
+            raise ValueError("The shards are resampled with the low variance resampler")
+        filter_seed, shard_seed = spawn_seeds(seed, 2)
+        super().__init__(motion_model=motion_model,
+                         measurement_strategy=measurement_strategy,
+                         resampler=resampler,
+                         injector=injector,
+                         resampling_threshold=resampling_threshold,
+                         seed=filter_seed)
+        self.number_of_shards = number_of_shards
+        self.exchange_interval = exchange_interval
+        self.exchange_fraction = exchange_fraction
+        self.history_length = measurement_strategy.history_length \
+            if isinstance(measurement_strategy, SlidingDTWMeasurementModel3D) else None
+        self.shared_columns = []
+        self.particles = None
+        self.shard_bounds = []
+        self.log_masses = np.zeros(number_of_shards)
+
+        context = multiprocessing.get_context()
+        # forked workers must share the resource tracker of this process, otherwise they report the columns as leaked
+        resource_tracker.ensure_running()
+        self.connections = []
+        self.processes = []
+        worker_seeds = [seed] if number_of_shards == 1 else spawn_seeds(shard_seed, number_of_shards)
+        for worker_seed in worker_seeds:
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=run_shard_worker, args=(worker_connection, filter_config, worker_seed),
+                                      daemon=True)
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+        self.finalizer = weakref.finalize(self, stop_workers, self.connections, self.processes, self.shared_columns)
+        self.receive_from_shards()
+
+    def receive_from_shards(self) -> list:
+        results = [connection.recv() for connection in self.connections]
+        for shard, result in enumerate(results):
+            if isinstance(result, ShardError):
+                raise RuntimeError("Shard " + str(shard) + " failed:\n" + str(result))
+        return results
+
+    def run_on_shards(self, command: str, arguments_per_shard: list = None) -> list:
+        for shard, connection in enumerate(self.connections):
+            connection.send((command, () if arguments_per_shard is None else arguments_per_shard[shard]))
+        return self.receive_from_shards()
+
+    def close(self) -> None:
+        self.particles = None
+        self.finalizer()
+
+    def setup_particles(self, number_of_particles: int, **prior) -> ArrayParticleSet:
+        """
+        draws the initial particles of each shard from the prior of ArrayParticleSet.from_prior
+        @return: particle set of all shards, a view onto the shared columns
+        """
+        if number_of_particles < self.number_of_shards:
+            raise ValueError("Each shard needs at least one particle")
+        for shared_columns in self.shared_columns:
+            shared_columns.close(unlink=True)
+        self.shared_columns.clear()
+        shared_columns = SharedParticleColumns(number_of_particles, history_length=self.history_length)
+        self.shared_columns.append(shared_columns)
+        bounds = np.linspace(0, number_of_particles, self.number_of_shards + 1).astype(int)
+        self.shard_bounds = list(zip(bounds[:-1], bounds[1:]))
+        self.run_on_shards("initialize", [(shared_columns.get_name(), number_of_particles, int(start), int(stop),
+                                           self.history_length, prior) for start, stop in self.shard_bounds])
+        self.particles = shared_columns.get_particle_set()
+        return self.particles
+
+    def normalize_shard_weights(self, log_masses: np.ndarray) -> None:
+        weights = self.particles.weights
+        maximum = np.max(log_masses)
+        if not np.isfinite(maximum):
+            weights[:] = 1 / len(weights)
+            return
+        shard_masses = np.exp(log_masses - maximum)
+        shard_masses /= np.sum(shard_masses)
+        for (start, stop), shard_mass in zip(self.shard_bounds, shard_masses):
+            weights[start:stop] *= shard_mass
+
+    def exchange_particles(self) -> None:
+        weights = self.particles.weights
+        number_of_migrants = int(self.exchange_fraction * min(stop - start for start, stop in self.shard_bounds))
+        if self.number_of_shards < 2 or number_of_migrants == 0:
+            return
+        sources, destinations = [], []
+        for shard, (start, stop) in enumerate(self.shard_bounds):
+            next_start, next_stop = self.shard_bounds[(shard + 1) % self.number_of_shards]
+            sources.append(start + np.argpartition(-weights[start:stop], number_of_migrants - 1)[:number_of_migrants])
+            destinations.append(next_start + np.argpartition(weights[next_start:next_stop],
+                                                             number_of_migrants - 1)[:number_of_migrants])
+        sources, destinations = np.concatenate(sources), np.concatenate(destinations)
+        if self.history_length is not None:
+            self.run_on_shards("export_histories")
+        weights[sources] /= 2
+        self.shared_columns[0].copy_rows(sources, destinations)
+        weights /= np.sum(weights)
+        if self.history_length is not None:
+            self.run_on_shards("import_histories")
+
+    def filter(self,
+               previous_particle_set: ParticleSet,
+               displacement_measurement: float,
+               impedance_measurement: float) -> ParticleSet:
+        if self.particles is None:
+            raise ValueError("You must setup the particles of the shards before filtering")
+        if self.timing_hooks:
+            self.begin_timing_step()
+        self.log_masses = np.array(self.run_on_shards("weight", [(displacement_measurement, impedance_measurement)]
+                                                      * self.number_of_shards))
+        self.normalize_shard_weights(self.log_masses)
+        self.lap("weighting")
+
+        self.number_of_steps += 1
+        if self.exchange_interval is not None and self.number_of_steps % self.exchange_interval == 0:
+            self.exchange_particles()
+            self.lap("exchange")
+
+        self.effective_sample_size = self.calculate_effective_sample_size(self.particles.weights)
+        self.resampled = self.resampling_threshold is None \
+            or self.effective_sample_size < self.resampling_threshold * len(self.particles)
+        if not self.resampled:
+            return self.particles
+        self.number_of_resampling_steps += 1
+        self.run_on_shards("resample")
+        self.lap("resampling")
+        return self.particles
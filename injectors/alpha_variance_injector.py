@@ -1,5 +1,5 @@
-from numpy import random
 from strategies.injection_strategy import InjectionStrategy
+from utils.array_particle_set import ArrayParticleSet
 from utils.particle_set import ParticleSet
 
 
@@ -7,13 +7,22 @@ class AlphaVariationInjector(InjectionStrategy):
 
     def __init__(self,
                  alpha_center: float = 2,
-                 alpha_variance: float = 0.1):
+                 alpha_variance: float = 0.1,
+                 injection_fraction: float = 0.05):
+        if not 0 <= injection_fraction <= 1:
+            raise ValueError("injection fraction must be between 0 and 1")
         self.alpha_center = alpha_center
         self.alpha_variance = alpha_variance
+        self.injection_fraction = injection_fraction
 
     def inject(self, particles: ParticleSet) -> ParticleSet:
-        number_injected_particles = int(len(particles) * 0.05)
-        particles.sort_ascending_by_weight()
-        for index in range(number_injected_particles):
-            particles[index].state.alpha = random.normal(loc=particles[index].state.alpha, scale=0.1)
+        number_injected_particles = int(len(particles) * self.injection_fraction)
+        worst_indices = self.select_worst_particle_indices(particles.get_weights(), number_injected_particles)
+        random_generator = self.get_random_generator()
+        if isinstance(particles, ArrayParticleSet):
+            particles.alphas[worst_indices] = random_generator.normal(loc=particles.alphas[worst_indices], scale=0.1)
+            return particles
+        alphas = random_generator.normal(loc=[particles[index].state.alpha for index in worst_indices], scale=0.1)
+        for index, alpha in zip(worst_indices, alphas):
+            particles[index].state.alpha = float(alpha)
         return particles
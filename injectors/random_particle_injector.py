@@ -1,24 +1,39 @@
-from numpy import random
 from strategies.injection_strategy import InjectionStrategy
+from utils.array_particle_set import ArrayParticleSet
 from utils.map3D import Map3D
 from utils.particle_set import ParticleSet
 
 
 class RandomParticleInjector3D(InjectionStrategy):
 
-    def __init__(self, map3D: Map3D):
+    def __init__(self, map3D: Map3D,
+                 injection_fraction: float = 0.05):
+        if not 0 <= injection_fraction <= 1:
+            raise ValueError("injection fraction must be between 0 and 1")
         self.map3D = map3D
+        self.injection_fraction = injection_fraction
 
     def inject(self,
                particles: ParticleSet) -> ParticleSet:
-        number_injected_particles = int(len(particles) * 0.05)
-        particles.sort_ascending_by_weight()
+        number_injected_particles = int(len(particles) * self.injection_fraction)
+        worst_indices = self.select_worst_particle_indices(particles.get_weights(), number_injected_particles)
 
-        for index in range(number_injected_particles):
+        random_generator = self.get_random_generator()
+        vessel_indices = random_generator.integers(0, len(self.map3D.get_vessels()), size=len(worst_indices))
+        positions = random_generator.uniform(0, self.map3D.get_vessel_lengths()[vessel_indices])
+        if isinstance(particles, ArrayParticleSet):
+            alphas = random_generator.normal(loc=particles.alphas[worst_indices], scale=0.1)
+            particles.branches[worst_indices] = vessel_indices
+            particles.displacements[worst_indices] = positions
+            particles.alphas[worst_indices] = alphas
+            if particles.sliding:
+                particles.reference_histories.reset_rows(worst_indices)
+            return particles
+
+        alphas = random_generator.normal(loc=[particles[index].state.alpha for index in worst_indices], scale=0.1)
+        for index, vessel_index, position, alpha in zip(worst_indices, vessel_indices, positions, alphas):
             particles[index].reset_particle()
-            vessel_index = random.randint(0, len(self.map3D.get_vessels()))
-            position = random.uniform(0, self.map3D.get_vessel(vessel_index)[-1]["centerline_position"])
-            particles[index].state.position = position
-            particles[index].state.branch = vessel_index
-            particles[index].set_alpha(random.normal(loc=particles[index].state.alpha, scale=0.1))
+            particles[index].state.position = float(position)
+            particles[index].state.branch = int(vessel_index)
+            particles[index].set_alpha(float(alpha))
         return particles
@@ -1,31 +1,68 @@
 import math
 
+import numpy as np
+
 from strategies.measurement_strategy import MeasurementStrategy
+from utils.array_particle_set import ArrayParticleSet
 from utils.map3D import Map3D
+from utils.particle_filter_component_enums import WeightingMode
 from utils.particle_set import ParticleSet
 
 """
 The Ahistoric Measurement Model raw weights of each particle by simply comparing currently measured
 impedance to the reference prediction based on the current position of each particle.
+For an ArrayParticleSet, the reference predictions of all particles are retrieved from the map in one batch, split
+into chunks by the weighting executor. An object based ParticleSet is weighted particle by particle; if the
+weighting executor runs in parallel, the positions of the particles are gathered and weighted in chunks.
 """
 
 
 class AhistoricMeasurementModel3D(MeasurementStrategy):
 
-    def __init__(self, map3D: Map3D):
-        super().__init__()
+    def __init__(self, map3D: Map3D,
+                 weighting_mode: WeightingMode = WeightingMode.INVERSE,
+                 likelihood_scale: float = 1.0):
+        super().__init__(weighting_mode=weighting_mode, likelihood_scale=likelihood_scale)
         self.map3D = map3D
 
     def get_reference(self):
         return self.map3D
 
+    def get_reference_value(self, branch: int, displacement: float) -> float:
+        if self.reference_cache is not None:
+            return self.reference_cache.get_reference_value(self.map3D, branch, displacement)
+        return self.map3D.get_reference_value(branch=branch, displacement=displacement)
+
     def retrieve_signal_prediction(self, particle) -> float:
-        local_reference_value = self.map3D.get_reference_value(
+        local_reference_value = self.get_reference_value(
             branch=particle.get_state().get_position()["branch"],
             displacement=particle.get_state().get_position()["displacement"])
         return local_reference_value
 
+    def calculate_raw_weights(self, branches: np.ndarray, displacements: np.ndarray, measurement: float) -> np.ndarray:
+        reference_values = self.map3D.get_reference_values(branches=branches, displacements=displacements)
+        return (measurement - reference_values) ** 2
+
+    def calculate_raw_weights_per_particle(self, branches: list, displacements: list, measurement: float) -> list:
+        return [math.pow(measurement - self.get_reference_value(branch=branch, displacement=displacement), 2)
+                for branch, displacement in zip(branches, displacements)]
+
     def raw_weight_particles(self, particles: ParticleSet, measurement: float) -> ParticleSet:
+        if isinstance(particles, ArrayParticleSet):
+            self.map3D.get_compiled_map()
+            particles.weights = self.weighting_executor.map_chunks(type(self).calculate_raw_weights, self,
+                                                                   [particles.branches, particles.displacements],
+                                                                   arguments=(measurement,))
+            return particles
+        if not self.weighting_executor.is_serial(len(particles)):
+            raw_weights = self.weighting_executor.map_chunks(
+                type(self).calculate_raw_weights_per_particle, self,
+                [[particle.state.branch for particle in particles],
+                 [particle.state.position for particle in particles]],
+                arguments=(measurement,))
+            for particle, raw_weight in zip(particles, raw_weights):
+                particle.weight = float(raw_weight)
+            return particles
         for particle in particles:
             particle.weight = math.pow((measurement - self.retrieve_signal_prediction(particle=particle)), 2)
         return particles
@@ -2,112 +2,188 @@ import numpy as np
 from tslearn.metrics import dtw
 
 from strategies.measurement_strategy import MeasurementStrategy
+from utils.array_particle_set import ArrayParticleSet
+from utils.batched_dtw import BatchedDTW
+from utils.history_buffer import HistoryBuffer
 from utils.map3D import Map3D
+from utils.particle_filter_component_enums import DTWEngine, WeightingMode
 from utils.particle_reference_retriever import ParticleReferenceRetriever
 from utils.particle_set import ParticleSet
+from utils.reference_cache import ReferenceCache
+from utils.series_transforms import SeriesTransform, IncrementalDerivativeTransform
 
 """
-The SlidingDTW Measurement model raw weights the particles by comparing the history of the past 20 reference predictions 
-to the history of the past 20 impedance measurements. Each particle stores its own reference history.
+The SlidingDTW Measurement model raw weights the particles by comparing the history of the past n reference predictions
+to the history of the past n impedance measurements, n is given by the history length (default 20).
+Each particle stores its own reference history; for an ArrayParticleSet, all reference histories are rows of one
+HistoryBuffer and are compared to the measurement history without copying.
 The signal histories are compared by a convex combination of a standard DTW and a derivative DTW algorithm. 
+The DTW distances are either calculated per particle with tslearn or for all particles at once with the BatchedDTW.
+The transform of the measurement history is calculated once per step and updated incrementally as the window slides,
+the transform of the reference histories is applied to the whole history matrix at once.
+The transform and the DTW distances of the reference histories are calculated in chunks of particles by the
+weighting executor.
 """
 
 
 class SlidingDTWMeasurementModel3D(MeasurementStrategy):
-    def __init__(self, map3D: Map3D):
+    def __init__(self, map3D: Map3D,
+                 dtw_engine: DTWEngine = DTWEngine.TSLEARN,
+                 sakoe_chiba_radius: int = None,
+                 history_length: int = 20,
+                 weighting_mode: WeightingMode = WeightingMode.INVERSE,
+                 likelihood_scale: float = 1.0):
+        super().__init__(weighting_mode=weighting_mode, likelihood_scale=likelihood_scale)
         self.map3D = map3D
-        self.measurement_history = []
+        self.history_length = history_length
+        self.measurement_buffer = HistoryBuffer(1, history_length)
         self.particle_reference_retriever = ParticleReferenceRetriever()
+        self.dtw_engine = dtw_engine
+        self.sakoe_chiba_radius = sakoe_chiba_radius
+        self.batched_dtw = BatchedDTW(sakoe_chiba_radius=sakoe_chiba_radius)
+
+    @property
+    def measurement_history(self) -> np.ndarray:
+        return self.measurement_buffer.get_row(0)
 
     def get_reference(self):
         return self.map3D
 
+    def set_reference_cache(self, reference_cache: ReferenceCache = None) -> None:
+        super().set_reference_cache(reference_cache)
+        self.particle_reference_retriever.reference_cache = reference_cache
+
     def reset_measurement_history(self):
-        self.measurement_history = []
+        self.measurement_buffer.reset()
 
     @staticmethod
     def retrieve_signal_prediction(particle):
         return particle.reference_history
 
-    def raw_weight_particles(self, particles: ParticleSet, measurement: float) -> ParticleSet:
-        self.measurement_history.append(measurement)
-        if len(self.measurement_history) > 20:
-            self.measurement_history = self.measurement_history[-20:]
+    def transform_series(self, series):
+        return series
+
+    def transform_windows(self, windows: np.ndarray) -> np.ndarray:
+        return windows
+
+    def transform_measurement_history(self):
+        return self.measurement_history
+
+    def append_measurement(self, measurement: float):
+        self.measurement_buffer.append(measurement)
 
+    def update_histories(self, particles: ParticleSet, measurement: float):
+        self.append_measurement(measurement)
+        if isinstance(particles, ArrayParticleSet):
+            particles.reference_histories.append(
+                self.particle_reference_retriever.retrieve_reference_updates(particles, self.map3D))
+            return
         for particle in particles:
             particle.reference_history += self.particle_reference_retriever.retrieve_reference_update(
                 particle, self.map3D)
-            if len(particle.reference_history) > 20:
-                particle.reference_history = particle.reference_history[-20:]
-            particle.weight = dtw(self.measurement_history, particle.reference_history)
+            if len(particle.reference_history) > self.history_length:
+                particle.reference_history = particle.reference_history[-self.history_length:]
+
+    def calculate_distances(self, measurement_series, particle_series) -> np.ndarray:
+        if self.dtw_engine == DTWEngine.BATCHED:
+            if isinstance(particle_series, np.ndarray):
+                return self.batched_dtw.distances(measurement_series, particle_series)
+            return self.batched_dtw.distances_to_series_list(measurement_series, particle_series)
+        if self.sakoe_chiba_radius is not None:
+            return np.array([dtw(measurement_series, series,
+                                 global_constraint="sakoe_chiba",
+                                 sakoe_chiba_radius=self.sakoe_chiba_radius) for series in particle_series])
+        return np.array([dtw(measurement_series, series) for series in particle_series])
+
+    def calculate_window_distances(self, windows: np.ndarray, measurement_series) -> np.ndarray:
+        return self.calculate_distances(measurement_series, self.transform_windows(windows))
+
+    def calculate_history_distances(self, reference_histories: list, measurement_series) -> np.ndarray:
+        return self.calculate_distances(measurement_series,
+                                        [self.transform_series(history) for history in reference_histories])
+
+    def raw_weight_particles(self, particles: ParticleSet, measurement: float) -> ParticleSet:
+        self.update_histories(particles=particles, measurement=measurement)
+        measurement_series = self.transform_measurement_history()
+        if isinstance(particles, ArrayParticleSet):
+            for rows, windows in particles.reference_histories.get_windows():
+                particles.weights[rows] = self.weighting_executor.map_chunks(type(self).calculate_window_distances,
+                                                                             self, [windows],
+                                                                             arguments=(measurement_series,))
+            return particles
+        distances = self.weighting_executor.map_chunks(type(self).calculate_history_distances, self,
+                                                       [[particle.reference_history for particle in particles]],
+                                                       arguments=(measurement_series,))
+        for particle, distance in zip(particles, distances):
+            particle.weight = distance
         return particles
 
 
 class SlidingDerivativeDTWMeasurementModel3D(SlidingDTWMeasurementModel3D):
 
-    def __init__(self, map3D: Map3D):
-        super().__init__(map3D)
+    def __init__(self, map3D: Map3D,
+                 dtw_engine: DTWEngine = DTWEngine.TSLEARN,
+                 sakoe_chiba_radius: int = None,
+                 history_length: int = 20,
+                 weighting_mode: WeightingMode = WeightingMode.INVERSE,
+                 likelihood_scale: float = 1.0):
+        super().__init__(map3D, dtw_engine=dtw_engine, sakoe_chiba_radius=sakoe_chiba_radius,
+                         history_length=history_length, weighting_mode=weighting_mode,
+                         likelihood_scale=likelihood_scale)
+        self.measurement_transform = IncrementalDerivativeTransform(window_length=history_length)
+
+    def reset_measurement_history(self):
+        super().reset_measurement_history()
+        self.measurement_transform.reset()
 
     @staticmethod
     def smooth_exponentially(data: list,
                              alpha: float = 0.5) -> list:
-        if len(data) < 1:
-            raise ValueError("list must contain elements")
-        if alpha <= 0 or alpha >= 1:
-            raise ValueError("alpha must be between 0 and 1")
-        fitted_data = [data[0]]
-        for index in range(1, len(data)):
-            next_fit = alpha * data[index] + (1 - alpha) * data[index - 1]
-            fitted_data.append(next_fit)
-        return fitted_data
+        return list(SeriesTransform.smooth_exponentially(data, alpha))
 
     def derive_series(self, series: list) -> list:
         if len(series) < 3:
             return series
-        series_np = np.array(self.smooth_exponentially(series))
-        derivative = 0.25 * series_np[2:] + 0.5 * series_np[1:-1] - 0.75 * series_np[:-2]
+        return list(SeriesTransform.derive(series))
 
-        return list(derivative)
+    def transform_series(self, series):
+        return self.derive_series(series)
 
-    def raw_weight_particles(self, particles: ParticleSet, measurement: float) -> ParticleSet:
-        self.measurement_history.append(measurement)
-        if len(self.measurement_history) > 20:
-            self.measurement_history = self.measurement_history[-20:]
+    def transform_windows(self, windows: np.ndarray) -> np.ndarray:
+        return SeriesTransform.derive(windows)
 
-        for particle in particles:
-            particle.reference_history += self.particle_reference_retriever.retrieve_reference_update(
-                particle, self.map3D)
-            if len(particle.reference_history) > 20:
-                particle.reference_history = particle.reference_history[-20:]
-            particle.weight = dtw(self.derive_series(self.measurement_history),
-                                  self.derive_series(particle.reference_history))
-        return particles
+    def transform_measurement_history(self):
+        return self.measurement_transform.get_derived(self.measurement_history)
+
+    def append_measurement(self, measurement: float):
+        super().append_measurement(measurement)
+        self.measurement_transform.append(measurement)
 
 
 class SlidingCombinedDerivativeDTWMeasurementModel3D(SlidingDerivativeDTWMeasurementModel3D):
 
-    def __init__(self, map3D: Map3D):
-        super().__init__(map3D)
+    def __init__(self, map3D: Map3D,
+                 dtw_engine: DTWEngine = DTWEngine.TSLEARN,
+                 sakoe_chiba_radius: int = None,
+                 history_length: int = 20,
+                 weighting_mode: WeightingMode = WeightingMode.INVERSE,
+                 likelihood_scale: float = 1.0):
+        super().__init__(map3D, dtw_engine=dtw_engine, sakoe_chiba_radius=sakoe_chiba_radius,
+                         history_length=history_length, weighting_mode=weighting_mode,
+                         likelihood_scale=likelihood_scale)
+
+    combination_alpha = 0.2
 
     def convex_combine_derived_and_raw_series(self, series: list) -> list:
-        alpha = 0.2
         if len(series) < 3:
             return series
-        series_np = np.array(series)
-        derivative = self.derive_series(series)
-        combination = alpha * series_np[2:] + (1 - alpha) * np.array(derivative)
-        return list(combination)
+        return list(SeriesTransform.convex_combine(series, self.combination_alpha))
 
-    def raw_weight_particles(self, particles: ParticleSet, measurement: float) -> ParticleSet:
-        self.measurement_history.append(measurement)
-        if len(self.measurement_history) > 20:
-            self.measurement_history = self.measurement_history[-20:]
+    def transform_series(self, series):
+        return self.convex_combine_derived_and_raw_series(series)
 
-        for particle in particles:
-            particle.reference_history += self.particle_reference_retriever.retrieve_reference_update(
-                particle, self.map3D)
-            if len(particle.reference_history) > 20:
-                particle.reference_history = particle.reference_history[-20:]
-            particle.weight = dtw(self.convex_combine_derived_and_raw_series(self.measurement_history),
-                                  self.convex_combine_derived_and_raw_series(particle.reference_history))
-        return particles
+    def transform_windows(self, windows: np.ndarray) -> np.ndarray:
+        return SeriesTransform.convex_combine(windows, self.combination_alpha)
+
+    def transform_measurement_history(self):
+        return self.measurement_transform.get_convex_combination(self.measurement_history, self.combination_alpha)
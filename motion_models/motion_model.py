@@ -1,7 +1,9 @@
-from numpy import random
+import numpy as np
 from strategies.motion_strategy import MotionStrategy
+from utils.array_particle_set import ArrayParticleSet
 from utils.map3D import Map3D
 from utils.particle_set import ParticleSet
+from utils.streaming_statistics import RunningStatistics, RollingStatistics
 
 """
 The MotionModel3D takes a set of particles and applies the current displacement measurement.
@@ -11,6 +13,15 @@ resulting value is used as center of a normal distribution with variance equal t
 error of the displacement sensor. The new position estimate of the respective particle is then 
 drawn from this normal distribution. After the position of each particle of the particle set was 
 updated, the particle set is returned.
+For an ArrayParticleSet, all particles are moved at once: the noise is drawn in one call, particles that left
+their vessel are found by a comparison against the vessel lengths, and the vessel switches are resolved in batches
+over only the particles that crossed a vessel boundary.
+The vessel switches use the transition tables of the compiled map: a backward overshoot of any length is resolved in
+one pass with the ancestors and path lengths to the root, a forward overshoot draws one successor per hop from the
+successor table.
+The estimated error of the displacement sensor is the standard error of the mean of the recent displacement
+measurements. It is tracked with streaming statistics, so neither its memory nor its cost per step grows with the
+length of the intervention.
 """
 
 
@@ -23,22 +34,43 @@ class MotionModel3D(MotionStrategy):
             raise ValueError("number of included measurements cannot be smaller than 1")
         self.included_measurements = included_measurements
         self.map3D = map3D
-        self.displacement_history = []
+        self.displacement_statistics = RunningStatistics()
+        self.recent_displacement_statistics = RollingStatistics(included_measurements)
+        self.latest_displacement = None
+
+    def update_displacement_error(self, displacement_measurement: float) -> float:
+        """
+        Streaming equivalent of calculate_displacement_error over all displacement measurements so far, with memory
+        bounded by the number of included measurements.
+        """
+        if self.latest_displacement is not None:
+            self.recent_displacement_statistics.append(self.latest_displacement)
+        self.latest_displacement = displacement_measurement
+        self.displacement_statistics.append(displacement_measurement)
+        number_of_displacements = self.displacement_statistics.count
+        if number_of_displacements < 2:
+            return 0.3
+        if self.included_measurements <= 1 or self.included_measurements >= number_of_displacements:
+            return self.displacement_statistics.get_standard_error()
+        return self.recent_displacement_statistics.get_standard_error()
 
     def move_particles(self, previous_particle_set: ParticleSet,
                        displacement_measurement: float) -> ParticleSet:
 
-        self.displacement_history.append(displacement_measurement)
-        error = self.calculate_displacement_error(self.displacement_history, self.included_measurements)
+        error = self.update_displacement_error(displacement_measurement)
+        if isinstance(previous_particle_set, ArrayParticleSet):
+            return self.move_particle_array(particles=previous_particle_set,
+                                            displacement_measurement=displacement_measurement,
+                                            error=error)
         for particle in previous_particle_set:
             position_estimate = particle.get_position()["displacement"] \
                                 + (displacement_measurement * particle.state.alpha)
 
-            position_estimate = random.normal(loc=position_estimate, scale=error)
+            position_estimate = self.get_random_generator().normal(loc=position_estimate, scale=error)
 
             vessel_length = self.map3D.get_vessel(particle.get_position()["branch"])[-1]["centerline_position"]
             if 0 < position_estimate < vessel_length:
-                particle.state.set_position(random.normal(loc=position_estimate, scale=error))
+                particle.state.set_position(self.get_random_generator().normal(loc=position_estimate, scale=error))
             elif position_estimate < 0:
                 self.handle_backward_vessel_switch(particle=particle,
                                                    position_estimate=position_estimate)
@@ -49,27 +81,59 @@ class MotionModel3D(MotionStrategy):
         return previous_particle_set
 
     def handle_backward_vessel_switch(self, particle, position_estimate: float):
-        current_index = particle.get_position()["branch"]
-        while position_estimate < 0:
-            if current_index == 0:
-                position_estimate = 0
-                break
-            else:
-                predecessor_vessel_length = self.map3D.get_vessel(current_index)[-1]["centerline_position"]
-                position_estimate = predecessor_vessel_length + position_estimate
-                current_index = self.map3D.get_index_of_predecessor(current_index)
-        particle.state.set_position(position=position_estimate)
-        particle.state.set_branch(current_index)
+        branches, positions = self.map3D.get_transition_tables().resolve_backward_overshoot(
+            branches=np.array([particle.get_position()["branch"]]), position_estimates=np.array([position_estimate]))
+        particle.state.set_position(position=float(positions[0]))
+        particle.state.set_branch(int(branches[0]))
 
     def handle_forward_vessel_switch(self, particle, position_estimate: float):
+        vessel_lengths = self.map3D.get_vessel_lengths()
+        successor_table, number_of_successors = self.map3D.get_successor_table()
         successor_index = particle.get_position()["branch"]
-        current_branch = self.map3D.get_vessel(successor_index)
-        successor_indices = self.map3D.get_indices_of_successors(successor_index)
-        while position_estimate > current_branch[-1]["centerline_position"] and not successor_indices == []:
+        while position_estimate > vessel_lengths[successor_index] and number_of_successors[successor_index] > 0:
+            position_estimate = position_estimate - float(vessel_lengths[successor_index])
             # conversion to int is necessary, otherwise it is not json serializable
-            successor_index = int(random.choice(successor_indices))
-            position_estimate = position_estimate - current_branch[-1]["centerline_position"]
-            successor_indices = self.map3D.get_indices_of_successors(successor_index)
-            current_branch = self.map3D.get_vessel(successor_index)
+            successor_index = int(self.get_random_generator().choice(
+                successor_table[successor_index, :number_of_successors[successor_index]]))
         particle.state.set_position(position=position_estimate)
         particle.state.set_branch(successor_index)
+
+    def move_particle_array(self, particles: ArrayParticleSet,
+                            displacement_measurement: float,
+                            error: float) -> ArrayParticleSet:
+        vessel_lengths = self.map3D.get_vessel_lengths()
+        noise = self.get_random_generator().normal(loc=0, scale=error, size=(2, len(particles)))
+        position_estimates = particles.displacements + displacement_measurement * particles.alphas + noise[0]
+
+        inside = (0 < position_estimates) & (position_estimates < vessel_lengths[particles.branches])
+        backward = position_estimates < 0
+        forward = ~(inside | backward)
+        particles.displacements = np.where(inside, position_estimates + noise[1], position_estimates)
+
+        self.handle_backward_vessel_switches(particles=particles, indices=np.flatnonzero(backward),
+                                             vessel_lengths=vessel_lengths)
+        self.handle_forward_vessel_switches(particles=particles, indices=np.flatnonzero(forward),
+                                            vessel_lengths=vessel_lengths)
+        return particles
+
+    def handle_backward_vessel_switches(self, particles: ArrayParticleSet, indices: np.ndarray,
+                                        vessel_lengths: np.ndarray):
+        branches, position_estimates = self.map3D.get_transition_tables().resolve_backward_overshoot(
+            branches=particles.branches[indices], position_estimates=particles.displacements[indices])
+        particles.displacements[indices] = position_estimates
+        particles.branches[indices] = branches
+
+    def handle_forward_vessel_switches(self, particles: ArrayParticleSet, indices: np.ndarray,
+                                       vessel_lengths: np.ndarray):
+        successor_table, number_of_successors = self.map3D.get_successor_table()
+        branches = particles.branches[indices]
+        position_estimates = particles.displacements[indices]
+        active = np.arange(len(indices))
+        while len(active) > 0:
+            active = active[(position_estimates[active] > vessel_lengths[branches[active]])
+                            & (number_of_successors[branches[active]] > 0)]
+            choices = self.get_random_generator().integers(0, number_of_successors[branches[active]])
+            position_estimates[active] -= vessel_lengths[branches[active]]
+            branches[active] = successor_table[branches[active], choices]
+        particles.displacements[indices] = position_estimates
+        particles.branches[indices] = branches
@@ -0,0 +1,209 @@
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from navigators.replay_engine import RecordingReader
+from navigators.vessel_navigator import VesselNavigator
+from utils.map3D import Map3D
+from utils.particle_filter_component_enums import MeasurementType, InjectorType, ParticleSetType, DTWEngine
+from utils.random_streams import spawn_seeds
+
+"""
+The batch evaluation runs the particle filter over several recordings and configurations (measurement type, injector
+type, number of particles and alpha center) on a process pool. Each worker loads the vessel map once in its
+initializer and reuses it, including the compiled map, for all of its jobs. Every job draws its random numbers from
+its own seed, spawned from the base seed by the index of the job, so the results do not depend on the number of
+workers or on the order in which the jobs finish.
+Recordings are .npy or CSV files with the columns displacement and impedance, optionally followed by the true branch
+and the true displacement. With ground truth, the accuracy of the largest cluster of the position estimate is
+evaluated: the fraction of steps on the true branch and the displacement error on these steps. The metrics of all
+jobs and their means per configuration are written to one JSON report.
+Run from the repository root:
+    python -m navigators.batch_evaluation --map map.json --recordings a.csv b.csv --particles 500 1000 --workers 8
+"""
+
+worker_maps = {}
+
+
+def initialize_worker(map_path: str) -> None:
+    get_worker_map(map_path)
+
+
+def get_worker_map(map_path: str) -> Map3D:
+    if map_path not in worker_maps:
+        map3D = Map3D()
+        map3D.load_map(map_path)
+        map3D.get_compiled_map()
+        worker_maps[map_path] = map3D
+    return worker_maps[map_path]
+
+
+def load_recording(path: str) -> np.ndarray:
+    reader = RecordingReader(path)
+    return np.concatenate(list(reader.read_chunks(path)))
+
+
+def create_jobs(map_path: str,
+                recordings: list,
+                measurement_types: list,
+                injector_types: list,
+                numbers_of_particles: list,
+                alpha_centers: list,
+                seed: int = 0,
+                particle_set_type: ParticleSetType = ParticleSetType.ARRAY) -> list:
+    configurations = list(itertools.product(recordings, measurement_types, injector_types, numbers_of_particles,
+                                            alpha_centers))
+    seeds = spawn_seeds(seed, len(configurations))
+    jobs = []
+    for index, (configuration, job_seed) in enumerate(zip(configurations, seeds)):
+        recording, measurement_type, injector_type, number_of_particles, alpha_center = configuration
+        jobs.append({"index": index,
+                     "map_path": map_path,
+                     "recording": recording,
+                     "measurement_type": measurement_type.name,
+                     "injector_type": injector_type.name,
+                     "number_of_particles": number_of_particles,
+                     "alpha_center": alpha_center,
+                     "particle_set_type": particle_set_type.name,
+                     "seed": int(job_seed.generate_state(1)[0])})
+    return jobs
+
+
+def calculate_accuracy(estimated_branches: np.ndarray, estimated_centers: np.ndarray, recording: np.ndarray) -> dict:
+    if recording.shape[1] < 4 or len(recording) == 0:
+        return {"branch_accuracy": None, "mean_absolute_error": None, "median_absolute_error": None,
+                "p95_absolute_error": None}
+    on_true_branch = estimated_branches == recording[:, 2].astype(np.int64)
+    errors = np.abs(estimated_centers - recording[:, 3])[on_true_branch]
+    return {"branch_accuracy": float(np.mean(on_true_branch)),
+            "mean_absolute_error": float(np.mean(errors)) if len(errors) > 0 else None,
+            "median_absolute_error": float(np.median(errors)) if len(errors) > 0 else None,
+            "p95_absolute_error": float(np.percentile(errors, 95)) if len(errors) > 0 else None}
+
+
+def evaluate_job(job: dict) -> dict:
+    recording = load_recording(job["recording"])
+    navigator = VesselNavigator()
+    navigator.setup_navigator(reference_path=job["map_path"],
+                              log_destination_path=os.path.join(tempfile.gettempdir(), ""),
+                              filename="batch_evaluation_" + str(os.getpid()),
+                              measurement_type=MeasurementType[job["measurement_type"]],
+                              injector_type=InjectorType[job["injector_type"]],
+                              number_of_particles=job["number_of_particles"],
+                              alpha_center=job["alpha_center"],
+                              loglevel=logging.WARNING,
+                              particle_set_type=ParticleSetType[job["particle_set_type"]],
+                              dtw_engine=DTWEngine.BATCHED,
+                              reference_map=get_worker_map(job["map_path"]),
+                              seed=job["seed"])
+    estimated_branches = np.full(len(recording), -1, dtype=np.int64)
+    estimated_centers = np.full(len(recording), np.nan)
+    start = time.perf_counter()
+    for step, (displacement, impedance) in enumerate(recording[:, :2]):
+        first_cluster = navigator.update_step(displacement=float(displacement),
+                                              impedance=float(impedance)).get_first_cluster()
+        if first_cluster is not None:
+            estimated_branches[step] = first_cluster.get_branch()
+            estimated_centers[step] = first_cluster.get_center()
+    runtime = time.perf_counter() - start
+    result = dict(job)
+    result.update({"number_of_steps": len(recording),
+                   "runtime": runtime,
+                   "steps_per_second": len(recording) / runtime if runtime > 0 else 0.0,
+                   "worker": os.getpid()})
+    result.update(calculate_accuracy(estimated_branches, estimated_centers, recording))
+    return result
+
+
+def aggregate_results(results: list) -> list:
+    keys = ["measurement_type", "injector_type", "number_of_particles", "alpha_center"]
+    groups = {}
+    for result in results:
+        groups.setdefault(tuple(result[key] for key in keys), []).append(result)
+    aggregates = []
+    for configuration, group in groups.items():
+        aggregate = dict(zip(keys, configuration))
+        aggregate["number_of_recordings"] = len(group)
+        aggregate["number_of_steps"] = sum(result["number_of_steps"] for result in group)
+        aggregate["runtime"] = sum(result["runtime"] for result in group)
+        aggregate["steps_per_second"] = aggregate["number_of_steps"] / aggregate["runtime"] \
+            if aggregate["runtime"] > 0 else 0.0
+        for metric in ["branch_accuracy", "mean_absolute_error", "median_absolute_error", "p95_absolute_error"]:
+            values = [result[metric] for result in group if result[metric] is not None]
+            aggregate[metric] = float(np.mean(values)) if values else None
+        aggregates.append(aggregate)
+    return aggregates
+
+
+def run_batch_evaluation(jobs: list, number_of_workers: int = None) -> dict:
+    if len(jobs) == 0:
+        raise ValueError("no jobs to evaluate")
+    map_paths = {job["map_path"] for job in jobs}
+    if len(map_paths) != 1:
+        raise ValueError("all jobs of a batch evaluation must use the same map")
+    number_of_workers = number_of_workers or os.cpu_count()
+    start = time.perf_counter()
+    if number_of_workers <= 1:
+        initialize_worker(*map_paths)
+        results = [evaluate_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=number_of_workers, initializer=initialize_worker,
+                                 initargs=tuple(map_paths)) as executor:
+            results = list(executor.map(evaluate_job, jobs))
+    wall_time = time.perf_counter() - start
+    return {"timestamp": datetime.datetime.now().isoformat(),
+            "platform": platform.platform(),
+            "number_of_workers": number_of_workers,
+            "wall_time": wall_time,
+            "average_concurrency": sum(result["runtime"] for result in results) / wall_time,
+            "aggregates": aggregate_results(results),
+            "jobs": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="evaluate the particle filter over recordings and configurations")
+    parser.add_argument("--map", required=True)
+    parser.add_argument("--recordings", nargs="+", required=True)
+    parser.add_argument("--measurement-types", nargs="+", default=["AHISTORIC"],
+                        choices=[t.name for t in MeasurementType])
+    parser.add_argument("--injector-types", nargs="+", default=["ALPHA_VARIANCE"],
+                        choices=[t.name for t in InjectorType])
+    parser.add_argument("--particles", type=int, nargs="+", default=[1000])
+    parser.add_argument("--alpha-centers", type=float, nargs="+", default=[2.0])
+    parser.add_argument("--particle-set-type", default="ARRAY", choices=[t.name for t in ParticleSetType])
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="batch_evaluation.json")
+    arguments = parser.parse_args()
+
+    jobs = create_jobs(map_path=arguments.map,
+                       recordings=arguments.recordings,
+                       measurement_types=[MeasurementType[name] for name in arguments.measurement_types],
+                       injector_types=[InjectorType[name] for name in arguments.injector_types],
+                       numbers_of_particles=arguments.particles,
+                       alpha_centers=arguments.alpha_centers,
+                       seed=arguments.seed,
+                       particle_set_type=ParticleSetType[arguments.particle_set_type])
+    report = run_batch_evaluation(jobs, arguments.workers)
+    report["configuration"] = vars(arguments)
+    with open(arguments.output, "w") as outfile:
+        json.dump(report, outfile, indent=4)
+    for aggregate in report["aggregates"]:
+        print(f'{aggregate["measurement_type"]:>12} {aggregate["injector_type"]:>15} '
+              f'{aggregate["number_of_particles"]:>7} particles alpha {aggregate["alpha_center"]}: '
+              f'branch accuracy {aggregate["branch_accuracy"]} | {aggregate["steps_per_second"]:.1f} steps/s')
+    print(f'{len(jobs)} jobs on {report["number_of_workers"]} workers in {report["wall_time"]:.2f} s '
+          f'(average concurrency {report["average_concurrency"]:.2f})')
+
+
+if __name__ == "__main__":
+    main()
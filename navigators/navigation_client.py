@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from navigators.navigation_service import NavigationService
+from navigators.replay_engine import RecordingReader
+from utils.random_streams import spawn_seeds
+
+"""
+The NavigationClient talks to a NavigationService over one connection and awaits the response of each message
+before sending the next one. The load test opens one client and session per simulated catheter and lets all
+sessions send their update steps concurrently, from a recording or from random measurements. It reports the
+throughput of the service and the client side latency percentiles, together with the batching statistics of the
+service. With --start-service, the service runs in the same process, otherwise the load test connects to a running
+service:
+    python -m navigators.navigation_client --map map.json --sessions 32 --steps 200 --start-service
+"""
+
+
+class NavigationClient:
+    """
+    @param reader: stream of the connection to the service
+    @param writer: stream of the connection to the service
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.session_id = None
+
+    @classmethod
+    async def connect(cls, host: str = "127.0.0.1", port: int = 8765, unix_socket: str = None):
+        if unix_socket is not None:
+            return cls(*await asyncio.open_unix_connection(unix_socket))
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def request(self, message: dict) -> dict:
+        self.writer.write((json.dumps(message) + "\n").encode())
+        await self.writer.drain()
+        response = json.loads(await self.reader.readline())
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+    async def open_session(self, config: dict, session_id: str = None) -> str:
+        message = {"type": "open", "config": config}
+        if session_id is not None:
+            message["session"] = session_id
+        self.session_id = (await self.request(message))["session"]
+        return self.session_id
+
+    async def update(self, displacement: float, impedance: float) -> dict:
+        return await self.request({"type": "update", "session": self.session_id,
+                                   "displacement": displacement, "impedance": impedance})
+
+    async def get_stats(self) -> dict:
+        return await self.request({"type": "stats", "session": self.session_id})
+
+    async def close_session(self) -> dict:
+        return await self.request({"type": "close", "session": self.session_id})
+
+    async def get_service_stats(self) -> dict:
+        return await self.request({"type": "service_stats"})
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def run_session(client: NavigationClient, displacements: np.ndarray, impedances: np.ndarray) -> list:
+    latencies = []
+    for displacement, impedance in zip(displacements, impedances):
+        start = time.perf_counter()
+        await client.update(float(displacement), float(impedance))
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def load_measurements(recording: str, number_of_steps: int, seed: int) -> tuple:
+    if recording is None:
+        generator = np.random.default_rng(seed)
+        return generator.normal(0.5, 0.05, number_of_steps), generator.uniform(3, 7, number_of_steps)
+    displacements, impedances = next(iter(RecordingReader(recording, chunk_size=number_of_steps)))
+    return displacements, impedances
+
+
+async def run_load_test(arguments) -> dict:
+    service = None
+    if arguments.start_service:
+        service = NavigationService(number_of_workers=arguments.workers, batch_window=arguments.batch_window)
+        await service.start(host=arguments.host, port=0, unix_socket=arguments.unix_socket)
+        if arguments.unix_socket is None:
+            arguments.port = service.get_port()
+    displacements, impedances = load_measurements(arguments.recording, arguments.steps, arguments.seed)
+    config = {"reference_path": arguments.map,
+              "number_of_particles": arguments.particles,
+              "measurement_type": arguments.measurement_type,
+              "particle_set_type": arguments.particle_set_type,
+              "dtw_engine": "BATCHED"}
+    clients = [await NavigationClient.connect(arguments.host, arguments.port, arguments.unix_socket)
+               for _ in range(arguments.sessions)]
+    for client, seed in zip(clients, spawn_seeds(arguments.seed, arguments.sessions)):
+        await client.open_session(dict(config, seed=int(seed.generate_state(1)[0])))
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*[run_session(client, displacements, impedances) for client in clients])
+    duration = time.perf_counter() - start
+
+    session_stats = [await client.close_session() for client in clients]
+    service_stats = await clients[0].get_service_stats()
+    for client in clients:
+        await client.close()
+    if service is not None:
+        await service.stop()
+
+    latencies = np.concatenate(latencies) * 1000
+    number_of_updates = len(latencies)
+    return {"number_of_sessions": arguments.sessions,
+            "number_of_updates": number_of_updates,
+            "duration": duration,
+            "updates_per_second": number_of_updates / duration,
+            "latency_ms": {"mean": float(np.mean(latencies)),
+                           "p50": float(np.percentile(latencies, 50)),
+                           "p95": float(np.percentile(latencies, 95)),
+                           "p99": float(np.percentile(latencies, 99)),
+                           "max": float(np.max(latencies))},
+            "service": service_stats,
+            "sessions": session_stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="load test of the navigation service")
+    parser.add_argument("--map", required=True)
+    parser.add_argument("--recording", default=None, help=".npy or .csv file with displacements and impedances")
+    parser.add_argument("--sessions", type=int, default=16)
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--particles", type=int, default=1000)
+    parser.add_argument("--measurement-type", default="AHISTORIC")
+    parser.add_argument("--particle-set-type", default="ARRAY")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-socket", default=None)
+    parser.add_argument("--start-service", action="store_true")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-window", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON file for the full report")
+    arguments = parser.parse_args()
+
+    report = asyncio.run(run_load_test(arguments))
+    if arguments.output is not None:
+        with open(arguments.output, "w") as outfile:
+            json.dump(report, outfile, indent=4)
+    latency = report["latency_ms"]
+    print(f'{report["number_of_updates"]} updates of {report["number_of_sessions"]} sessions in '
+          f'{report["duration"]:.2f} s ({report["updates_per_second"]:.1f} updates/s) | latency p50 '
+          f'{latency["p50"]:.2f} ms, p95 {latency["p95"]:.2f} ms, p99 {latency["p99"]:.2f} ms | '
+          f'{report["service"]["number_of_batches"]} batches')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from navigators.vessel_navigator import VesselNavigator
+from utils.map3D import Map3D
+from utils.particle_filter_component_enums import MeasurementType, InjectorType, ParticleSetType, DTWEngine, \
+    ResamplerType, WeightingMode, WeightingExecutorType
+from utils.position_estimate import PositionEstimate
+from utils.timing_hooks import StepTimingRecorder
+
+"""
+The NavigationService hosts many independent navigator sessions in one process, e.g. one per simulated catheter or
+replay. Clients connect over a local TCP or Unix socket and exchange newline delimited JSON messages:
+
+    {"type": "open", "config": {"reference_path": "map.json", "number_of_particles": 1000, ...}}
+    {"type": "update", "session": "session-1", "displacement": 0.5, "impedance": 4.2}
+    {"type": "stats", "session": "session-1"}
+    {"type": "close", "session": "session-1"}
+
+The config of an open message holds the arguments of VesselNavigator.setup_navigator, enum values given by their
+names, except reference_map and configure_logger, which the service sets itself. Sessions do not configure the root
+logger, and every map is loaded once and shared read-only by all sessions using it; per-session settings such as the
+reference cache belong to the model of the session.
+Update messages of all connections are collected in one queue. The dispatcher takes all updates that arrived while
+the previous batch was processed, at most max_batch_size, and runs the steps of the different sessions concurrently
+on the worker pool; the steps of one session are run in order. Each response carries the position estimate and the
+latency of the update, and the stats message returns the queueing, update and total latency percentiles of the
+session over its recent steps. Closing a session, or stopping the service, releases the worker pools and shared
+memory of its particle filter.
+"""
+
+ENUM_ARGUMENTS = {"measurement_type": MeasurementType, "injector_type": InjectorType,
+                  "particle_set_type": ParticleSetType, "dtw_engine": DTWEngine,
+                  "resampler_type": ResamplerType, "weighting_mode": WeightingMode,
+                  "weighting_executor": WeightingExecutorType}
+RESERVED_ARGUMENTS = ["reference_map", "configure_logger"]
+
+
+class NavigationSession:
+    """
+    @param session_id: name of the session in the messages
+    @param navigator: set up navigator of the session
+    @param latency_capacity: number of recent steps kept for the latency statistics
+    """
+
+    def __init__(self, session_id: str, navigator: VesselNavigator, latency_capacity: int = 1000) -> None:
+        self.session_id = session_id
+        self.navigator = navigator
+        self.latencies = StepTimingRecorder(capacity=latency_capacity, stages=["queue", "update"])
+        self.number_of_steps = 0
+        self.lock = threading.Lock()
+
+    def update(self, displacement: float, impedance: float, received: float) -> dict:
+        with self.lock:
+            started = time.perf_counter()
+            position_estimate = self.navigator.update_step(displacement=displacement, impedance=impedance)
+            finished = time.perf_counter()
+            self.number_of_steps += 1
+            self.latencies.begin_step(self.number_of_steps)
+            self.latencies.record_stage("queue", started - received)
+            self.latencies.record_stage("update", finished - started)
+            self.latencies.end_step(finished - received)
+        return {"session": self.session_id,
+                "step": self.number_of_steps,
+                "estimate": self.serialize_estimate(position_estimate),
+                "latency_ms": (finished - received) * 1000}
+
+    @staticmethod
+    def serialize_estimate(position_estimate: PositionEstimate) -> dict:
+        clusters = [{"branch": int(cluster.get_branch()),
+                     "center": float(cluster.get_center()),
+                     "error": float(cluster.get_error()),
+                     "number_of_particles": int(cluster.get_number_of_particles())}
+                    for branch_clusters in position_estimate.get_clusters().values() for cluster in branch_clusters]
+        first_cluster = max(clusters, key=lambda cluster: cluster["number_of_particles"], default=None)
+        return {"first_cluster": first_cluster, "clusters": clusters}
+
+    def close(self) -> None:
+        with self.lock:
+            self.navigator.close()
+
+    def get_stats(self) -> dict:
+        return {"session": self.session_id,
+                "number_of_steps": self.number_of_steps,
+                "latency": self.latencies.summary(percentiles=(50, 95, 99, 100))}
+
+
+class NavigationService:
+    """
+    @param number_of_workers: number of worker threads running the update steps
+    @param max_batch_size: maximal number of updates dispatched to the workers at once
+    @param batch_window: time in seconds the dispatcher waits for further updates before dispatching a batch
+    """
+
+    def __init__(self, number_of_workers: int = 4, max_batch_size: int = 256, batch_window: float = 0.0) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=number_of_workers)
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.sessions = {}
+        self.maps = {}
+        self.maps_lock = threading.Lock()
+        self.session_counter = itertools.count(1)
+        self.pending_updates = None
+        self.dispatcher = None
+        self.servers = []
+        self.number_of_batches = 0
+        self.number_of_updates = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765, unix_socket: str = None) -> None:
+        self.pending_updates = asyncio.Queue()
+        self.dispatcher = asyncio.create_task(self.dispatch_updates())
+        if unix_socket is not None:
+            self.servers.append(await asyncio.start_unix_server(self.handle_connection, path=unix_socket))
+        else:
+            self.servers.append(await asyncio.start_server(self.handle_connection, host=host, port=port))
+
+    def get_port(self) -> int:
+        return self.servers[0].sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
+        self.executor.shutdown(wait=True)
+
+    def get_map(self, map_path: str) -> Map3D:
+        # sessions are opened on worker threads; the map is loaded once and published with its compiled map and
+        # transition tables already built, so the sessions only read it
+        with self.maps_lock:
+            if map_path not in self.maps:
+                map3D = Map3D()
+                map3D.load_map(map_path)
+                map3D.get_compiled_map()
+                map3D.get_transition_tables()
+                self.maps[map_path] = map3D
+            return self.maps[map_path]
+
+    def open_session(self, config: dict, session_id: str = None) -> NavigationSession:
+        if session_id is None:
+            session_id = "session-" + str(next(self.session_counter))
+        if session_id in self.sessions:
+            raise ValueError("Session " + session_id + " already exists")
+        arguments = dict(config)
+        if "reference_path" not in arguments:
+            raise ValueError("The session config needs a reference_path")
+        reserved = [name for name in RESERVED_ARGUMENTS if name in arguments]
+        if reserved:
+            raise ValueError("The session config must not set " + ", ".join(reserved)
+                             + ", the service loads the map and leaves the logger untouched")
+        for name, enum in ENUM_ARGUMENTS.items():
+            if name in arguments:
+                arguments[name] = enum[arguments[name]]
+        arguments.setdefault("log_destination_path", None)
+        arguments.setdefault("filename", session_id)
+        navigator = VesselNavigator()
+        navigator.setup_navigator(reference_map=self.get_map(arguments["reference_path"]), configure_logger=False,
+                                  **arguments)
+        session = NavigationSession(session_id, navigator)
+        self.sessions[session_id] = session
+        return session
+
+    def get_session(self, message: dict) -> NavigationSession:
+        if message.get("session") not in self.sessions:
+            raise KeyError("Unknown session " + str(message.get("session")))
+        return self.sessions[message["session"]]
+
+    async def handle_message(self, message: dict) -> dict:
+        message_type = message.get("type")
+        if message_type == "update":
+            session = self.get_session(message)
+            future = asyncio.get_running_loop().create_future()
+            await self.pending_updates.put((session, float(message["displacement"]), float(message["impedance"]),
+                                            time.perf_counter(), future))
+            return await future
+        if message_type == "open":
+            loop = asyncio.get_running_loop()
+            session = await loop.run_in_executor(self.executor, self.open_session, message.get("config", {}),
+                                                 message.get("session"))
+            return {"session": session.session_id}
+        if message_type == "stats":
+            return self.get_session(message).get_stats()
+        if message_type == "close":
+            session = self.get_session(message)
+            del self.sessions[session.session_id]
+            await asyncio.get_running_loop().run_in_executor(self.executor, session.close)
+            return session.get_stats()
+        if message_type == "service_stats":
+            return {"number_of_sessions": len(self.sessions),
+                    "number_of_batches": self.number_of_batches,
+                    "number_of_updates": self.number_of_updates}
+        raise ValueError("Unknown message type " + str(message_type))
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    response = await self.handle_message(message)
+                    if "id" in message:
+                        response["id"] = message["id"]
+                except Exception as error:
+                    response = {"error": type(error).__name__ + ": " + str(error)}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def collect_batch(self) -> list:
+        batch = [await self.pending_updates.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            if not self.pending_updates.empty():
+                batch.append(self.pending_updates.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.pending_updates.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    @staticmethod
+    def run_session_updates(session: NavigationSession, updates: list) -> list:
+        results = []
+        for displacement, impedance, received in updates:
+            try:
+                results.append(session.update(displacement, impedance, received))
+            except Exception as error:
+                results.append(error)
+        return results
+
+    async def dispatch_updates(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.collect_batch()
+            updates_per_session = {}
+            for session, displacement, impedance, received, future in batch:
+                updates_per_session.setdefault(session, []).append((displacement, impedance, received, future))
+            sessions = list(updates_per_session.keys())
+            results = await asyncio.gather(*[
+                loop.run_in_executor(self.executor, self.run_session_updates, session,
+                                     [update[:3] for update in updates_per_session[session]])
+                for session in sessions])
+            for session, session_results in zip(sessions, results):
+                for update, result in zip(updates_per_session[session], session_results):
+                    future = update[3]
+                    if future.cancelled():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+            self.number_of_batches += 1
+            self.number_of_updates += len(batch)
+
+
+async def serve(host: str, port: int, unix_socket: str, number_of_workers: int, max_batch_size: int,
+                batch_window: float) -> None:
+    service = NavigationService(number_of_workers=number_of_workers, max_batch_size=max_batch_size,
+                                batch_window=batch_window)
+    await service.start(host=host, port=port, unix_socket=unix_socket)
+    print("navigation service listening on " + (unix_socket if unix_socket else host + ":" + str(service.get_port())),
+          flush=True)
+    try:
+        await asyncio.gather(*[server.serve_forever() for server in service.servers])
+    finally:
+        await service.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="host navigator sessions behind a local socket")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-socket", default=None)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    parser.add_argument("--batch-window", type=float, default=0.0, help="seconds to wait for further updates")
+    parser.add_argument("--loglevel", default="WARNING")
+    arguments = parser.parse_args()
+    logging.basicConfig(level=arguments.loglevel, format="%(asctime)s %(levelname)-8s %(message)s")
+    try:
+        asyncio.run(serve(arguments.host, arguments.port, arguments.unix_socket, arguments.workers,
+                          arguments.max_batch_size, arguments.batch_window))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
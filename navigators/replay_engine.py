@@ -0,0 +1,253 @@
+import argparse
+import itertools
+import logging
+import os
+import time
+
+import numpy as np
+
+from navigators.vessel_navigator import VesselNavigator
+from utils.particle_filter_component_enums import MeasurementType, InjectorType, ParticleSetType, DTWEngine, \
+    ResamplerType
+from utils.position_estimate import PositionEstimate
+
+"""
+The ReplayEngine reprocesses a recorded intervention offline. The RecordingReader streams the displacement and
+impedance measurements of a recording in chunks: .npy recordings are memory mapped and sliced, CSV recordings are
+parsed chunk by chunk. Each chunk is fed step by step through the update_step of a configured VesselNavigator, and
+the position estimates of the chunk are written by the EstimateWriter before the next chunk is read, so the memory
+use does not depend on the length of the recording.
+The EstimateWriter stores one row per step with the two largest clusters of the position estimate. It writes either
+a CSV file or a directory of .npz chunk files with one array per column, which load_replay_estimates concatenates.
+Run from the repository root:
+    python -m navigators.replay_engine --map map.json --recording recording.csv --output estimates.csv
+"""
+
+ESTIMATE_COLUMNS = ["step", "displacement_measurement", "impedance_measurement", "number_of_clusters",
+                    "first_branch", "first_center", "first_error", "first_number_of_particles",
+                    "second_branch", "second_center", "second_error", "second_number_of_particles",
+                    "average_alpha"]
+
+
+class RecordingReader:
+    """
+    @param displacement_path: .npy or .csv file; a file with two columns holds displacements and impedances
+    @param impedance_path: .npy or .csv file with the impedances, if they are not part of the first file
+    @param chunk_size: number of steps per chunk
+    @param delimiter: delimiter of the CSV files
+    """
+
+    def __init__(self, displacement_path: str, impedance_path: str = None, chunk_size: int = 10_000,
+                 delimiter: str = ",") -> None:
+        if chunk_size < 1:
+            raise ValueError("chunk size must be at least 1")
+        self.displacement_path = displacement_path
+        self.impedance_path = impedance_path
+        self.chunk_size = chunk_size
+        self.delimiter = delimiter
+
+    def __iter__(self):
+        if self.impedance_path is None:
+            for chunk in self.read_chunks(self.displacement_path):
+                if chunk.shape[1] < 2:
+                    raise ValueError("a single recording file needs a displacement and an impedance column")
+                yield chunk[:, 0], chunk[:, 1]
+            return
+        for displacements, impedances in itertools.zip_longest(self.read_chunks(self.displacement_path),
+                                                               self.read_chunks(self.impedance_path)):
+            if displacements is None or impedances is None or len(displacements) != len(impedances):
+                raise ValueError("displacement and impedance recordings differ in length")
+            yield displacements[:, 0], impedances[:, 0]
+
+    def read_chunks(self, path: str):
+        if path.endswith(".npy"):
+            return self.read_npy_chunks(path)
+        if path.endswith(".csv") or path.endswith(".txt"):
+            return self.read_csv_chunks(path)
+        raise ValueError("recordings must be .npy or .csv files: " + path)
+
+    def read_npy_chunks(self, path: str):
+        recording = np.load(path, mmap_mode="r")
+        if recording.ndim == 1:
+            recording = recording.reshape(-1, 1)
+        for start in range(0, len(recording), self.chunk_size):
+            yield np.array(recording[start:start + self.chunk_size], dtype=np.float64)
+
+    def read_csv_chunks(self, path: str):
+        with open(path) as infile:
+            lines = []
+            for line_number, line in enumerate(infile):
+                if not line.strip():
+                    continue
+                if line_number == 0 and not self.is_numeric_row(line):
+                    continue
+                lines.append(line)
+                if len(lines) == self.chunk_size:
+                    yield np.loadtxt(lines, delimiter=self.delimiter, ndmin=2)
+                    lines = []
+            if lines:
+                yield np.loadtxt(lines, delimiter=self.delimiter, ndmin=2)
+
+    def is_numeric_row(self, line: str) -> bool:
+        try:
+            [float(value) for value in line.split(self.delimiter)]
+        except ValueError:
+            return False
+        return True
+
+
+class EstimateWriter:
+    """
+    @param output_path: a path ending with .csv is written as CSV file, any other path as directory of .npz chunks
+    """
+
+    def __init__(self, output_path: str) -> None:
+        self.output_path = output_path
+        self.number_of_chunks = 0
+        self.csv_file = None
+        if output_path.endswith(".csv"):
+            self.csv_file = open(output_path, "w")
+            self.csv_file.write(",".join(ESTIMATE_COLUMNS) + "\n")
+        else:
+            os.makedirs(output_path, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_chunk(self, columns: dict) -> None:
+        if self.csv_file is not None:
+            np.savetxt(self.csv_file, np.column_stack([columns[column] for column in ESTIMATE_COLUMNS]),
+                       delimiter=",", fmt="%.10g")
+            self.csv_file.flush()
+        else:
+            np.savez(os.path.join(self.output_path, "estimates_" + str(self.number_of_chunks).zfill(6) + ".npz"),
+                     **columns)
+        self.number_of_chunks += 1
+
+    def close(self) -> None:
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = None
+
+
+def load_replay_estimates(output_path: str) -> dict:
+    if output_path.endswith(".csv"):
+        table = np.loadtxt(output_path, delimiter=",", skiprows=1, ndmin=2)
+        return {column: table[:, i] for i, column in enumerate(ESTIMATE_COLUMNS)}
+    chunks = []
+    for filename in sorted(os.listdir(output_path)):
+        if filename.startswith("estimates_") and filename.endswith(".npz"):
+            with np.load(os.path.join(output_path, filename)) as chunk:
+                chunks.append({column: chunk[column] for column in ESTIMATE_COLUMNS})
+    return {column: np.concatenate([chunk[column] for chunk in chunks]) if chunks else np.array([])
+            for column in ESTIMATE_COLUMNS}
+
+
+class ReplayEngine:
+    """
+    @param navigator: set up navigator through which the recording is replayed
+    @param progress_callback: called after each chunk with the number of replayed steps and the steps per second
+    """
+
+    def __init__(self, navigator: VesselNavigator, progress_callback=None) -> None:
+        self.navigator = navigator
+        self.progress_callback = progress_callback
+
+    @staticmethod
+    def get_estimate_row(position_estimate: PositionEstimate) -> list:
+        clusters = []
+        for first_or_second in [position_estimate.get_first_cluster(), position_estimate.get_second_cluster()]:
+            if first_or_second is None:
+                clusters += [-1, np.nan, np.nan, 0]
+            else:
+                clusters += [first_or_second.get_branch(), first_or_second.get_center(),
+                             first_or_second.get_error(), first_or_second.get_number_of_particles()]
+        number_of_clusters = sum(len(branch_clusters) for branch_clusters in position_estimate.get_clusters().values())
+        return [number_of_clusters] + clusters
+
+    def replay_chunk(self, first_step: int, displacements: np.ndarray, impedances: np.ndarray) -> dict:
+        rows = []
+        for displacement, impedance in zip(displacements, impedances):
+            position_estimate = self.navigator.update_step(displacement=float(displacement), impedance=float(impedance))
+            rows.append(self.get_estimate_row(position_estimate) + [self.navigator.get_current_average_alpha()])
+        rows = np.array(rows, dtype=np.float64).reshape(-1, len(ESTIMATE_COLUMNS) - 3)
+        columns = {"step": np.arange(first_step, first_step + len(displacements)),
+                   "displacement_measurement": np.asarray(displacements, dtype=np.float64),
+                   "impedance_measurement": np.asarray(impedances, dtype=np.float64)}
+        for i, column in enumerate(ESTIMATE_COLUMNS[3:]):
+            columns[column] = rows[:, i]
+        for column in ["number_of_clusters", "first_branch", "first_number_of_particles",
+                       "second_branch", "second_number_of_particles"]:
+            columns[column] = columns[column].astype(np.int64)
+        return columns
+
+    def replay(self, reader: RecordingReader, writer: EstimateWriter) -> dict:
+        """
+        @return: number of replayed steps, replay duration in seconds and throughput in steps per second
+        """
+        number_of_steps = 0
+        start = time.perf_counter()
+        for displacements, impedances in reader:
+            writer.write_chunk(self.replay_chunk(number_of_steps, displacements, impedances))
+            number_of_steps += len(displacements)
+            if self.progress_callback is not None:
+                self.progress_callback(number_of_steps, number_of_steps / (time.perf_counter() - start))
+        duration = time.perf_counter() - start
+        return {"number_of_steps": number_of_steps,
+                "duration": duration,
+                "steps_per_second": number_of_steps / duration if duration > 0 else 0.0}
+
+
+def print_progress(number_of_steps: int, steps_per_second: float) -> None:
+    print(f'replayed {number_of_steps} steps ({steps_per_second:.1f} steps/s)', flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replay a recorded intervention through the particle filter")
+    parser.add_argument("--map", required=True, help="vessel centerline map (.json)")
+    parser.add_argument("--recording", required=True,
+                        help=".npy or .csv file with displacement and impedance columns, or the displacements only")
+    parser.add_argument("--impedances", default=None, help=".npy or .csv file with the impedances")
+    parser.add_argument("--output", required=True, help=".csv file or directory of .npz chunks for the estimates")
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    parser.add_argument("--delimiter", default=",")
+    parser.add_argument("--measurement-type", default="AHISTORIC", choices=[t.name for t in MeasurementType])
+    parser.add_argument("--injector-type", default="ALPHA_VARIANCE", choices=[t.name for t in InjectorType])
+    parser.add_argument("--particle-set-type", default="ARRAY", choices=[t.name for t in ParticleSetType])
+    parser.add_argument("--dtw-engine", default="BATCHED", choices=[t.name for t in DTWEngine])
+    parser.add_argument("--resampler-type", default="LOW_VARIANCE", choices=[t.name for t in ResamplerType])
+    parser.add_argument("--resampling-threshold", type=float, default=None)
+    parser.add_argument("--particles", type=int, default=1000)
+    parser.add_argument("--alpha-center", type=float, default=2.0)
+    parser.add_argument("--initial-branch", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--log-directory", default=".")
+    arguments = parser.parse_args()
+
+    navigator = VesselNavigator()
+    navigator.setup_navigator(reference_path=arguments.map,
+                              log_destination_path=os.path.join(arguments.log_directory, ""),
+                              filename="replay",
+                              measurement_type=MeasurementType[arguments.measurement_type],
+                              injector_type=InjectorType[arguments.injector_type],
+                              number_of_particles=arguments.particles,
+                              initial_branch=arguments.initial_branch,
+                              alpha_center=arguments.alpha_center,
+                              loglevel=logging.WARNING,
+                              particle_set_type=ParticleSetType[arguments.particle_set_type],
+                              dtw_engine=DTWEngine[arguments.dtw_engine],
+                              resampling_threshold=arguments.resampling_threshold,
+                              resampler_type=ResamplerType[arguments.resampler_type],
+                              seed=arguments.seed)
+    reader = RecordingReader(arguments.recording, arguments.impedances, arguments.chunk_size, arguments.delimiter)
+    with EstimateWriter(arguments.output) as writer:
+        summary = ReplayEngine(navigator, progress_callback=print_progress).replay(reader, writer)
+    print(f'replayed {summary["number_of_steps"]} steps in {summary["duration"]:.2f} s '
+          f'({summary["steps_per_second"]:.1f} steps/s)')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 import logging
 from filter.model3D import Model3D
+from utils.map3D import Map3D
 from utils.position_estimate import PositionEstimate
-from utils.particle_filter_component_enums import MeasurementType, InjectorType
+from utils.particle_filter_component_enums import MeasurementType, InjectorType, ParticleSetType, DTWEngine, \
+    ResamplerType, WeightingMode, WeightingExecutorType
 
 
 class VesselNavigator:
@@ -23,23 +25,67 @@ class VesselNavigator:
                         initial_position_variance: float = 0.5,
                         alpha_center: float = 2.0,
                         alpha_variance: float = 0.1,
-                        loglevel=logging.INFO
+                        loglevel=logging.INFO,
+                        particle_set_type: ParticleSetType = ParticleSetType.OBJECT,
+                        dtw_engine: DTWEngine = DTWEngine.TSLEARN,
+                        sakoe_chiba_radius: int = None,
+                        history_length: int = 20,
+                        resampling_threshold: float = None,
+                        resampler_type: ResamplerType = ResamplerType.LOW_VARIANCE,
+                        min_number_of_particles: int = 100,
+                        max_number_of_particles: int = 10_000,
+                        weighting_mode: WeightingMode = WeightingMode.INVERSE,
+                        likelihood_scale: float = 1.0,
+                        injection_fraction: float = 0.05,
+                        reference_map: Map3D = None,
+                        configure_logger: bool = True,
+                        seed=None,
+                        number_of_shards: int = 1,
+                        exchange_interval: int = 10,
+                        exchange_fraction: float = 0.05,
+                        weighting_executor: WeightingExecutorType = WeightingExecutorType.SERIAL,
+                        number_of_weighting_workers: int = None,
+                        reference_cache_resolution: float = None
                         ):
         self.model = Model3D()
         self.model.setup_particle_filter(map_path=reference_path,
                                          measurement_model=measurement_type,
                                          injector_type=injector_type,
-                                         alpha_center=alpha_center)
+                                         alpha_center=alpha_center,
+                                         dtw_engine=dtw_engine,
+                                         sakoe_chiba_radius=sakoe_chiba_radius,
+                                         history_length=history_length,
+                                         resampling_threshold=resampling_threshold,
+                                         resampler_type=resampler_type,
+                                         min_number_of_particles=min_number_of_particles,
+                                         max_number_of_particles=max_number_of_particles,
+                                         weighting_mode=weighting_mode,
+                                         likelihood_scale=likelihood_scale,
+                                         injection_fraction=injection_fraction,
+                                         map3D=reference_map,
+                                         seed=seed,
+                                         number_of_shards=number_of_shards,
+                                         exchange_interval=exchange_interval,
+                                         exchange_fraction=exchange_fraction,
+                                         weighting_executor=weighting_executor,
+                                         number_of_weighting_workers=number_of_weighting_workers,
+                                         reference_cache_resolution=reference_cache_resolution)
         self.model.setup_particles(number_of_particles=number_of_particles,
                                    initial_position_center=initial_position_center,
                                    initial_position_variance=initial_position_variance,
                                    alpha_center=alpha_center,
                                    alpha_variance=alpha_variance,
-                                   initial_branch=initial_branch
+                                   initial_branch=initial_branch,
+                                   particle_set_type=particle_set_type
                                    )
-        self.model.setup_logger(loglevel=loglevel,
-                                log_directory=log_destination_path,
-                                filename=filename + "_log")
+        if configure_logger:
+            self.model.setup_logger(loglevel=loglevel,
+                                    log_directory=log_destination_path,
+                                    filename=filename + "_log")
+
+    def close(self) -> None:
+        if self.model is not None:
+            self.model.close()
 
     def get_current_particle_set(self):
         return self.model.get_particles()
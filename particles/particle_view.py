@@ -0,0 +1,81 @@
+from particles.particle import Particle3D, SlidingParticle3D
+from particles.state import State3D
+
+"""
+Particle and state views are lightweight adapters onto one row of an ArrayParticleSet. They expose the
+interface of Particle3D / SlidingParticle3D and State3D, but read and write the contiguous columns of the
+particle store instead of holding their own values. This way, strategies that iterate over particles keep
+working on an array-backed particle set. Deep copying a view returns a detached Particle3D or SlidingParticle3D.
+"""
+
+
+class StateView(State3D):
+    def __init__(self, store, index: int) -> None:
+        self._store = store
+        self._index = index
+
+    @property
+    def position(self) -> float:
+        return float(self._store.displacements[self._index])
+
+    @position.setter
+    def position(self, position: float):
+        self._store.displacements[self._index] = position
+
+    @property
+    def branch(self) -> int:
+        return int(self._store.branches[self._index])
+
+    @branch.setter
+    def branch(self, branch: int):
+        self._store.branches[self._index] = branch
+
+    @property
+    def alpha(self) -> float:
+        return float(self._store.alphas[self._index])
+
+    @alpha.setter
+    def alpha(self, alpha: float):
+        self._store.alphas[self._index] = alpha
+
+    def __deepcopy__(self, memo):
+        state = State3D(position=self.position, branch=self.branch, alpha=self.alpha)
+        state.set_alpha(self.alpha)
+        return state
+
+
+class ParticleView(Particle3D):
+    def __init__(self, store, index: int) -> None:
+        self._store = store
+        self._index = index
+
+    @property
+    def state(self) -> StateView:
+        return StateView(self._store, self._index)
+
+    @property
+    def weight(self) -> float:
+        return float(self._store.weights[self._index])
+
+    @weight.setter
+    def weight(self, weight: float):
+        self._store.weights[self._index] = weight
+
+    def __deepcopy__(self, memo):
+        return Particle3D(state=self.state.__deepcopy__(memo), weight=self.weight)
+
+
+class SlidingParticleView(ParticleView, SlidingParticle3D):
+
+    @property
+    def reference_history(self) -> list:
+        return self._store.reference_histories.get_row(self._index).tolist()
+
+    @reference_history.setter
+    def reference_history(self, reference_history: list):
+        self._store.reference_histories.set_row(self._index, reference_history)
+
+    def __deepcopy__(self, memo):
+        particle = SlidingParticle3D(state=self.state.__deepcopy__(memo), weight=self.weight)
+        particle.reference_history = list(self.reference_history)
+        return particle
@@ -1,4 +1,5 @@
-from numpy import random
+import numpy as np
+from utils.random_streams import default_random_generator
 
 
 class State:
@@ -19,11 +20,13 @@ class State:
             return self.position == other.position and self.alpha == other.alpha
         return False
 
-    def assign_random_alpha(self, center: float = 2, variance: float = 0.1):
-        self.alpha = random.normal(loc=center, scale=variance)
+    def assign_random_alpha(self, center: float = 2, variance: float = 0.1,
+                            random_generator: np.random.Generator = default_random_generator):
+        self.alpha = random_generator.normal(loc=center, scale=variance)
 
-    def assign_random_position(self, center: float = 0, variance: float = 0.1):
-        self.position = random.normal(loc=center, scale=variance)
+    def assign_random_position(self, center: float = 0, variance: float = 0.1,
+                               random_generator: np.random.Generator = default_random_generator):
+        self.position = random_generator.normal(loc=center, scale=variance)
 
     def get_position(self):
         return self.position
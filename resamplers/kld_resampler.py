@@ -0,0 +1,129 @@
+import copy
+import numpy as np
+from scipy.stats import norm
+from strategies.resampling_strategy import ResamplingStrategy
+from utils.array_particle_set import ArrayParticleSet
+from utils.particle_set import ParticleSet
+
+"""
+The KLDResampler adapts the number of particles to the complexity of the posterior (KLD sampling, Fox 2003).
+The particle states are binned by branch, displacement bin and alpha bin. Particles are drawn from the weighted
+particle set until their number suffices to bound the Kullback-Leibler divergence between the particle
+approximation and the posterior by epsilon with probability 1 - delta, given the number of occupied bins k:
+
+    n = (k - 1) / (2 * epsilon) * (1 - 2 / (9 * (k - 1)) + sqrt(2 / (9 * (k - 1))) * z_(1 - delta))^3
+
+The candidates are drawn in batches, each by low variance sampling and shuffled. The first batch holds the minimal
+number of particles and every further batch as many particles as were drawn before, up to the maximal number, so
+the sampling stops after about twice the number of particles the posterior requires. The particles of the weighted
+set are binned once, and the occupied bins are carried from batch to batch, so only the candidates of each batch are
+checked for new bins. The resampled set is the shortest prefix of the candidates that fulfills the bound, within the
+given limits.
+"""
+
+
+class KLDResampler(ResamplingStrategy):
+    """
+    @param min_number_of_particles: lower limit of the number of resampled particles
+    @param max_number_of_particles: upper limit of the number of resampled particles
+    @param epsilon: bound of the Kullback-Leibler divergence
+    @param delta: probability that the bound is violated
+    @param displacement_bin_size: size of the displacement bins in mm
+    @param alpha_bin_size: size of the alpha bins
+    """
+
+    def __init__(self,
+                 min_number_of_particles: int = 100,
+                 max_number_of_particles: int = 10_000,
+                 epsilon: float = 0.05,
+                 delta: float = 0.01,
+                 displacement_bin_size: float = 1.0,
+                 alpha_bin_size: float = 0.1):
+        if min_number_of_particles < 1 or max_number_of_particles < min_number_of_particles:
+            raise ValueError("the particle limits must fulfill 1 <= min_number_of_particles <= max_number_of_particles")
+        if epsilon <= 0 or not 0 < delta < 1:
+            raise ValueError("epsilon must be positive and delta between 0 and 1")
+        if displacement_bin_size <= 0 or alpha_bin_size <= 0:
+            raise ValueError("bin sizes must be positive")
+        self.min_number_of_particles = min_number_of_particles
+        self.max_number_of_particles = max_number_of_particles
+        self.epsilon = epsilon
+        self.z_quantile = norm.ppf(1 - delta)
+        self.displacement_bin_size = displacement_bin_size
+        self.alpha_bin_size = alpha_bin_size
+
+    def calculate_required_number_of_particles(self, number_of_bins: np.ndarray) -> np.ndarray:
+        k = np.maximum(number_of_bins - 1, 1)
+        a = 2 / (9 * k)
+        required = k / (2 * self.epsilon) * (1 - a + np.sqrt(a) * self.z_quantile) ** 3
+        return np.where(number_of_bins > 1, np.ceil(required), 0)
+
+    def calculate_bin_labels(self, particles: ParticleSet) -> np.ndarray:
+        """
+        @return: bin label of each particle, numbered from 0 to the number of occupied bins - 1
+        """
+        if isinstance(particles, ArrayParticleSet):
+            branches, displacements, alphas = particles.branches, particles.displacements, particles.alphas
+        else:
+            branches = np.array([particle.state.branch for particle in particles])
+            displacements = np.array([particle.state.position for particle in particles])
+            alphas = np.array([particle.state.alpha for particle in particles])
+        bins = np.stack([branches,
+                         np.floor(displacements / self.displacement_bin_size),
+                         np.floor(alphas / self.alpha_bin_size)], axis=1)
+        return np.unique(bins, axis=0, return_inverse=True)[1].reshape(-1)
+
+    @staticmethod
+    def calculate_cumulative_weights(weights: np.ndarray) -> np.ndarray:
+        total_weight = np.sum(weights)
+        if not total_weight > 0:
+            weights = np.ones(len(weights))
+            total_weight = len(weights)
+        return np.cumsum(weights) / total_weight
+
+    def draw_candidates(self, cumulative_weights: np.ndarray, number_of_candidates: int) -> np.ndarray:
+        random_generator = self.get_random_generator()
+        pointers = (random_generator.uniform(0, 1) + np.arange(number_of_candidates)) / number_of_candidates
+        candidates = np.minimum(np.searchsorted(cumulative_weights, pointers, side="left"),
+                                len(cumulative_weights) - 1)
+        return random_generator.permutation(candidates)
+
+    def select_particle_indices(self, weighted_particle_set: ParticleSet) -> np.ndarray:
+        cumulative_weights = self.calculate_cumulative_weights(weighted_particle_set.get_weights())
+        particle_labels = self.calculate_bin_labels(weighted_particle_set)
+        occupied = np.zeros(np.max(particle_labels) + 1, dtype=bool)
+        batches = []
+        number_of_candidates = 0
+        number_of_bins = 0
+        batch_size = self.min_number_of_particles
+        while True:
+            candidates = self.draw_candidates(cumulative_weights, batch_size)
+            labels = particle_labels[candidates]
+            unoccupied = np.flatnonzero(~occupied[labels])
+            opens_new_bin = np.zeros(batch_size, dtype=np.int64)
+            opens_new_bin[unoccupied[np.unique(labels[unoccupied], return_index=True)[1]]] = 1
+            bins = number_of_bins + np.cumsum(opens_new_bin)
+            number_of_particles = number_of_candidates + np.arange(1, batch_size + 1)
+            sufficient = (number_of_particles >= self.calculate_required_number_of_particles(bins)) \
+                & (number_of_particles >= self.min_number_of_particles)
+            if sufficient.any():
+                batches.append(candidates[:np.argmax(sufficient) + 1])
+                break
+            batches.append(candidates)
+            occupied[labels] = True
+            number_of_bins = bins[-1]
+            number_of_candidates += batch_size
+            if number_of_candidates >= self.max_number_of_particles:
+                break
+            batch_size = min(number_of_candidates, self.max_number_of_particles - number_of_candidates)
+        return np.concatenate(batches)
+
+    def resample(self, weighted_particle_set: ParticleSet) -> ParticleSet:
+        selected_indices = self.select_particle_indices(weighted_particle_set)
+        if isinstance(weighted_particle_set, ArrayParticleSet):
+            return weighted_particle_set.take(selected_indices)
+
+        resampled_particle_set = ParticleSet()
+        for index in selected_indices:
+            resampled_particle_set.append(particle=copy.deepcopy(weighted_particle_set[index]))
+        return resampled_particle_set
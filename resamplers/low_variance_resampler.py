@@ -1,11 +1,28 @@
 import copy
-import random
+import math
+import numpy as np
 from strategies.resampling_strategy import ResamplingStrategy
+from utils.array_particle_set import ArrayParticleSet
 from utils.particle_set import ParticleSet
 
+"""
+The LowVarianceResampler draws the new particle set with a single random root and n equidistant pointers into the
+cumulative weights. In the index based mode, the ancestor of each new particle is found for all pointers at once by a
+binary search in the cumulative weights. Otherwise, the cumulative weights are walked sequentially.
+Both modes select the same ancestors for the same random root. If the weights sum up to one and only the rounding of
+the cumulative sum leaves the last pointers beyond it, these pointers select the last particle. For an
+ArrayParticleSet, the ancestor indices are applied as a gather over the particle columns, an object based
+ParticleSet receives deep copies of the ancestors.
+"""
+
+CUMULATIVE_WEIGHT_TOLERANCE = 1e-9
+
 
 class LowVarianceResampler(ResamplingStrategy):
 
+    def __init__(self, index_based: bool = True):
+        self.index_based = index_based
+
     @staticmethod
     def generate_cumulative_weight_list(particle_set: ParticleSet) -> list:
         cumulative_weights = [particle_set[0].weight]
@@ -13,24 +30,54 @@ class LowVarianceResampler(ResamplingStrategy):
             cumulative_weights.append(cumulative_weights[index - 1] + particle_set[index].weight)
         return cumulative_weights
 
-    def resample(self, weighted_particle_set: ParticleSet) -> ParticleSet:
-        resampled_particle_set = ParticleSet()
+    def select_particle_indices(self, weighted_particle_set: ParticleSet) -> list:
+        selected_indices = []
 
         n = len(weighted_particle_set)
-        random_root = random.uniform(0, (1 / n))
+        random_root = self.get_random_generator().uniform(0, (1 / n))
         cumulative_weights = self.generate_cumulative_weight_list(particle_set=weighted_particle_set)
+        if abs(cumulative_weights[-1] - 1) < CUMULATIVE_WEIGHT_TOLERANCE:
+            cumulative_weights[-1] = math.inf
         i = 0
         for j in range(0, n):
             accumulator = random_root + j * (1 / n)
             while accumulator > cumulative_weights[i]:
                 i += 1
                 if i > len(cumulative_weights)-1:
-                    if len(resampled_particle_set) < len(weighted_particle_set):
-                        resampled_particle_set.append(particle=copy.deepcopy(weighted_particle_set[0]))
-                        return resampled_particle_set
+                    if len(selected_indices) < len(weighted_particle_set):
+                        selected_indices.append(0)
+                        return selected_indices
                     else:
-                        return resampled_particle_set
-            resampled_particle_set.append(particle=copy.deepcopy(weighted_particle_set[i]))
+                        return selected_indices
+            selected_indices.append(i)
 
-        return resampled_particle_set
+        return selected_indices
 
+    @staticmethod
+    def calculate_ancestor_indices(weights: np.ndarray, random_root: float) -> np.ndarray:
+        n = len(weights)
+        cumulative_weights = np.cumsum(weights)
+        if n > 0 and abs(cumulative_weights[-1] - 1) < CUMULATIVE_WEIGHT_TOLERANCE:
+            cumulative_weights[-1] = np.inf
+        accumulators = random_root + np.arange(n) * (1 / n)
+        ancestor_indices = np.searchsorted(cumulative_weights, accumulators, side="left")
+        exceeding = np.flatnonzero(ancestor_indices >= n)
+        if len(exceeding) > 0:
+            # if the weights sum up to less than one, the sequential walk appends the first particle and stops
+            ancestor_indices = np.append(ancestor_indices[:exceeding[0]], 0)
+        return ancestor_indices
+
+    def resample(self, weighted_particle_set: ParticleSet) -> ParticleSet:
+        if self.index_based:
+            weights = weighted_particle_set.get_weights()
+            random_root = self.get_random_generator().uniform(0, (1 / len(weights)))
+            selected_indices = self.calculate_ancestor_indices(weights, random_root)
+        else:
+            selected_indices = self.select_particle_indices(weighted_particle_set)
+        if isinstance(weighted_particle_set, ArrayParticleSet):
+            return weighted_particle_set.take(selected_indices)
+
+        resampled_particle_set = ParticleSet()
+        for index in selected_indices:
+            resampled_particle_set.append(particle=copy.deepcopy(weighted_particle_set[index]))
+        return resampled_particle_set
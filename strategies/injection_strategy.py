@@ -1,15 +1,23 @@
 from abc import abstractmethod
+import numpy as np
 from utils.particle_set import ParticleSet
+from utils.random_streams import StochasticStrategy
 
 
-class InjectionStrategy:
+class InjectionStrategy(StochasticStrategy):
+
+    @staticmethod
+    def select_worst_particle_indices(weights: np.ndarray, number_of_particles: int) -> np.ndarray:
+        if number_of_particles <= 0:
+            return np.array([], dtype=np.int64)
+        if number_of_particles >= len(weights):
+            return np.arange(len(weights))
+        return np.argpartition(weights, number_of_particles - 1)[:number_of_particles]
 
     @staticmethod
     def remove_number_of_worst_particles(particles: ParticleSet,
                                          number_to_remove: int) -> ParticleSet:
-        particles.sort_descending_by_weight()
-        for index in range(number_to_remove):
-            particles.pop_last()
+        particles.delete(InjectionStrategy.select_worst_particle_indices(particles.get_weights(), number_to_remove))
         return particles
 
     @abstractmethod
@@ -1,16 +1,87 @@
 import sys
 from abc import abstractmethod
+import numpy as np
+from utils.particle_filter_component_enums import WeightingMode, WeightingExecutorType
 from utils.particle_set import ParticleSet
+from utils.reference_cache import ReferenceCache
+from utils.weighting_executor import WeightingExecutor
+
+"""
+The MeasurementStrategy turns the raw weights of the particles, i.e. the distances between measurement and
+reference prediction, into normalized weights in one vectorized pass over the weight array.
+In the INVERSE mode, the weights are the inverted raw weights, clamped to 10_000 for raw weights below 0.0001.
+In the LOG_LIKELIHOOD mode, each particle receives the log likelihood -raw_weight / likelihood_scale, and the
+weights are normalized with log-sum-exp, so they can neither underflow nor overflow.
+The raw weights are calculated by the weighting executor of the strategy, which runs the per-particle work serially
+by default, or in chunks on a thread or process pool. Single reference lookups of the strategy can be memoized in
+its own reference cache.
+"""
 
 
 class MeasurementStrategy:
 
+    def __init__(self,
+                 weighting_mode: WeightingMode = WeightingMode.INVERSE,
+                 likelihood_scale: float = 1.0):
+        if likelihood_scale <= 0:
+            raise ValueError("likelihood scale must be positive")
+        self.weighting_mode = weighting_mode
+        self.likelihood_scale = likelihood_scale
+        self.weighting_executor = WeightingExecutor(WeightingExecutorType.SERIAL)
+        self.reference_cache = None
+
+    def set_reference_cache(self, reference_cache: ReferenceCache = None) -> None:
+        self.reference_cache = reference_cache
+
+    def set_weighting_executor(self, weighting_executor: WeightingExecutor) -> None:
+        self.weighting_executor.close()
+        self.weighting_executor = weighting_executor
+
     def weight_particles(self, particles: ParticleSet, measurement: float):
         particles = self.raw_weight_particles(particles=particles, measurement=measurement)
-        particles = self.invert_raw_weights(particles=particles)
-        particles = self.normalize_particles(particles=particles)
+        particles.set_weights(self.calculate_weights(particles.get_weights()))
         return particles
 
+    def calculate_weights(self, raw_weights: np.ndarray) -> np.ndarray:
+        if self.weighting_mode == WeightingMode.LOG_LIKELIHOOD:
+            return self.normalize_log_weights(-np.asarray(raw_weights, dtype=np.float64) / self.likelihood_scale)
+        weights = self.calculate_inverse_weights(raw_weights)
+        normalizer = np.sum(weights)
+        if normalizer == 0:
+            normalizer = sys.float_info.max
+        return weights / normalizer
+
+    def calculate_log_normalizer(self, raw_weights: np.ndarray) -> float:
+        """
+        @return: logarithm of the sum of the unnormalized weights that calculate_weights divides by, -inf if all
+        weights vanish; used to normalize the weights of several particle sets against each other
+        """
+        if self.weighting_mode == WeightingMode.LOG_LIKELIHOOD:
+            log_weights = -np.asarray(raw_weights, dtype=np.float64) / self.likelihood_scale
+            log_weights = np.where(np.isnan(log_weights), -np.inf, log_weights)
+            maximum = np.max(log_weights, initial=-np.inf)
+            if not np.isfinite(maximum):
+                return -np.inf
+            return float(maximum + np.log(np.sum(np.exp(log_weights - maximum))))
+        normalizer = np.sum(self.calculate_inverse_weights(raw_weights))
+        return float(np.log(normalizer)) if normalizer > 0 else -np.inf
+
+    @staticmethod
+    def calculate_inverse_weights(raw_weights: np.ndarray) -> np.ndarray:
+        raw_weights = np.asarray(raw_weights, dtype=np.float64)
+        weights = np.full(len(raw_weights), 10_000, dtype=np.float64)
+        invertible = raw_weights > 0.0001
+        weights[invertible] = 1 / raw_weights[invertible]
+        return weights
+
+    @staticmethod
+    def normalize_log_weights(log_weights: np.ndarray) -> np.ndarray:
+        log_weights = np.where(np.isnan(log_weights), -np.inf, log_weights)
+        maximum = np.max(log_weights, initial=-np.inf)
+        if not np.isfinite(maximum):
+            return np.full(len(log_weights), 1 / max(len(log_weights), 1))
+        weights = np.exp(log_weights - maximum)
+        return weights / np.sum(weights)
 
     @abstractmethod
     def raw_weight_particles(self, particles: ParticleSet, measurement: float) -> ParticleSet:
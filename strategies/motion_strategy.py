@@ -1,9 +1,10 @@
 from abc import abstractmethod
 from utils.particle_set import ParticleSet
+from utils.random_streams import StochasticStrategy
 from scipy.stats import sem
 
 
-class MotionStrategy:
+class MotionStrategy(StochasticStrategy):
 
     @abstractmethod
     def move_particles(self, previous_particle_set: ParticleSet,
@@ -1,8 +1,9 @@
 from abc import abstractmethod
 from utils.particle_set import ParticleSet
+from utils.random_streams import StochasticStrategy
 
 
-class ResamplingStrategy:
+class ResamplingStrategy(StochasticStrategy):
     @abstractmethod
     def resample(self, particles: ParticleSet) -> ParticleSet:
         raise NotImplementedError
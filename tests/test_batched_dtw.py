@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from tslearn.metrics import dtw
+
+from utils.batched_dtw import BatchedDTW
+
+"""
+Checks the distances of the BatchedDTW against per-series calls of tslearn.metrics.dtw, without and with Sakoe-Chiba
+band, for single and many series and for series and histories of unequal length.
+"""
+
+RADII = [None, 0, 1, 2, 5]
+
+
+def tslearn_distances(series: np.ndarray, histories, radius: int) -> np.ndarray:
+    if radius is None:
+        return np.array([dtw(series, history) for history in histories])
+    return np.array([dtw(series, history, global_constraint="sakoe_chiba", sakoe_chiba_radius=radius)
+                     for history in histories])
+
+
+@pytest.mark.parametrize("radius", RADII)
+@pytest.mark.parametrize("number_of_histories", [1, 50])
+@pytest.mark.parametrize("length_series, length_histories", [(20, 20), (20, 17), (15, 20), (1, 4), (4, 1)])
+def test_distances_match_tslearn(radius, number_of_histories, length_series, length_histories):
+    generator = np.random.default_rng(length_series * 100 + length_histories)
+    series = generator.normal(size=length_series)
+    histories = generator.normal(size=(number_of_histories, length_histories))
+    batched = BatchedDTW(sakoe_chiba_radius=radius).distances(series, histories)
+    np.testing.assert_allclose(batched, tslearn_distances(series, histories, radius), rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize("radius", RADII)
+def test_distances_match_tslearn_across_chunks(radius):
+    generator = np.random.default_rng(1)
+    series = generator.normal(size=12)
+    histories = generator.normal(size=(23, 10))
+    batched = BatchedDTW(sakoe_chiba_radius=radius, chunk_size=5).distances(series, histories)
+    np.testing.assert_allclose(batched, tslearn_distances(series, histories, radius), rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize("radius", RADII)
+def test_series_list_of_unequal_lengths_matches_tslearn(radius):
+    generator = np.random.default_rng(2)
+    series = generator.normal(size=10)
+    histories = [generator.normal(size=length) for length in [10, 3, 7, 10, 1, 12, 7]]
+    batched = BatchedDTW(sakoe_chiba_radius=radius).distances_to_series_list(series, histories)
+    np.testing.assert_allclose(batched, tslearn_distances(series, histories, radius), rtol=1e-9, atol=1e-12)
+
+
+def test_identical_series_have_zero_distance():
+    series = np.linspace(0.0, 1.0, 8)
+    assert np.array_equal(BatchedDTW().distances(series, np.tile(series, (3, 1))), np.zeros(3))
+
+
+def test_invalid_arguments_are_rejected():
+    with pytest.raises(ValueError):
+        BatchedDTW(sakoe_chiba_radius=-1)
+    with pytest.raises(ValueError):
+        BatchedDTW().distances(np.zeros(3), np.zeros(3))
+    with pytest.raises(ValueError):
+        BatchedDTW().distances(np.zeros(0), np.zeros((2, 3)))
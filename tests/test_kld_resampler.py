@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from resamplers.kld_resampler import KLDResampler
+from utils.array_particle_set import ArrayParticleSet
+
+"""
+Checks that the KLDResampler draws its candidates in growing batches and stops at the first batch that fulfills the
+KLD bound, so a concentrated posterior is resampled with few candidates, and that the number of resampled particles
+stays within the limits and fulfills the bound for the bins it occupies.
+"""
+
+
+class CountingKLDResampler(KLDResampler):
+
+    def __init__(self, **options) -> None:
+        super().__init__(**options)
+        self.batch_sizes = []
+
+    def draw_candidates(self, cumulative_weights: np.ndarray, number_of_candidates: int) -> np.ndarray:
+        self.batch_sizes.append(number_of_candidates)
+        return super().draw_candidates(cumulative_weights, number_of_candidates)
+
+
+def create_particles(displacements, weights=None) -> ArrayParticleSet:
+    displacements = np.asarray(displacements, dtype=np.float64)
+    if weights is None:
+        weights = np.full(len(displacements), 1 / len(displacements))
+    return ArrayParticleSet(displacements=displacements, alphas=np.full(len(displacements), 1.05), weights=weights)
+
+
+def create_resampler(seed: int = 0, **options) -> CountingKLDResampler:
+    resampler = CountingKLDResampler(**options)
+    resampler.set_random_generator(np.random.default_rng(seed))
+    return resampler
+
+
+def count_bins(resampler: KLDResampler, particles: ArrayParticleSet) -> int:
+    return len(np.unique(resampler.calculate_bin_labels(particles)))
+
+
+def test_concentrated_posterior_draws_only_the_first_batch():
+    resampler = create_resampler(min_number_of_particles=50, max_number_of_particles=10_000)
+    resampled = resampler.resample(create_particles(np.linspace(0.0, 0.9, 500)))
+    assert len(resampled) == 50
+    assert resampler.batch_sizes == [50]
+
+
+def test_batches_double_until_the_bound_is_met():
+    resampler = create_resampler(min_number_of_particles=20, max_number_of_particles=100_000)
+    resampled = resampler.resample(create_particles(np.linspace(0.0, 199.9, 2000)))
+    assert resampler.batch_sizes == [20] + [20 * 2 ** index for index in range(len(resampler.batch_sizes) - 1)]
+    assert len(resampled) <= sum(resampler.batch_sizes)
+    assert len(resampled) > sum(resampler.batch_sizes[:-1])
+    required = resampler.calculate_required_number_of_particles(np.array([count_bins(resampler, resampled)]))[0]
+    assert len(resampled) >= required
+    assert len(resampled) < 100_000
+
+
+def test_limits_are_respected():
+    particles = create_particles(np.linspace(0.0, 999.9, 10_000))
+    resampler = create_resampler(min_number_of_particles=30, max_number_of_particles=500)
+    resampled = resampler.resample(particles)
+    assert len(resampled) == 500
+    assert sum(resampler.batch_sizes) == 500
+    assert resampler.batch_sizes == [30, 30, 60, 120, 240, 20]
+    resampler = create_resampler(min_number_of_particles=200, max_number_of_particles=200)
+    assert len(resampler.resample(particles)) == 200
+    assert resampler.batch_sizes == [200]
+
+
+def test_candidates_follow_the_weights():
+    weights = np.zeros(100)
+    weights[[10, 70]] = [0.25, 0.75]
+    resampler = create_resampler(min_number_of_particles=400, max_number_of_particles=400)
+    resampled = resampler.resample(create_particles(np.arange(100), weights))
+    assert np.count_nonzero(resampled.displacements == 10) == 100
+    assert np.count_nonzero(resampled.displacements == 70) == 300
+
+
+def test_zero_weights_are_resampled_uniformly():
+    resampler = create_resampler(min_number_of_particles=100, max_number_of_particles=100)
+    resampled = resampler.resample(create_particles(np.arange(100), np.zeros(100)))
+    np.testing.assert_array_equal(np.sort(resampled.displacements), np.arange(100))
+
+
+@pytest.mark.parametrize("particle_set_type", ["ARRAY", "OBJECT"])
+def test_seeded_resampling_is_reproducible(particle_set_type):
+    particles = create_particles(np.linspace(0.0, 99.9, 1000))
+    if particle_set_type == "OBJECT":
+        particles = particles.to_particle_set()
+    runs = []
+    for _ in range(2):
+        resampled = create_resampler(seed=3, min_number_of_particles=20).resample(particles)
+        runs.append([particle.state.position for particle in resampled] if particle_set_type == "OBJECT"
+                    else resampled.displacements)
+    np.testing.assert_array_equal(runs[0], runs[1])
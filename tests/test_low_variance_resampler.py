@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+
+from resamplers.low_variance_resampler import LowVarianceResampler
+from utils.array_particle_set import ArrayParticleSet
+
+"""
+Checks that the index based ancestor selection of the LowVarianceResampler selects the same ancestors as the
+sequential walk over the cumulative weights for the same random root, including the edge cases of the walk, and that
+the gather over an ArrayParticleSet copies the history rows of the ancestors.
+"""
+
+# weights that sum up to one, whose cumulative sum rounds to 0.9999999999999998
+ROUNDED_WEIGHTS = [0.08253646383588481, 0.086423407735426, 0.07510477341493792, 0.06582141708349908,
+                   0.05209707297368502, 0.0219273406092448, 0.060633072761378144, 0.01486934213004106,
+                   0.020590844058432298, 0.06877179475992698, 0.05046300794491922, 0.013446468449762128,
+                   0.03044147925862322, 0.08114778700591802, 0.009158313737512455, 0.067965320609154,
+                   0.07780512133519554, 0.00882078688835782, 0.0759583437056462, 0.03601784170245514]
+
+
+class FixedRootGenerator:
+    """
+    @param random_root: value returned by every draw, so the sequential walk uses a given random root
+    """
+
+    def __init__(self, random_root: float) -> None:
+        self.random_root = random_root
+
+    def uniform(self, low: float, high: float) -> float:
+        return self.random_root
+
+
+def sequential_ancestor_indices(weights, random_root: float) -> np.ndarray:
+    resampler = LowVarianceResampler(index_based=False)
+    resampler.set_random_generator(FixedRootGenerator(random_root))
+    particles = ArrayParticleSet(displacements=np.arange(len(weights)), weights=weights).to_particle_set()
+    return np.array(resampler.select_particle_indices(particles), dtype=np.int64)
+
+
+def get_random_roots(number_of_particles: int) -> list:
+    return [0.0, 0.5 / number_of_particles, np.nextafter(1 / number_of_particles, 0)]
+
+
+def assert_same_ancestors(weights, random_root: float) -> np.ndarray:
+    weights = np.asarray(weights, dtype=np.float64)
+    ancestor_indices = LowVarianceResampler.calculate_ancestor_indices(weights, random_root)
+    np.testing.assert_array_equal(ancestor_indices, sequential_ancestor_indices(weights, random_root))
+    return ancestor_indices
+
+
+@pytest.mark.parametrize("number_of_particles", [1, 2, 3, 10, 49, 100])
+def test_uniform_weights(number_of_particles):
+    weights = np.full(number_of_particles, 1 / number_of_particles)
+    for random_root in get_random_roots(number_of_particles):
+        assert_same_ancestors(weights, random_root)
+    np.testing.assert_array_equal(assert_same_ancestors(weights, 0.5 / number_of_particles),
+                                  np.arange(number_of_particles))
+
+
+@pytest.mark.parametrize("dominant_index", [0, 4, 9])
+def test_dominant_particle_is_selected_for_all_pointers(dominant_index):
+    weights = np.full(10, 1e-12)
+    weights[dominant_index] = 1 - 9e-12
+    for random_root in get_random_roots(10):
+        ancestor_indices = assert_same_ancestors(weights, random_root)
+        assert np.count_nonzero(ancestor_indices == dominant_index) >= 9
+
+
+def test_single_particle_is_selected():
+    for random_root in get_random_roots(1):
+        np.testing.assert_array_equal(assert_same_ancestors([1.0], random_root), [0])
+
+
+def test_zero_weights_select_the_first_particle_only():
+    for random_root in get_random_roots(5)[1:]:
+        np.testing.assert_array_equal(assert_same_ancestors(np.zeros(5), random_root), [0])
+
+
+def test_weights_below_one_stop_at_the_first_particle():
+    weights = np.full(10, 0.09)
+    ancestor_indices = assert_same_ancestors(weights, np.nextafter(0.1, 0))
+    assert ancestor_indices[-1] == 0
+    assert len(ancestor_indices) < len(weights)
+
+
+def test_rounded_cumulative_weights_select_the_last_particle():
+    weights = np.array(ROUNDED_WEIGHTS)
+    assert np.cumsum(weights)[-1] < 1
+    for random_root in get_random_roots(len(weights)):
+        assert len(assert_same_ancestors(weights, random_root)) == len(weights)
+    # the last pointer lies beyond the rounded cumulative sum
+    ancestor_indices = assert_same_ancestors(weights, np.nextafter(1 / len(weights), 0))
+    assert ancestor_indices[-1] == len(weights) - 1
+
+
+def test_random_weights_select_the_same_ancestors():
+    generator = np.random.default_rng(0)
+    for _ in range(200):
+        number_of_particles = int(generator.integers(1, 60))
+        weights = generator.random(number_of_particles) ** generator.integers(1, 8)
+        weights /= weights.sum()
+        for random_root in get_random_roots(number_of_particles) + [generator.uniform(0, 1 / number_of_particles)]:
+            ancestor_indices = assert_same_ancestors(weights, random_root)
+            assert len(ancestor_indices) == number_of_particles
+            assert np.all(np.diff(ancestor_indices) >= 0)
+
+
+def test_resample_is_equal_for_both_modes_with_the_same_generator():
+    generator = np.random.default_rng(1)
+    weights = generator.random(50)
+    particles = ArrayParticleSet(displacements=np.arange(50), weights=weights / weights.sum())
+    index_based = LowVarianceResampler(index_based=True)
+    index_based.set_random_generator(np.random.default_rng(2))
+    sequential = LowVarianceResampler(index_based=False)
+    sequential.set_random_generator(np.random.default_rng(2))
+    np.testing.assert_array_equal(index_based.resample(particles).displacements,
+                                  sequential.resample(particles).displacements)
+
+
+def test_take_gathers_history_rows_without_aliasing():
+    particles = ArrayParticleSet(displacements=np.arange(4), weights=np.full(4, 0.25), sliding=True,
+                                 history_length=3)
+    for index in range(4):
+        particles.reference_histories.set_row(index, np.arange(index + 1) + 10 * index)
+    resampled = particles.take(np.array([2, 2, 0, 3]))
+    for row, ancestor in enumerate([2, 2, 0, 3]):
+        np.testing.assert_array_equal(resampled.reference_histories.get_row(row),
+                                      particles.reference_histories.get_row(ancestor))
+        assert resampled.displacements[row] == ancestor
+    assert not np.shares_memory(resampled.reference_histories.data, particles.reference_histories.data)
+    assert not np.shares_memory(resampled.displacements, particles.displacements)
+    resampled.reference_histories.set_row(0, [-1.0, -2.0])
+    resampled.reference_histories.append(np.full(4, 99.0))
+    np.testing.assert_array_equal(particles.reference_histories.get_row(2), [20, 21, 22])
+    np.testing.assert_array_equal(resampled.reference_histories.get_row(1), [21, 22, 99])
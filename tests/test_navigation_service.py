@@ -0,0 +1,74 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic_data import generate_vessel_tree, save_vessel_tree
+from navigators.navigation_service import NavigationService
+from utils.map3D import Map3D
+
+"""
+Checks that the sessions of the NavigationService share one read-only map per path, also when they are opened
+concurrently, and that the config of a session cannot set the arguments reserved for the service.
+"""
+
+
+@pytest.fixture
+def map_path(tmp_path):
+    return save_vessel_tree(generate_vessel_tree(5, 2, 20, np.random.default_rng(0)), str(tmp_path))
+
+
+@pytest.fixture
+def service():
+    service = NavigationService(number_of_workers=2)
+    yield service
+    for session in service.sessions.values():
+        session.close()
+    service.executor.shutdown(wait=True)
+
+
+def get_config(map_path: str, **options) -> dict:
+    return {"reference_path": map_path, "number_of_particles": 50, "particle_set_type": "ARRAY", "seed": 1, **options}
+
+
+def test_concurrent_sessions_share_one_prepared_map(map_path, service, monkeypatch):
+    load_map = Map3D.load_map
+    loads = []
+
+    def slow_load_map(map3D, absolute_path):
+        loads.append(absolute_path)
+        time.sleep(0.05)
+        load_map(map3D, absolute_path)
+
+    monkeypatch.setattr(Map3D, "load_map", slow_load_map)
+    barrier = threading.Barrier(6)
+
+    def open_session(index):
+        barrier.wait()
+        return service.open_session(get_config(map_path), "session-" + str(index))
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        sessions = list(executor.map(open_session, range(6)))
+    assert len(loads) == 1
+    maps = {id(session.navigator.model.particle_filter.measurement_strategy.map3D) for session in sessions}
+    assert maps == {id(service.maps[map_path])}
+    assert service.maps[map_path].compiled_map.transition_tables is not None
+
+
+def test_reference_cache_of_a_session_leaves_the_shared_map_unchanged(map_path, service):
+    cached = service.open_session(get_config(map_path, particle_set_type="OBJECT", reference_cache_resolution=0.5))
+    exact = service.open_session(get_config(map_path, particle_set_type="OBJECT"))
+    map3D = service.maps[map_path]
+    assert cached.navigator.model.particle_filter.measurement_strategy.reference_cache.resolution == 0.5
+    assert exact.navigator.model.particle_filter.measurement_strategy.reference_cache is None
+    assert exact.navigator.model.particle_filter.measurement_strategy.get_reference_value(0, 0.43) \
+        == map3D.get_reference_value(0, 0.43)
+
+
+@pytest.mark.parametrize("reserved", [{"configure_logger": True}, {"reference_map": None}])
+def test_reserved_config_keys_are_rejected(map_path, service, reserved):
+    with pytest.raises(ValueError, match=list(reserved)[0]):
+        service.open_session(get_config(map_path, **reserved))
+    assert service.sessions == {}
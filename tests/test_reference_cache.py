@@ -0,0 +1,80 @@
+import pickle
+
+import pytest
+
+from measurement_models.ahistoric_measurement_model import AhistoricMeasurementModel3D
+from measurement_models.sliding_dtw_measurement_model import SlidingDTWMeasurementModel3D
+from particles.particle import SlidingParticle3D
+from particles.state import State3D
+from utils.map3D import Map3D
+from utils.reference_cache import ReferenceCache
+
+"""
+Checks that the reference cache returns the reference value at the quantized displacement, is owned by the
+measurement model instead of the shared map, and is cleared when the map changes.
+"""
+
+
+def create_map() -> Map3D:
+    map3D = Map3D()
+    map3D.add_vessel_impedance_prediction_per_position_in_mm([0.0, 10.0], [0.0, 10.0], 0)
+    map3D.add_vessel_impedance_prediction_per_position_in_mm([0.0, 10.0], [20.0, 30.0], 1)
+    map3D.add_mapping([0, 1])
+    return map3D
+
+
+def test_cache_returns_the_value_at_the_quantized_displacement():
+    map3D = create_map()
+    reference_cache = ReferenceCache(resolution=0.5, max_size=2)
+    assert reference_cache.get_reference_value(map3D, 0, 0.43) == pytest.approx(0.5)
+    assert reference_cache.get_reference_value(map3D, 0, 0.6) == pytest.approx(0.5)
+    assert reference_cache.get_reference_value(map3D, 1, 2.1) == pytest.approx(22.0)
+    assert reference_cache.get_reference_value(map3D, 0, 3.0) == pytest.approx(3.0)
+    assert reference_cache.get_statistics()["hits"] == 1
+    assert reference_cache.get_statistics()["evictions"] == 1
+    assert len(reference_cache) == 2
+
+
+def test_models_sharing_a_map_keep_their_own_cache():
+    map3D = create_map()
+    exact = AhistoricMeasurementModel3D(map3D)
+    coarse = AhistoricMeasurementModel3D(map3D)
+    coarse.set_reference_cache(ReferenceCache(resolution=0.5))
+    fine = AhistoricMeasurementModel3D(map3D)
+    fine.set_reference_cache(ReferenceCache(resolution=0.1))
+    assert coarse.get_reference_value(0, 0.43) == pytest.approx(0.5)
+    assert fine.get_reference_value(0, 0.43) == pytest.approx(0.4)
+    assert exact.get_reference_value(0, 0.43) == pytest.approx(0.43)
+    assert map3D.get_reference_value(0, 0.43) == pytest.approx(0.43)
+    assert coarse.get_reference_value(0, 0.43) == pytest.approx(0.5)
+
+
+def test_sliding_model_hands_its_cache_to_the_retriever():
+    map3D = create_map()
+    measurement_model = SlidingDTWMeasurementModel3D(map3D)
+    measurement_model.set_reference_cache(ReferenceCache(resolution=0.5))
+    state = State3D()
+    state.set_branch(1)
+    state.set_position(2.1)
+    particle = SlidingParticle3D(state=state, weight=0)
+    reference_update = measurement_model.particle_reference_retriever.retrieve_reference_update(particle, map3D)
+    assert reference_update == [pytest.approx(22.0)]
+
+
+def test_cache_is_cleared_when_the_map_changes():
+    map3D = create_map()
+    reference_cache = ReferenceCache(resolution=0.5)
+    reference_cache.get_reference_value(map3D, 0, 1.0)
+    assert len(reference_cache) == 1
+    map3D.add_vessel_impedance_prediction_per_position_in_mm([0.0, 10.0], [40.0, 50.0], 2)
+    assert reference_cache.get_reference_value(map3D, 2, 1.0) == pytest.approx(41.0)
+    assert len(reference_cache) == 1
+
+
+def test_pickled_cache_starts_empty():
+    map3D = create_map()
+    reference_cache = ReferenceCache(resolution=0.5)
+    reference_cache.get_reference_value(map3D, 0, 1.0)
+    copied_cache = pickle.loads(pickle.dumps(reference_cache))
+    assert len(copied_cache) == 0
+    assert copied_cache.get_reference_value(map3D, 0, 1.2) == pytest.approx(1.0)
@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic_data import generate_vessel_tree, save_vessel_tree, generate_measurement_stream
+from filter.model3D import Model3D
+from utils.particle_filter_component_enums import MeasurementType, InjectorType, ParticleSetType, DTWEngine
+
+"""
+Checks the ShardedParticleFilter against the serial ParticleFilter and the global weight normalization and the
+particle exchange between the shards, on a small synthetic vessel tree.
+"""
+
+NUMBER_OF_STEPS = 8
+
+
+@pytest.fixture(scope="module")
+def map_path(tmp_path_factory):
+    map3D = generate_vessel_tree(7, 2, 30, np.random.default_rng(0))
+    return save_vessel_tree(map3D, str(tmp_path_factory.mktemp("map")))
+
+
+@pytest.fixture(scope="module")
+def stream(map_path):
+    map3D = generate_vessel_tree(7, 2, 30, np.random.default_rng(0))
+    return generate_measurement_stream(map3D, NUMBER_OF_STEPS, np.random.default_rng(1))
+
+
+def setup_model(map_path: str, measurement_model: MeasurementType, number_of_particles: int = 300, seed=5,
+                particle_set_type: ParticleSetType = ParticleSetType.ARRAY, **options) -> Model3D:
+    model = Model3D()
+    model.setup_particle_filter(map_path=map_path, measurement_model=measurement_model,
+                                injector_type=InjectorType.ALPHA_VARIANCE, alpha_center=2.0,
+                                dtw_engine=DTWEngine.BATCHED, seed=seed, **options)
+    model.setup_particles(number_of_particles=number_of_particles, initial_position_variance=0.5,
+                          particle_set_type=particle_set_type)
+    return model
+
+
+def run_model(model: Model3D, stream: dict) -> list:
+    columns = []
+    for displacement, impedance in zip(stream["displacements"], stream["impedances"]):
+        model.update_model(displacement=float(displacement), impedance=float(impedance))
+        particles = model.get_particles()
+        columns.append([particles.branches.copy(), particles.displacements.copy(), particles.alphas.copy(),
+                        particles.weights.copy()])
+    return columns
+
+
+@pytest.mark.parametrize("measurement_model", [MeasurementType.AHISTORIC, MeasurementType.SLIDING_DTW])
+@pytest.mark.parametrize("resampling_threshold", [None, 0.5])
+def test_single_shard_matches_serial_filter(map_path, stream, measurement_model, resampling_threshold):
+    serial = run_model(setup_model(map_path, measurement_model, resampling_threshold=resampling_threshold), stream)
+    model = setup_model(map_path, measurement_model, resampling_threshold=resampling_threshold, number_of_shards=1)
+    try:
+        sharded = run_model(model, stream)
+    finally:
+        model.close()
+    for serial_columns, sharded_columns in zip(serial, sharded):
+        for serial_column, sharded_column in zip(serial_columns[:3], sharded_columns[:3]):
+            np.testing.assert_array_equal(sharded_column, serial_column)
+        np.testing.assert_allclose(sharded_columns[3], serial_columns[3], rtol=1e-9, atol=1e-15)
+
+
+def test_seeded_run_is_reproducible(map_path, stream):
+    runs = []
+    for _ in range(2):
+        model = setup_model(map_path, MeasurementType.SLIDING_DTW, number_of_shards=3, exchange_interval=2,
+                            exchange_fraction=0.1, resampling_threshold=0.5)
+        try:
+            runs.append(run_model(model, stream))
+        finally:
+            model.close()
+    for first_columns, second_columns in zip(*runs):
+        for first_column, second_column in zip(first_columns, second_columns):
+            np.testing.assert_array_equal(first_column, second_column)
+
+
+def test_normalize_shard_weights_keeps_the_global_sum(map_path):
+    model = setup_model(map_path, MeasurementType.AHISTORIC, number_of_particles=30, number_of_shards=3)
+    try:
+        sharded_filter = model.particle_filter
+        weights = sharded_filter.particles.weights
+        generator = np.random.default_rng(2)
+        for log_masses in [np.array([0.0, -1.0, -700.0]), np.array([-3.0, -3.0, -3.0]), np.array([10.0, -np.inf, 2.0])]:
+            for start, stop in sharded_filter.shard_bounds:
+                weights[start:stop] = generator.random(stop - start)
+                weights[start:stop] /= np.sum(weights[start:stop])
+            sharded_filter.normalize_shard_weights(log_masses)
+            assert np.sum(weights) == pytest.approx(1.0, abs=1e-12)
+            shard_masses = np.array([np.sum(weights[start:stop]) for start, stop in sharded_filter.shard_bounds])
+            expected = np.exp(log_masses - np.max(log_masses))
+            np.testing.assert_allclose(shard_masses, expected / np.sum(expected), rtol=1e-9, atol=1e-300)
+        sharded_filter.normalize_shard_weights(np.full(3, -np.inf))
+        np.testing.assert_array_equal(weights, np.full(30, 1 / 30))
+    finally:
+        model.close()
+
+
+def test_exchange_particles_moves_rows_and_histories_to_the_next_shard(map_path, stream):
+    model = setup_model(map_path, MeasurementType.SLIDING_DTW, number_of_particles=40, number_of_shards=2,
+                        exchange_interval=None, exchange_fraction=0.1, history_length=5)
+    try:
+        for displacement, impedance in zip(stream["displacements"][:3], stream["impedances"][:3]):
+            model.update_model(displacement=float(displacement), impedance=float(impedance))
+        sharded_filter = model.particle_filter
+        shared_columns = sharded_filter.shared_columns[0]
+        particles = sharded_filter.particles
+        particles.weights[:] = np.arange(1, 41, dtype=np.float64)
+        particles.weights /= np.sum(particles.weights)
+        particles.displacements[:] = np.arange(40, dtype=np.float64)
+        sharded_filter.run_on_shards("export_histories")
+        before = {column: np.array(getattr(particles, column)) for column in ["branches", "displacements", "alphas"]}
+        histories_before = shared_columns.history_data.copy()
+        lengths_before = shared_columns.history_lengths.copy()
+        weights_before = particles.weights.copy()
+
+        sharded_filter.exchange_particles()
+
+        # the two best particles of each shard replace the two worst particles of the other shard
+        moves = {int(np.flatnonzero(before["displacements"] == particles.displacements[destination])[0]): destination
+                 for destination in [0, 1, 20, 21]}
+        assert sorted(moves) == [18, 19, 38, 39]
+        assert all((source < 20) == (destination >= 20) for source, destination in moves.items())
+        sharded_filter.run_on_shards("export_histories")
+        for source, destination in moves.items():
+            for column, values in before.items():
+                assert getattr(particles, column)[destination] == values[source]
+            np.testing.assert_array_equal(shared_columns.history_data[destination], histories_before[source])
+            assert shared_columns.history_lengths[destination] == lengths_before[source]
+            assert particles.weights[destination] == pytest.approx(particles.weights[source])
+        unchanged = np.setdiff1d(np.arange(40), list(moves.values()))
+        for column, values in before.items():
+            np.testing.assert_array_equal(getattr(particles, column)[unchanged], values[unchanged])
+        np.testing.assert_array_equal(shared_columns.history_data[unchanged], histories_before[unchanged])
+        assert np.sum(particles.weights) == pytest.approx(1.0, abs=1e-12)
+        expected_weights = weights_before.copy()
+        expected_weights[list(moves)] /= 2
+        expected_weights[list(moves.values())] = expected_weights[list(moves)]
+        np.testing.assert_allclose(particles.weights, expected_weights / np.sum(expected_weights), rtol=1e-12)
+    finally:
+        model.close()
+
+
+def test_sharded_filter_rejects_object_particle_sets(map_path):
+    with pytest.raises(ValueError):
+        setup_model(map_path, MeasurementType.AHISTORIC, number_of_shards=2,
+                    particle_set_type=ParticleSetType.OBJECT).close()
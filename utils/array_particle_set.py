@@ -0,0 +1,180 @@
+import numpy as np
+from utils.random_streams import default_random_generator
+
+from particles.particle import Particle, SlidingParticle3D
+from particles.particle_view import ParticleView, SlidingParticleView
+from utils.history_buffer import HistoryBuffer
+from utils.particle_set import ParticleSet
+
+"""
+The ArrayParticleSet stores the particle set as structure of arrays: the branch, displacement, alpha and weight
+of all particles are held in contiguous numpy columns. Vectorized strategies operate on these columns directly.
+Indexing or iterating over the set yields particle views, which read and write the columns, so strategies
+written against the object based ParticleSet keep working unchanged.
+If the set is created for the sliding measurement models, the reference histories of all particles are stored in
+one HistoryBuffer, with one row per particle.
+"""
+
+
+class ArrayParticleSet(ParticleSet):
+    """
+    @param branches: branch index of each particle
+    @param displacements: displacement along the centerline of the branch of each particle
+    @param alphas: estimate of the systematic displacement error of each particle
+    @param weights: weight of each particle, zero if not given
+    @param sliding: if True, each particle stores a reference history for the sliding measurement models
+    @param history_length: maximal length of the reference histories
+    """
+
+    def __init__(self,
+                 branches=None,
+                 displacements=None,
+                 alphas=None,
+                 weights=None,
+                 sliding: bool = False,
+                 history_length: int = 20) -> None:
+        self.displacements = np.array([] if displacements is None else displacements, dtype=np.float64)
+        number_of_particles = len(self.displacements)
+        self.branches = np.zeros(number_of_particles, dtype=np.int64) if branches is None \
+            else np.array(branches, dtype=np.int64)
+        self.alphas = np.zeros(number_of_particles, dtype=np.float64) if alphas is None \
+            else np.array(alphas, dtype=np.float64)
+        self.weights = np.zeros(number_of_particles, dtype=np.float64) if weights is None \
+            else np.array(weights, dtype=np.float64)
+        if not len(self.branches) == len(self.alphas) == len(self.weights) == number_of_particles:
+            raise ValueError("All particle columns must have the same length")
+        self.sliding = sliding
+        self.reference_histories = HistoryBuffer(number_of_particles, history_length) if sliding else None
+
+    @classmethod
+    def from_prior(cls,
+                   number_of_particles: int,
+                   initial_position_center: float = 0.0,
+                   initial_position_variance: float = 0.0,
+                   alpha_center: float = 2.0,
+                   alpha_variance: float = 0.1,
+                   initial_branch: int = 0,
+                   sliding: bool = False,
+                   history_length: int = 20,
+                   random_generator: np.random.Generator = default_random_generator):
+        return cls(branches=np.full(number_of_particles, initial_branch, dtype=np.int64),
+                   displacements=random_generator.normal(loc=initial_position_center,
+                                                         scale=initial_position_variance,
+                                                         size=number_of_particles),
+                   alphas=random_generator.normal(loc=alpha_center, scale=alpha_variance, size=number_of_particles),
+                   sliding=sliding,
+                   history_length=history_length)
+
+    @classmethod
+    def from_particle_set(cls, particles: ParticleSet, history_length: int = 20):
+        sliding = len(particles) > 0 and all(isinstance(particle, SlidingParticle3D) for particle in particles)
+        particle_set = cls(branches=[particle.state.branch for particle in particles],
+                           displacements=[particle.state.position for particle in particles],
+                           alphas=[particle.state.alpha for particle in particles],
+                           weights=[particle.weight for particle in particles],
+                           sliding=sliding,
+                           history_length=history_length)
+        if sliding:
+            for index, particle in enumerate(particles):
+                particle_set.reference_histories.set_row(index, particle.reference_history)
+        return particle_set
+
+    @classmethod
+    def from_columns(cls, branches: np.ndarray, displacements: np.ndarray, alphas: np.ndarray, weights: np.ndarray,
+                     reference_histories: HistoryBuffer = None):
+        """
+        wraps existing columns without copying them, e.g. views onto shared memory
+        """
+        particle_set = cls()
+        particle_set.branches = branches
+        particle_set.displacements = displacements
+        particle_set.alphas = alphas
+        particle_set.weights = weights
+        particle_set.sliding = reference_histories is not None
+        particle_set.reference_histories = reference_histories
+        return particle_set
+
+    def to_particle_set(self) -> ParticleSet:
+        particles = ParticleSet()
+        for index in range(len(self)):
+            particles.append(self[index].__deepcopy__({}))
+        return particles
+
+    def __str__(self):
+        return f'[ArrayParticleSet: {len(self)} particles]'
+
+    def append(self, particle: Particle) -> None:
+        if not isinstance(particle, Particle):
+            raise ValueError("ParticleSet must only contain objects of the Particle class")
+        self.branches = np.append(self.branches, particle.state.branch)
+        self.displacements = np.append(self.displacements, particle.state.position)
+        self.alphas = np.append(self.alphas, particle.state.alpha)
+        self.weights = np.append(self.weights, particle.weight)
+        if self.sliding:
+            self.reference_histories.append_rows([getattr(particle, "reference_history", [])])
+
+    def remove(self, particle: Particle) -> None:
+        if not isinstance(particle, Particle):
+            raise ValueError("ParticleSet must only contain objects of the Particle class")
+        for index in range(len(self)):
+            if self[index] == particle:
+                self.delete(index)
+                return
+        raise ValueError("ArrayParticleSet.remove(x): x not in particle set")
+
+    def delete(self, indices) -> None:
+        self.reorder(np.delete(np.arange(len(self)), indices))
+
+    def reorder(self, order) -> None:
+        self.branches = self.branches[order]
+        self.displacements = self.displacements[order]
+        self.alphas = self.alphas[order]
+        self.weights = self.weights[order]
+        if self.sliding:
+            self.reference_histories = self.reference_histories.take(order)
+
+    def take(self, indices):
+        """
+        @return: new particle set with copies of the particles at the given indices, indices may repeat
+        """
+        particle_set = ArrayParticleSet(branches=self.branches[indices],
+                                        displacements=self.displacements[indices],
+                                        alphas=self.alphas[indices],
+                                        weights=self.weights[indices])
+        if self.sliding:
+            particle_set.sliding = True
+            particle_set.reference_histories = self.reference_histories.take(indices)
+        return particle_set
+
+    def get_weights(self) -> np.ndarray:
+        return self.weights
+
+    def set_weights(self, weights) -> None:
+        self.weights = np.array(weights, dtype=np.float64)
+
+    def sort_ascending_by_weight(self):
+        self.reorder(np.argsort(self.weights, kind="stable"))
+
+    def sort_descending_by_weight(self):
+        self.reorder(np.argsort(-self.weights, kind="stable"))
+
+    def pop_last(self) -> Particle:
+        particle = self[len(self) - 1].__deepcopy__({})
+        self.delete(len(self) - 1)
+        return particle
+
+    def __len__(self):
+        return len(self.displacements)
+
+    def __getitem__(self, item):
+        if not -len(self) <= item < len(self):
+            raise IndexError("particle index out of range")
+        if item < 0:
+            item += len(self)
+        if self.sliding:
+            return SlidingParticleView(self, item)
+        return ParticleView(self, item)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
@@ -0,0 +1,90 @@
+import numpy as np
+
+"""
+The BatchedDTW calculates the DTW distance of one series to many series at once. The cumulative cost matrices
+of all series are filled simultaneously, one anti-diagonal after the other, so the number of numpy operations
+only depends on the series lengths and not on the number of series. Like tslearn.metrics.dtw, the local cost is
+the squared difference and the distance is the square root of the cumulative cost of the optimal path.
+An optional Sakoe-Chiba band restricts the warping path, using the same band definition as tslearn.
+The series are processed in chunks to bound the memory of the cost matrices.
+"""
+
+
+class BatchedDTW:
+    """
+    @param sakoe_chiba_radius: radius of the Sakoe-Chiba band, None for an unconstrained warping path
+    @param chunk_size: number of series whose cost matrices are held in memory at the same time
+    """
+
+    def __init__(self,
+                 sakoe_chiba_radius: int = None,
+                 chunk_size: int = 4096) -> None:
+        if sakoe_chiba_radius is not None and sakoe_chiba_radius < 0:
+            raise ValueError("the radius of the Sakoe-Chiba band cannot be negative")
+        if chunk_size < 1:
+            raise ValueError("chunk size must be at least 1")
+        self.sakoe_chiba_radius = sakoe_chiba_radius
+        self.chunk_size = chunk_size
+
+    def get_band_mask(self, length_series: int, length_histories: int) -> np.ndarray:
+        mask = np.ones((length_series, length_histories), dtype=bool)
+        if self.sakoe_chiba_radius is None:
+            return mask
+        mask[:] = False
+        radius = self.sakoe_chiba_radius
+        if length_series > length_histories:
+            width = length_series - length_histories + radius
+            for index in range(length_histories):
+                mask[max(0, index - radius):min(length_series, index + width) + 1, index] = True
+        else:
+            width = length_histories - length_series + radius
+            for index in range(length_series):
+                mask[index, max(0, index - radius):min(length_histories, index + width) + 1] = True
+        return mask
+
+    def distances(self, series, histories) -> np.ndarray:
+        """
+        @param series: the series all histories are compared to
+        @param histories: (N, W) matrix with one series of length W per row
+        @return: DTW distance of the series to each row of the histories
+        """
+        series = np.asarray(series, dtype=np.float64)
+        histories = np.asarray(histories, dtype=np.float64)
+        if histories.ndim != 2:
+            raise ValueError("histories must be a two dimensional array")
+        if len(series) == 0 or histories.shape[1] == 0:
+            raise ValueError("DTW requires non-empty series")
+        distances = np.empty(len(histories), dtype=np.float64)
+        for start in range(0, len(histories), self.chunk_size):
+            distances[start:start + self.chunk_size] = self.calculate_chunk(
+                series, histories[start:start + self.chunk_size])
+        return distances
+
+    def distances_to_series_list(self, series, histories: list) -> np.ndarray:
+        """
+        compares the series to a list of series of possibly different lengths by grouping series of equal length
+        """
+        lengths = np.array([len(history) for history in histories], dtype=np.int64)
+        distances = np.empty(len(histories), dtype=np.float64)
+        for length in np.unique(lengths):
+            indices = np.flatnonzero(lengths == length)
+            distances[indices] = self.distances(series, [histories[index] for index in indices])
+        return distances
+
+    def calculate_chunk(self, series: np.ndarray, histories: np.ndarray) -> np.ndarray:
+        length_series = len(series)
+        length_histories = histories.shape[1]
+        mask = self.get_band_mask(length_series, length_histories)
+
+        cumulative_cost = np.full((len(histories), length_series + 1, length_histories + 1), np.inf)
+        cumulative_cost[:, 0, 0] = 0
+        for diagonal in range(length_series + length_histories - 1):
+            i = np.arange(max(0, diagonal - length_histories + 1), min(length_series - 1, diagonal) + 1)
+            j = diagonal - i
+            in_band = mask[i, j]
+            i, j = i[in_band], j[in_band]
+            local_cost = (series[i] - histories[:, j]) ** 2
+            cumulative_cost[:, i + 1, j + 1] = local_cost + np.minimum(
+                np.minimum(cumulative_cost[:, i, j + 1], cumulative_cost[:, i + 1, j]),
+                cumulative_cost[:, i, j])
+        return np.sqrt(cumulative_cost[:, length_series, length_histories])
@@ -0,0 +1,256 @@
+import numbers
+from collections.abc import MutableMapping
+
+import numpy as np
+
+"""
+The CompiledMap3D holds the vessels of a Map3D as contiguous arrays. The centerline positions and reference
+signals of all vessels are concatenated, the vessel with index i occupies the slice offsets[i]:offsets[i + 1].
+The compiled map interpolates the reference values of many (branch, displacement) pairs in one vectorized pass.
+Vessels sampled on a uniform grid, e.g. the millimeter lists of add_vessel_impedance_prediction_as_millimeter_list,
+are interpolated by direct index computation, all other vessels by a binary search over their centerline positions.
+
+A compiled map is saved as one .cmap.npy file holding a single float64 array: a header with a magic number, the
+format version and the number of vessels, centerline points and mappings, followed by the vessel flags, the offsets,
+the positions, the signals, the mappings and the per-vessel grid information. np.load with mmap_mode="r" maps the file
+without reading it, the positions and signals stay views into the mapped file, so loading takes milliseconds
+independent of the size of the map, and processes loading the same file share one copy in the page cache.
+CompiledVessels presents such a map as the vessel dictionary of Map3D and builds the list of centerline points of a
+vessel only when the vessel is accessed.
+The TransitionTables of the vessel tree are derived from the mappings on first use and live as long as the compiled
+map, which is rebuilt whenever vessels or mappings are added.
+"""
+
+COMPILED_MAP_SUFFIX = ".cmap.npy"
+COMPILED_MAP_MAGIC = 7.3569
+COMPILED_MAP_VERSION = 1
+
+
+class CompiledMap3D:
+
+    def __init__(self, vessels: dict = None, mappings: list = None):
+        if vessels is None:
+            vessels = {}
+        self.mappings = np.array(mappings if mappings else [], dtype=np.int64).reshape(-1, 2)
+        self.transition_tables = None
+        number_of_vessels = max(vessels.keys()) + 1 if vessels else 0
+        self.offsets = np.zeros(number_of_vessels + 1, dtype=np.int64)
+        self.contains_vessel = np.zeros(number_of_vessels, dtype=bool)
+        for index, vessel in vessels.items():
+            self.offsets[index + 1] = len(vessel)
+            self.contains_vessel[index] = True
+        self.offsets = np.cumsum(self.offsets)
+
+        self.positions = np.zeros(self.offsets[-1], dtype=np.float64)
+        self.signals = np.zeros(self.offsets[-1], dtype=np.float64)
+        for index, vessel in vessels.items():
+            self.positions[self.offsets[index]:self.offsets[index + 1]] = \
+                [point["centerline_position"] for point in vessel]
+            self.signals[self.offsets[index]:self.offsets[index + 1]] = \
+                [point["reference_signal"] for point in vessel]
+
+        self.lengths = np.zeros(number_of_vessels, dtype=np.float64)
+        self.grid_starts = np.zeros(number_of_vessels, dtype=np.float64)
+        self.grid_steps = np.ones(number_of_vessels, dtype=np.float64)
+        self.is_uniform = np.zeros(number_of_vessels, dtype=bool)
+        for index in vessels.keys():
+            positions = self.get_vessel_positions(index)
+            self.lengths[index] = positions[-1]
+            self.grid_starts[index] = positions[0]
+            steps = np.diff(positions)
+            if len(steps) > 0 and steps[0] > 0 and np.allclose(steps, steps[0], rtol=1e-12, atol=0):
+                self.grid_steps[index] = steps[0]
+                self.is_uniform[index] = True
+
+    def get_number_of_vessels(self) -> int:
+        return len(self.contains_vessel)
+
+    def get_transition_tables(self):
+        if self.transition_tables is None:
+            self.transition_tables = TransitionTables(self.mappings, self.lengths)
+        return self.transition_tables
+
+    def get_vessel_positions(self, index: int) -> np.ndarray:
+        return self.positions[self.offsets[index]:self.offsets[index + 1]]
+
+    def get_vessel_signals(self, index: int) -> np.ndarray:
+        return self.signals[self.offsets[index]:self.offsets[index + 1]]
+
+    def check_branches(self, branches: np.ndarray):
+        if len(branches) == 0:
+            return
+        if branches.min() < 0 or branches.max() >= self.get_number_of_vessels() \
+                or not self.contains_vessel[branches].all():
+            raise ValueError("No vessel branch with index "
+                             + str(branches[~np.isin(branches, np.flatnonzero(self.contains_vessel))][0])
+                             + " in the map")
+
+    def get_reference_values(self, branches, displacements) -> np.ndarray:
+        branches = np.asarray(branches, dtype=np.int64)
+        displacements = np.asarray(displacements, dtype=np.float64)
+        self.check_branches(branches)
+        reference_values = np.empty(len(displacements), dtype=np.float64)
+
+        uniform = self.is_uniform[branches]
+        uniform_branches = branches[uniform]
+        grid_positions = (displacements[uniform] - self.grid_starts[uniform_branches]) \
+            / self.grid_steps[uniform_branches]
+        number_of_points = self.offsets[uniform_branches + 1] - self.offsets[uniform_branches]
+        lower = np.clip(np.floor(grid_positions), 0, number_of_points - 2).astype(np.int64)
+        fraction = np.clip(grid_positions - lower, 0, 1)
+        lower += self.offsets[uniform_branches]
+        reference_values[uniform] = (1 - fraction) * self.signals[lower] + fraction * self.signals[lower + 1]
+
+        non_uniform = np.flatnonzero(~uniform)
+        if len(non_uniform) > 0:
+            for index in np.unique(branches[non_uniform]):
+                selection = non_uniform[branches[non_uniform] == index]
+                reference_values[selection] = np.interp(displacements[selection],
+                                                        self.get_vessel_positions(index),
+                                                        self.get_vessel_signals(index))
+        return reference_values
+
+    def save(self, absolute_path: str) -> str:
+        if not absolute_path.endswith(COMPILED_MAP_SUFFIX):
+            absolute_path += COMPILED_MAP_SUFFIX
+        header = [COMPILED_MAP_MAGIC, COMPILED_MAP_VERSION,
+                  self.get_number_of_vessels(), len(self.positions), len(self.mappings)]
+        np.save(absolute_path, np.concatenate([header, self.contains_vessel, self.offsets, self.positions,
+                                               self.signals, self.mappings.reshape(-1), self.lengths,
+                                               self.grid_starts, self.grid_steps, self.is_uniform]).astype(np.float64))
+        return absolute_path
+
+    @classmethod
+    def load(cls, absolute_path: str, mmap: bool = True):
+        data = np.load(absolute_path, mmap_mode="r" if mmap else None)
+        if data.ndim != 1 or len(data) < 5 or data[0] != COMPILED_MAP_MAGIC:
+            raise ValueError("File is not a compiled map: " + absolute_path)
+        if data[1] != COMPILED_MAP_VERSION:
+            raise ValueError("Unsupported compiled map version " + str(data[1]) + " in " + absolute_path)
+        number_of_vessels, number_of_points, number_of_mappings = [int(value) for value in data[2:5]]
+        sections = {}
+        start = 5
+        for name, size in [("contains_vessel", number_of_vessels), ("offsets", number_of_vessels + 1),
+                           ("positions", number_of_points), ("signals", number_of_points),
+                           ("mappings", 2 * number_of_mappings), ("lengths", number_of_vessels),
+                           ("grid_starts", number_of_vessels), ("grid_steps", number_of_vessels),
+                           ("is_uniform", number_of_vessels)]:
+            sections[name] = data[start:start + size]
+            start += size
+        if start != len(data):
+            raise ValueError("Compiled map is truncated or corrupted: " + absolute_path)
+
+        compiled_map = cls()
+        compiled_map.positions = sections["positions"]
+        compiled_map.signals = sections["signals"]
+        compiled_map.contains_vessel = np.array(sections["contains_vessel"], dtype=bool)
+        compiled_map.offsets = np.array(sections["offsets"], dtype=np.int64)
+        compiled_map.mappings = np.array(sections["mappings"], dtype=np.int64).reshape(-1, 2)
+        compiled_map.lengths = np.array(sections["lengths"])
+        compiled_map.grid_starts = np.array(sections["grid_starts"])
+        compiled_map.grid_steps = np.array(sections["grid_steps"])
+        compiled_map.is_uniform = np.array(sections["is_uniform"], dtype=bool)
+        return compiled_map
+
+
+class TransitionTables:
+    """
+    Per-vessel tables of the vessel tree, the root is the vessel with index 0:
+    - predecessors: index of the predecessor of each vessel, 0 for vessels without predecessor
+    - successor_table: one row of successor indices per vessel in the order of the mappings, padded with -1, and
+      number_of_successors of each vessel
+    - depths: number of hops from each vessel to the root
+    - ancestors: the vessel itself and its ancestors up to the root in the columns, padded with 0
+    - path_lengths: summed lengths of each vessel and its ancestors, without the root, i.e. the path length from the
+      end of the root to the end of the vessel
+    @param mappings: (M, 2) array of predecessor and successor indices
+    @param lengths: length of each vessel
+    """
+
+    def __init__(self, mappings: np.ndarray, lengths: np.ndarray) -> None:
+        number_of_vessels = len(lengths)
+        mappings = np.asarray(mappings, dtype=np.int64).reshape(-1, 2)
+        mappings = mappings[((mappings >= 0) & (mappings < number_of_vessels)).all(axis=1)]
+
+        self.predecessors = np.zeros(number_of_vessels, dtype=np.int64)
+        successors, first_mappings = np.unique(mappings[:, 1], return_index=True)
+        self.predecessors[successors] = mappings[first_mappings, 0]
+
+        self.number_of_successors = np.bincount(mappings[:, 0], minlength=number_of_vessels).astype(np.int64)
+        self.successor_table = np.full((number_of_vessels, max(int(self.number_of_successors.max(initial=0)), 1)), -1,
+                                       dtype=np.int64)
+        order = np.argsort(mappings[:, 0], kind="stable")
+        rows = mappings[order, 0]
+        columns = np.arange(len(rows)) - np.searchsorted(rows, rows, side="left")
+        self.successor_table[rows, columns] = mappings[order, 1]
+
+        parents = np.where(np.arange(number_of_vessels) == 0, 0, self.predecessors)
+        ancestors = [np.arange(number_of_vessels)]
+        while number_of_vessels > 0 and ancestors[-1].any():
+            if len(ancestors) > number_of_vessels:
+                raise ValueError("The mappings of the map contain a cycle")
+            ancestors.append(parents[ancestors[-1]])
+        self.ancestors = np.stack(ancestors, axis=1) if number_of_vessels > 0 else np.zeros((0, 1), dtype=np.int64)
+        self.depths = np.count_nonzero(self.ancestors, axis=1)
+        lengths = np.where(np.arange(number_of_vessels) == 0, 0.0, lengths)
+        self.path_lengths = lengths[self.ancestors].sum(axis=1)
+
+    def resolve_backward_overshoot(self, branches: np.ndarray, position_estimates: np.ndarray) -> tuple:
+        """
+        moves particles with negative positions towards the root in one pass: hop by hop, a particle adds the length of
+        its vessel and moves to the predecessor until its position is not negative; at the root it stops at 0
+        @return: branches and positions of the particles
+        """
+        branches = np.asarray(branches, dtype=np.int64)
+        targets = position_estimates + self.path_lengths[branches]
+        ancestors = self.ancestors[branches]
+        reached = self.path_lengths[ancestors] <= targets[:, np.newaxis]
+        hops = np.argmax(reached, axis=1)
+        found = reached[np.arange(len(branches)), hops]
+        new_branches = np.where(found, ancestors[np.arange(len(branches)), hops], 0)
+        new_positions = np.where(found, targets - self.path_lengths[new_branches], 0.0)
+        return new_branches, new_positions
+
+
+class CompiledVessels(MutableMapping):
+    """
+    @param compiled_map: compiled map whose vessels are presented as dictionary of lists of centerline points
+    """
+
+    def __init__(self, compiled_map: CompiledMap3D):
+        self.compiled_map = compiled_map
+        self.vessels = {}
+        self.removed = set()
+
+    def is_compiled_vessel(self, index) -> bool:
+        return isinstance(index, numbers.Integral) and 0 <= index < self.compiled_map.get_number_of_vessels() \
+            and bool(self.compiled_map.contains_vessel[index]) and index not in self.removed
+
+    def __contains__(self, index):
+        return index in self.vessels or self.is_compiled_vessel(index)
+
+    def __getitem__(self, index):
+        if index not in self.vessels:
+            if not self.is_compiled_vessel(index):
+                raise KeyError(index)
+            self.vessels[index] = [{"centerline_position": position, "reference_signal": signal}
+                                   for position, signal in zip(self.compiled_map.get_vessel_positions(index).tolist(),
+                                                               self.compiled_map.get_vessel_signals(index).tolist())]
+        return self.vessels[index]
+
+    def __setitem__(self, index, vessel):
+        self.vessels[index] = vessel
+
+    def __delitem__(self, index):
+        if index not in self:
+            raise KeyError(index)
+        self.vessels.pop(index, None)
+        self.removed.add(index)
+
+    def __iter__(self):
+        compiled_indices = [int(index) for index in np.flatnonzero(self.compiled_map.contains_vessel)
+                            if index not in self.removed]
+        return iter(sorted(set(compiled_indices) | set(self.vessels.keys())))
+
+    def __len__(self):
+        return sum(1 for _ in self)
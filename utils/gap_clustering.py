@@ -0,0 +1,56 @@
+import numpy as np
+
+"""
+The GapClustering1D clusters the displacements of the particles on all branches at once. On one dimensional data,
+DBSCAN with min_samples=2 marks every point with a neighbor within eps as core point, and two core points belong to
+the same cluster if they are connected by a chain of neighbors within eps. Hence, after sorting the displacements per
+branch, a new cluster starts wherever the gap to the previous displacement exceeds eps, and clusters of a single
+particle are noise. This yields exactly the clusters of DBSCAN(eps, min_samples=2), computed by one sort and
+grouped reductions for mean, standard error and size of each cluster.
+The clusters are returned in the order in which the DBSCAN based estimate adds them to the position estimate:
+branches by their first occurrence in the particle set and the clusters of a branch by the first occurrence of one of
+their particles, which is the order of the DBSCAN cluster labels.
+"""
+
+
+class GapClustering1D:
+    """
+    @param eps: maximal distance between two neighboring particles of a cluster
+    """
+
+    def __init__(self, eps: float = 3.0) -> None:
+        self.eps = eps
+
+    def cluster(self, branches, displacements) -> tuple:
+        """
+        @return: branch, mean displacement, standard error of the mean and number of particles of each cluster
+        """
+        branches = np.asarray(branches, dtype=np.int64)
+        displacements = np.asarray(displacements, dtype=np.float64)
+        if len(displacements) == 0:
+            return np.array([], dtype=np.int64), np.array([]), np.array([]), np.array([], dtype=np.int64)
+
+        order = np.lexsort((displacements, branches))
+        sorted_branches = branches[order]
+        sorted_displacements = displacements[order]
+        starts_cluster = np.ones(len(order), dtype=bool)
+        starts_cluster[1:] = (sorted_branches[1:] != sorted_branches[:-1]) \
+            | (np.diff(sorted_displacements) > self.eps)
+        labels = np.cumsum(starts_cluster) - 1
+        cluster_starts = np.flatnonzero(starts_cluster)
+
+        sizes = np.bincount(labels)
+        means = np.bincount(labels, weights=sorted_displacements) / sizes
+        squared_deviations = np.bincount(labels, weights=(sorted_displacements - means[labels]) ** 2)
+        errors = np.sqrt(squared_deviations / np.maximum(sizes - 1, 1) / sizes)
+        cluster_branches = sorted_branches[cluster_starts]
+        first_particles = np.minimum.reduceat(order, cluster_starts)
+
+        unique_branches, first_occurrences = np.unique(branches, return_index=True)
+        branch_ranks = np.empty(len(unique_branches), dtype=np.int64)
+        branch_ranks[np.argsort(first_occurrences)] = np.arange(len(unique_branches))
+        ranks = branch_ranks[np.searchsorted(unique_branches, cluster_branches)]
+
+        clusters = np.flatnonzero(sizes >= 2)
+        clusters = clusters[np.lexsort((first_particles[clusters], ranks[clusters]))]
+        return cluster_branches[clusters], means[clusters], errors[clusters], sizes[clusters]
@@ -0,0 +1,84 @@
+import numpy as np
+
+"""
+The HistoryBuffer stores one signal history per row in a preallocated circular buffer with a shared head index.
+Each value is written twice, at column head and column head + window_length, so the current window of all rows
+is always available as the contiguous slice data[:, head:head + window_length], ordered from the oldest to the
+newest value, without rolling or copying the buffer.
+As the rows can be reset individually, each row keeps the number of its valid values. The valid values of a row
+are the last entries of its window.
+"""
+
+
+class HistoryBuffer:
+    """
+    @param number_of_rows: number of histories stored in the buffer
+    @param window_length: maximal number of values per history
+    """
+
+    def __init__(self, number_of_rows: int, window_length: int = 20) -> None:
+        if window_length < 1:
+            raise ValueError("window length must be at least 1")
+        self.window_length = window_length
+        self.data = np.zeros((number_of_rows, 2 * window_length), dtype=np.float64)
+        self.lengths = np.zeros(number_of_rows, dtype=np.int64)
+        self.head = 0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def append(self, values) -> None:
+        self.data[:, self.head] = values
+        self.data[:, self.head + self.window_length] = values
+        self.head = (self.head + 1) % self.window_length
+        self.lengths = np.minimum(self.lengths + 1, self.window_length)
+
+    def get_window(self) -> np.ndarray:
+        return self.data[:, self.head:self.head + self.window_length]
+
+    def get_row(self, index: int) -> np.ndarray:
+        return self.get_window()[index, self.window_length - self.lengths[index]:]
+
+    def set_row(self, index: int, values) -> None:
+        values = np.asarray(values, dtype=np.float64)[-self.window_length:] if len(values) > 0 else []
+        columns = (self.head + self.window_length - len(values) + np.arange(len(values))) % self.window_length
+        self.data[index, columns] = values
+        self.data[index, columns + self.window_length] = values
+        self.lengths[index] = len(values)
+
+    def reset_rows(self, indices) -> None:
+        self.lengths[indices] = 0
+
+    def reset(self) -> None:
+        self.lengths[:] = 0
+        self.head = 0
+
+    def get_windows(self) -> list:
+        """
+        groups the rows by the number of valid values
+        @return: list of (row indices, windows) pairs; if all rows hold the same number of values, the windows are a
+        view onto the buffer
+        """
+        window = self.get_window()
+        lengths = np.unique(self.lengths)
+        if len(lengths) == 1:
+            return [(np.arange(len(self)), window[:, self.window_length - lengths[0]:])]
+        windows = []
+        for length in lengths:
+            rows = np.flatnonzero(self.lengths == length)
+            windows.append((rows, window[rows, self.window_length - length:]))
+        return windows
+
+    def take(self, indices):
+        history_buffer = HistoryBuffer(0, self.window_length)
+        history_buffer.data = self.data[indices]
+        history_buffer.lengths = self.lengths[indices]
+        history_buffer.head = self.head
+        return history_buffer
+
+    def append_rows(self, histories: list) -> None:
+        first_new_row = len(self)
+        self.data = np.concatenate([self.data, np.zeros((len(histories), 2 * self.window_length))])
+        self.lengths = np.concatenate([self.lengths, np.zeros(len(histories), dtype=np.int64)])
+        for offset, history in enumerate(histories):
+            self.set_row(first_new_row + offset, history)
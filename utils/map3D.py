@@ -1,14 +1,20 @@
 import copy
 import json
 import numbers
+import os
 
 import numpy as np
 
+from utils.compiled_map import CompiledMap3D, CompiledVessels, TransitionTables, COMPILED_MAP_SUFFIX
+
 """
 THe map3D class represents a 3D vessel tree as set of centerlines. Each vessel possesses a 
 unique index. The connections between the vessels are encoded by an index structure. 
 If two vessels with index i and j have a connection from i to j, the pair [i,j] represents this
 connection.
+For vectorized lookups, the vessels are compiled into contiguous arrays. The compiled map is built on first use
+and invalidated whenever vessels or mappings are added or the map is reloaded.
+Maps are stored as JSON or as compiled map (.cmap.npy), which load_map memory maps instead of parsing it.
 """
 
 
@@ -26,6 +32,7 @@ class Map3D:
             self.mappings = []
         else:
             self.mappings = mappings
+        self.compiled_map = None
 
     def __str__(self):
         return f'[Vessels: {str(self.vessels)} | mappings: {self.mappings} ]'
@@ -51,6 +58,7 @@ class Map3D:
         for i, position in enumerate(positions):
             vessel.append({"centerline_position": position, "reference_signal": reference_values[i]})
         self.vessels[index] = vessel
+        self.invalidate_compiled_map()
 
     def add_vessel_impedance_prediction_as_millimeter_list(self, reference_values: list, index: int):
         if not all(isinstance(x, numbers.Number) for x in reference_values):
@@ -63,6 +71,7 @@ class Map3D:
     def add_vessel_as_list_of_dicts(self, vessel: list, index: int):
         self.check_right_vessel_format(index=index)
         self.vessels[index] = vessel
+        self.invalidate_compiled_map()
 
     def add_vessel_from_json(self, absolute_path: str, index: int):
         self.check_right_vessel_format(index)
@@ -71,6 +80,7 @@ class Map3D:
                 vessel_to_read = json.load(infile)
                 vessel = vessel_to_read["signal_per_centerline_position"]
                 self.vessels[index] = vessel
+                self.invalidate_compiled_map()
         else:
             raise ValueError("File must be of type .json")
 
@@ -80,6 +90,7 @@ class Map3D:
         if not len(mapping) == 2:
             raise ValueError("The mapping must consist of 2 integer values")
         self.mappings.append(mapping)
+        self.invalidate_compiled_map()
 
     def get_vessels(self):
         return self.vessels
@@ -110,6 +121,31 @@ class Map3D:
             return []
         return successor_indices
 
+    def invalidate_compiled_map(self):
+        self.compiled_map = None
+
+    def get_compiled_map(self) -> CompiledMap3D:
+        if self.compiled_map is None:
+            self.compiled_map = CompiledMap3D(self.vessels, self.mappings)
+        return self.compiled_map
+
+    def get_vessel_lengths(self) -> np.ndarray:
+        return self.get_compiled_map().lengths
+
+    def get_transition_tables(self) -> TransitionTables:
+        return self.get_compiled_map().get_transition_tables()
+
+    def get_predecessor_table(self) -> np.ndarray:
+        return self.get_transition_tables().predecessors
+
+    def get_successor_table(self) -> tuple:
+        """
+        returns a table with one row of successor indices per vessel, padded with -1, and the number of
+        successors of each vessel
+        """
+        transition_tables = self.get_transition_tables()
+        return transition_tables.successor_table, transition_tables.number_of_successors
+
     # Expects centerline positions to be monotonically increasing! => makes search faster
     def get_reference_value(self, branch: int, displacement: float) -> float:
         if branch not in self.vessels.keys():
@@ -132,14 +168,26 @@ class Map3D:
             reference_value = np.interp(displacement, x, y)
             return reference_value
 
+    def get_reference_values(self, branches, displacements) -> np.ndarray:
+        return self.get_compiled_map().get_reference_values(branches=branches, displacements=displacements)
+
     def save_map(self, absolut_path: str, filename: str):
-        map_storage_format = {"vessels": self.vessels, "mappings": self.mappings}
+        map_storage_format = {"vessels": dict(self.vessels), "mappings": self.mappings}
         jo = json.dumps(map_storage_format, indent=4)
 
-        with open(absolut_path + "\\" + filename + ".json", "w") as outfile:
+        with open(os.path.join(absolut_path, filename + ".json"), "w") as outfile:
             outfile.write(jo)
 
+    def save_compiled_map(self, absolut_path: str, filename: str) -> str:
+        return self.get_compiled_map().save(os.path.join(absolut_path, filename + COMPILED_MAP_SUFFIX))
+
     def load_map(self, absolute_path: str):
+        if absolute_path.endswith(COMPILED_MAP_SUFFIX):
+            self.invalidate_compiled_map()
+            self.compiled_map = CompiledMap3D.load(absolute_path)
+            self.vessels = CompiledVessels(self.compiled_map)
+            self.mappings = self.compiled_map.mappings.tolist()
+            return
         if absolute_path.endswith('.json'):
             with open(absolute_path, "r") as infile:
                 map_to_read = json.load(infile)
@@ -162,6 +210,7 @@ class Map3D:
         keys = [key for key in self.vessels.keys()]
         for key in keys:
             self.vessels[int(key)] = self.vessels.pop(key)
+        self.invalidate_compiled_map()
 
 if __name__ == "__main__":
     PATH = "C:\\Users\\Chris\\OneDrive\\Desktop\\branch_pruning_agar_I\\3D reference new\\"
@@ -0,0 +1,69 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from utils.compiled_map import COMPILED_MAP_SUFFIX
+from utils.map3D import Map3D
+
+"""
+Converts vessel maps between the JSON format, the compiled map format (.cmap.npy) and .npy centerline files.
+A JSON map or a single .npy centerline is converted with
+    python -m utils.map_converter --input map.json --output map.cmap.npy
+A map of several .npy centerlines, sampled per millimeter, is assembled with the vessel indices in the given order
+and the mappings as predecessor:successor pairs
+    python -m utils.map_converter --vessels aorta.npy renal.npy iliac.npy --mappings 0:1 0:2 --output map.cmap.npy
+Compiled maps can be converted back to JSON by giving a .json output path.
+"""
+
+
+def build_map_from_npy(vessel_paths: list, mappings: list) -> Map3D:
+    map3D = Map3D()
+    for index, vessel_path in enumerate(vessel_paths):
+        map3D.add_vessel_impedance_prediction_as_millimeter_list(np.load(vessel_path).tolist(), index)
+    for mapping in mappings:
+        map3D.add_mapping([int(index) for index in mapping])
+    return map3D
+
+
+def save_map(map3D: Map3D, output_path: str) -> str:
+    directory, filename = os.path.split(output_path)
+    if filename.endswith(COMPILED_MAP_SUFFIX):
+        return map3D.save_compiled_map(directory, filename[:-len(COMPILED_MAP_SUFFIX)])
+    if filename.endswith(".json"):
+        map3D.save_map(directory, filename[:-len(".json")])
+        return output_path
+    raise ValueError("Output must be a .json or " + COMPILED_MAP_SUFFIX + " file")
+
+
+def convert_map(input_path: str, output_path: str) -> str:
+    map3D = Map3D()
+    map3D.load_map(input_path)
+    return save_map(map3D, output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="convert vessel maps to the compiled map format and back")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="JSON map, compiled map or .npy centerline")
+    source.add_argument("--vessels", nargs="+", help=".npy centerlines in the order of their vessel indices")
+    parser.add_argument("--mappings", nargs="*", default=[], help="connections as predecessor:successor")
+    parser.add_argument("--output", required=True, help="output path ending with .json or " + COMPILED_MAP_SUFFIX)
+    arguments = parser.parse_args()
+
+    if arguments.input is not None:
+        output_path = convert_map(arguments.input, arguments.output)
+    else:
+        output_path = save_map(build_map_from_npy(arguments.vessels,
+                                                  [mapping.split(":") for mapping in arguments.mappings]),
+                               arguments.output)
+    start = time.perf_counter()
+    map3D = Map3D()
+    map3D.load_map(output_path)
+    print(f'wrote {output_path}: {map3D.get_number_of_vessels()} vessels, {len(map3D.get_mappings())} mappings, '
+          f'loaded in {(time.perf_counter() - start) * 1000:.2f} ms')
+
+
+if __name__ == "__main__":
+    main()
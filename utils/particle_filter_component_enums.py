@@ -9,3 +9,35 @@ class MeasurementType(Enum):
 class InjectorType(Enum):
     ALPHA_VARIANCE = 0
     RANDOM_PARTICLE = 1
+
+
+class ParticleSetType(Enum):
+    OBJECT = 0
+    ARRAY = 1
+
+
+class DTWEngine(Enum):
+    TSLEARN = 0
+    BATCHED = 1
+
+
+class ResamplerType(Enum):
+    LOW_VARIANCE = 0
+    KLD = 1
+
+
+class WeightingMode(Enum):
+    INVERSE = 0
+    LOG_LIKELIHOOD = 1
+
+
+class ClusteringMethod(Enum):
+    DBSCAN = 0
+    GAP_1D = 1
+
+
+class WeightingExecutorType(Enum):
+    SERIAL = 0
+    THREAD = 1
+    PROCESS = 2
+    AUTO = 3
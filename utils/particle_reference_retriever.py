@@ -1,19 +1,34 @@
+import numpy as np
+
+from utils.array_particle_set import ArrayParticleSet
 from utils.map3D import Map3D
+from utils.reference_cache import ReferenceCache
 
 
 """
 The ParticleReferenceRetriever retrieves a reference prediction for a particle.
 Therefore, it uses the position estimate of the particle and returns the reference value
 stored in the map3D at the position estimate. 
+For an ArrayParticleSet, the reference predictions of all particles are retrieved at once. The single lookups of
+object based particles go through the reference cache of the retriever, if it has one.
 """
 
 
 class ParticleReferenceRetriever:
-    @staticmethod
-    def retrieve_reference_update(particle, map3D: Map3D) -> list:
-        local_reference_value = map3D.get_reference_value(
-            branch=particle.get_state().get_position()["branch"],
-            displacement=particle.get_state().get_position()["displacement"])
-        return [local_reference_value]
+    """
+    @param reference_cache: cache of the single reference lookups, None to look up every value in the map
+    """
 
+    def __init__(self, reference_cache: ReferenceCache = None) -> None:
+        self.reference_cache = reference_cache
 
+    def retrieve_reference_update(self, particle, map3D: Map3D) -> list:
+        branch = particle.get_state().get_position()["branch"]
+        displacement = particle.get_state().get_position()["displacement"]
+        if self.reference_cache is not None:
+            return [self.reference_cache.get_reference_value(map3D, branch, displacement)]
+        return [map3D.get_reference_value(branch=branch, displacement=displacement)]
+
+    @staticmethod
+    def retrieve_reference_updates(particles: ArrayParticleSet, map3D: Map3D) -> np.ndarray:
+        return map3D.get_reference_values(branches=particles.branches, displacements=particles.displacements)
@@ -1,3 +1,5 @@
+import numpy as np
+
 from particles.particle import Particle
 
 
@@ -15,6 +17,17 @@ class ParticleSet(object):
             raise ValueError("ParticleSet must only contain objects of the Particle class")
         self.set.remove(particle)
 
+    def get_weights(self) -> np.ndarray:
+        return np.array([particle.weight for particle in self.set], dtype=np.float64)
+
+    def set_weights(self, weights) -> None:
+        for particle, weight in zip(self.set, weights):
+            particle.weight = float(weight)
+
+    def delete(self, indices) -> None:
+        indices_to_delete = set(np.atleast_1d(indices).tolist())
+        self.set = [particle for index, particle in enumerate(self.set) if index not in indices_to_delete]
+
     def sort_ascending_by_weight(self):
         self.set.sort(key=lambda p: p.weight, reverse=False)
 
@@ -0,0 +1,32 @@
+import numpy as np
+
+"""
+All randomness of the particle filter is drawn from numpy Generators instead of the global numpy.random and random
+modules. The ParticleFilter derives independent child streams from its seed: one for the initial particles and one
+for each stochastic strategy, i.e. motion model, resampler and injector. A seeded filter is therefore bit-reproducible,
+and the draws of one stage do not shift the random numbers of another. Filters running in parallel receive
+independent seeds from spawn_seeds. Strategies that are used without a filter draw from a shared unseeded generator.
+"""
+
+default_random_generator = np.random.default_rng()
+
+
+def spawn_seeds(seed, number_of_seeds: int) -> list:
+    """
+    @param seed: integer seed, SeedSequence or None for fresh entropy
+    @return: independent child seeds, e.g. for the filters of parallel runs
+    """
+    seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    return seed_sequence.spawn(number_of_seeds)
+
+
+class StochasticStrategy:
+    random_generator = None
+
+    def set_random_generator(self, random_generator: np.random.Generator) -> None:
+        self.random_generator = random_generator
+
+    def get_random_generator(self) -> np.random.Generator:
+        if self.random_generator is None:
+            return default_random_generator
+        return self.random_generator
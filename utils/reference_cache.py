@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+
+"""
+The ReferenceCache memoizes the reference values of Map3D.get_reference_value for particles that query nearly the
+same position. The key of a lookup is the branch and the displacement quantized to the resolution of the cache, and
+the cached value is the reference value at the quantized displacement, so the result does not depend on which
+particle filled the entry. The cache holds at most max_size entries and evicts the least recently used entry.
+Hits, misses and evictions are counted until the counters are reset.
+The cache belongs to the measurement model that uses it, not to the map, so navigators sharing one map do not see
+each other's quantization. The map is passed with every lookup, and the entries are cleared whenever the compiled
+map of the map changes, i.e. after vessels or mappings were added or the map was reloaded.
+"""
+
+
+class ReferenceCache:
+    """
+    @param resolution: quantization step of the displacement in millimeters
+    @param max_size: maximal number of cached reference values
+    """
+
+    def __init__(self, resolution: float = 0.05, max_size: int = 100_000) -> None:
+        if resolution <= 0:
+            raise ValueError("The resolution of the reference cache must be positive")
+        if max_size < 1:
+            raise ValueError("The reference cache must hold at least one entry")
+        self.resolution = resolution
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.compiled_map = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def quantize(self, branch: int, displacement: float) -> tuple:
+        return int(branch), round(displacement / self.resolution)
+
+    def get_reference_value(self, map3D, branch: int, displacement: float) -> float:
+        """
+        @param map3D: map whose get_reference_value is called on a miss with the quantized displacement
+        """
+        key = self.quantize(branch, displacement)
+        compiled_map = map3D.get_compiled_map()
+        with self.lock:
+            if compiled_map is not self.compiled_map:
+                self.entries.clear()
+                self.compiled_map = compiled_map
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        reference_value = map3D.get_reference_value(key[0], key[1] * self.resolution)
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = reference_value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return reference_value
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        state["compiled_map"] = None
+        state["entries"] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def reset_statistics(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_statistics(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"size": len(self.entries),
+                "max_size": self.max_size,
+                "resolution": self.resolution,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0}
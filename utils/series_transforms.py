@@ -0,0 +1,96 @@
+import numpy as np
+
+from utils.history_buffer import HistoryBuffer
+
+"""
+The SeriesTransform bundles the transforms of the derivative DTW measurement models. All transforms operate on the
+last axis, so they transform a single series as well as a whole (N, W) matrix of particle histories in one call.
+The smoothing replaces each value but the first by a convex combination with its predecessor, the derivative is
+a three point derivative of the smoothed series, and the convex combination blends the raw series with its derivative.
+
+The IncrementalDerivativeTransform keeps the smoothed values and the derivative of a sliding window up to date as the
+window slides: each appended value costs one smoothing and one derivative step. Only the first derivative of the
+window is recalculated, because the first value of the window is not smoothed.
+"""
+
+
+class SeriesTransform:
+
+    @staticmethod
+    def smooth_exponentially(series, alpha: float = 0.5) -> np.ndarray:
+        series = np.asarray(series, dtype=np.float64)
+        if series.shape[-1] < 1:
+            raise ValueError("list must contain elements")
+        if alpha <= 0 or alpha >= 1:
+            raise ValueError("alpha must be between 0 and 1")
+        smoothed = np.empty_like(series)
+        smoothed[..., 0] = series[..., 0]
+        smoothed[..., 1:] = alpha * series[..., 1:] + (1 - alpha) * series[..., :-1]
+        return smoothed
+
+    @staticmethod
+    def derive(series, smoothing_alpha: float = 0.5) -> np.ndarray:
+        series = np.asarray(series, dtype=np.float64)
+        if series.shape[-1] < 3:
+            return series
+        smoothed = SeriesTransform.smooth_exponentially(series, smoothing_alpha)
+        return 0.25 * smoothed[..., 2:] + 0.5 * smoothed[..., 1:-1] - 0.75 * smoothed[..., :-2]
+
+    @staticmethod
+    def convex_combine(series, alpha: float = 0.2, smoothing_alpha: float = 0.5) -> np.ndarray:
+        series = np.asarray(series, dtype=np.float64)
+        if series.shape[-1] < 3:
+            return series
+        return alpha * series[..., 2:] + (1 - alpha) * SeriesTransform.derive(series, smoothing_alpha)
+
+
+class IncrementalDerivativeTransform:
+    """
+    @param window_length: maximal length of the sliding window
+    @param smoothing_alpha: weight of the current value in the smoothing
+    """
+
+    def __init__(self, window_length: int = 20, smoothing_alpha: float = 0.5) -> None:
+        if smoothing_alpha <= 0 or smoothing_alpha >= 1:
+            raise ValueError("alpha must be between 0 and 1")
+        self.smoothing_alpha = smoothing_alpha
+        self.smoothed = HistoryBuffer(1, window_length)
+        self.derivative = HistoryBuffer(1, window_length)
+        self.previous_value = None
+
+    def reset(self) -> None:
+        self.smoothed.reset()
+        self.derivative.reset()
+        self.previous_value = None
+
+    def append(self, value: float) -> None:
+        if self.previous_value is None:
+            self.smoothed.append(value)
+        else:
+            self.smoothed.append(self.smoothing_alpha * value + (1 - self.smoothing_alpha) * self.previous_value)
+        self.previous_value = value
+        smoothed = self.smoothed.get_row(0)
+        if len(smoothed) >= 3:
+            self.derivative.append(0.25 * smoothed[-1] + 0.5 * smoothed[-2] - 0.75 * smoothed[-3])
+        else:
+            self.derivative.append(0)
+
+    def get_derived(self, window: np.ndarray) -> np.ndarray:
+        """
+        @param window: the raw values of the sliding window, i.e. the last values passed to append
+        @return: the same result as SeriesTransform.derive(window)
+        """
+        if len(window) < 3:
+            return window
+        smoothed = self.smoothed.get_row(0)[-len(window):]
+        derived = self.derivative.get_row(0)[-(len(window) - 2):].copy()
+        derived[0] = 0.25 * smoothed[2] + 0.5 * smoothed[1] - 0.75 * window[0]
+        return derived
+
+    def get_convex_combination(self, window: np.ndarray, alpha: float = 0.2) -> np.ndarray:
+        """
+        @return: the same result as SeriesTransform.convex_combine(window, alpha)
+        """
+        if len(window) < 3:
+            return window
+        return alpha * window[2:] + (1 - alpha) * self.get_derived(window)
@@ -0,0 +1,215 @@
+import glob
+import os
+import queue
+import threading
+
+import numpy as np
+
+from utils.array_particle_set import ArrayParticleSet
+from utils.particle_set import ParticleSet
+from utils.position_estimate import PositionEstimate
+
+"""
+The StepRecorder writes the particle columns (branch, displacement, alpha, weight), the measurements, the effective
+sample size and the position estimate of the update steps to a binary recording, replacing the per-particle text
+dump in the log file. The recorder copies the columns of every sampled step into a buffer. Once chunk_size steps are
+buffered, the chunk is handed to a background thread, which concatenates the columns and writes them as one .npz
+file per chunk. At most max_pending_chunks chunks wait for the writer, after which recording blocks until the writer
+catches up, so memory stays bounded.
+Since the number of particles and clusters may change from step to step, the particle and estimate columns of a
+chunk are stored concatenated together with offsets: the particles of the i-th step of a chunk are
+particle_offsets[i]:particle_offsets[i + 1].
+The StepRecording loads a recording for offline analysis, either step by step or as concatenated columns.
+"""
+
+STEP_COLUMNS = ["steps", "displacement_measurements", "impedance_measurements", "effective_sample_sizes", "resampled"]
+PARTICLE_COLUMNS = ["branches", "displacements", "alphas", "weights"]
+ESTIMATE_COLUMNS = ["estimate_branches", "estimate_centers", "estimate_errors", "estimate_sizes"]
+
+
+class StepRecorder:
+    """
+    @param directory: directory of the recording; it is created if it does not exist
+    @param sampling_interval: every sampling_interval-th step is recorded
+    @param chunk_size: number of recorded steps per file
+    @param max_pending_chunks: number of chunks that may wait for the writer thread
+    @param filename: prefix of the chunk files
+    """
+
+    def __init__(self,
+                 directory: str,
+                 sampling_interval: int = 1,
+                 chunk_size: int = 100,
+                 max_pending_chunks: int = 4,
+                 filename: str = "steps") -> None:
+        if sampling_interval < 1 or chunk_size < 1 or max_pending_chunks < 1:
+            raise ValueError("sampling interval, chunk size and number of pending chunks must be at least 1")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.sampling_interval = sampling_interval
+        self.chunk_size = chunk_size
+        self.filename = filename
+        self.number_of_calls = 0
+        self.number_of_chunks = 0
+        self.recording_current_step = False
+        self.closed = False
+        self.writer_error = None
+        self.buffer = self.create_buffer()
+        self.pending_chunks = queue.Queue(maxsize=max_pending_chunks)
+        self.writer = threading.Thread(target=self.write_chunks, daemon=True)
+        self.writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def create_buffer() -> dict:
+        return {column: [] for column in STEP_COLUMNS + PARTICLE_COLUMNS + ESTIMATE_COLUMNS}
+
+    @staticmethod
+    def get_particle_columns(particles: ParticleSet) -> list:
+        if isinstance(particles, ArrayParticleSet):
+            return [particles.branches.copy(), particles.displacements.copy(),
+                    particles.alphas.copy(), particles.weights.copy()]
+        return [np.array([particle.state.branch for particle in particles], dtype=np.int64),
+                np.array([particle.state.position for particle in particles], dtype=np.float64),
+                np.array([particle.state.alpha for particle in particles], dtype=np.float64),
+                np.array([particle.weight for particle in particles], dtype=np.float64)]
+
+    def check_writer(self) -> None:
+        if self.writer_error is not None:
+            raise RuntimeError("writing the step recording failed") from self.writer_error
+
+    def record_step(self,
+                    step: int,
+                    particles: ParticleSet,
+                    displacement_measurement: float,
+                    impedance_measurement: float,
+                    effective_sample_size: float = np.nan,
+                    resampled: bool = True) -> None:
+        if self.closed:
+            raise ValueError("the step recorder is closed")
+        self.check_writer()
+        self.recording_current_step = self.number_of_calls % self.sampling_interval == 0
+        self.number_of_calls += 1
+        if not self.recording_current_step:
+            return
+        if len(self.buffer["steps"]) >= self.chunk_size:
+            self.flush()
+        for column, value in zip(STEP_COLUMNS, [step, displacement_measurement, impedance_measurement,
+                                                effective_sample_size, resampled]):
+            self.buffer[column].append(value)
+        for column, values in zip(PARTICLE_COLUMNS, self.get_particle_columns(particles)):
+            self.buffer[column].append(values)
+        for column in ESTIMATE_COLUMNS:
+            self.buffer[column].append(np.array([]))
+
+    def record_estimate(self, position_estimate: PositionEstimate) -> None:
+        """
+        Adds the position estimate to the most recently recorded step; ignored if that step was not sampled.
+        """
+        if not self.recording_current_step or len(self.buffer["steps"]) == 0:
+            return
+        clusters = [cluster for branch_clusters in position_estimate.get_clusters().values()
+                    for cluster in branch_clusters]
+        for column, values in zip(ESTIMATE_COLUMNS, [
+                np.array([cluster.get_branch() for cluster in clusters], dtype=np.int64),
+                np.array([cluster.get_center() for cluster in clusters], dtype=np.float64),
+                np.array([cluster.get_error() for cluster in clusters], dtype=np.float64),
+                np.array([cluster.get_number_of_particles() for cluster in clusters], dtype=np.int64)]):
+            self.buffer[column][-1] = values
+
+    def flush(self) -> None:
+        if len(self.buffer["steps"]) == 0:
+            return
+        self.pending_chunks.put((self.number_of_chunks, self.buffer))
+        self.number_of_chunks += 1
+        self.buffer = self.create_buffer()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        self.pending_chunks.put(None)
+        self.writer.join()
+        self.check_writer()
+
+    def write_chunks(self) -> None:
+        while True:
+            chunk = self.pending_chunks.get()
+            if chunk is None:
+                return
+            if self.writer_error is not None:
+                continue
+            try:
+                self.write_chunk(*chunk)
+            except Exception as error:
+                self.writer_error = error
+
+    def get_chunk_path(self, index: int) -> str:
+        return os.path.join(self.directory, self.filename + "_" + str(index).zfill(6) + ".npz")
+
+    def write_chunk(self, index: int, buffer: dict) -> None:
+        columns = {column: np.asarray(buffer[column]) for column in STEP_COLUMNS}
+        columns["steps"] = columns["steps"].astype(np.int64)
+        columns["resampled"] = columns["resampled"].astype(bool)
+        for offsets, names in [("particle_offsets", PARTICLE_COLUMNS), ("estimate_offsets", ESTIMATE_COLUMNS)]:
+            columns[offsets] = np.concatenate([[0], np.cumsum([len(values) for values in buffer[names[0]]])])
+            for column in names:
+                columns[column] = np.concatenate(buffer[column])
+        for column in ["estimate_branches", "estimate_sizes"]:
+            columns[column] = columns[column].astype(np.int64)
+        path = self.get_chunk_path(index)
+        with open(path + ".part", "wb") as outfile:
+            np.savez(outfile, **columns)
+        os.replace(path + ".part", path)
+
+
+class StepRecording:
+    """
+    @param directory: directory of a recording written by the StepRecorder
+    @param filename: prefix of the chunk files
+    """
+
+    def __init__(self, directory: str, filename: str = "steps") -> None:
+        self.chunk_paths = sorted(glob.glob(os.path.join(directory, filename + "_*.npz")))
+
+    def __len__(self):
+        return sum(len(chunk["steps"]) for chunk in self.iterate_chunks())
+
+    def iterate_chunks(self):
+        for path in self.chunk_paths:
+            with np.load(path) as chunk:
+                yield {name: chunk[name] for name in chunk.files}
+
+    def iterate_steps(self):
+        """
+        @return: iterator over the recorded steps, one dictionary of measurements, particle and estimate columns each
+        """
+        for chunk in self.iterate_chunks():
+            for i in range(len(chunk["steps"])):
+                step = {column: chunk[column][i].item() for column in STEP_COLUMNS}
+                for offsets, names in [("particle_offsets", PARTICLE_COLUMNS), ("estimate_offsets", ESTIMATE_COLUMNS)]:
+                    start, end = chunk[offsets][i], chunk[offsets][i + 1]
+                    step.update({column: chunk[column][start:end] for column in names})
+                yield step
+
+    def load(self) -> dict:
+        """
+        @return: all columns concatenated over the chunks, with the offsets relative to the concatenated columns
+        """
+        chunks = list(self.iterate_chunks())
+        columns = {}
+        for column in STEP_COLUMNS + PARTICLE_COLUMNS + ESTIMATE_COLUMNS:
+            columns[column] = np.concatenate([chunk[column] for chunk in chunks]) if chunks else np.array([])
+        for offsets in ["particle_offsets", "estimate_offsets"]:
+            shifted, total = [np.array([0])], 0
+            for chunk in chunks:
+                shifted.append(chunk[offsets][1:] + total)
+                total += chunk[offsets][-1]
+            columns[offsets] = np.concatenate(shifted)
+        return columns
@@ -0,0 +1,97 @@
+import math
+
+import numpy as np
+
+"""
+Streaming statistics with constant memory and constant cost per value, for quantities that are tracked over the whole
+intervention. The RunningStatistics accumulate count, mean and the sum of squared deviations of all values with
+Welford's algorithm. The RollingStatistics keep the same moments over the last window_length values: the values of
+the window are held in a ring buffer, and each new value is added to and the value leaving the window removed from
+the moments with the inverse Welford update. Since the removals accumulate rounding errors over long runs, the
+moments are recalculated from the ring buffer every recalculation_interval values, and also whenever the removal of
+an outlier cancels most of the squared deviations of the window.
+Variance and standard error of the mean use one degree of freedom, like scipy.stats.sem.
+"""
+
+
+class RunningStatistics:
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.0
+        self.squared_deviations = 0.0
+
+    @classmethod
+    def from_values(cls, values):
+        statistics = cls()
+        for value in values:
+            statistics.append(value)
+        return statistics
+
+    def append(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.squared_deviations += delta * (value - self.mean)
+
+    def get_mean(self) -> float:
+        return self.mean if self.count > 0 else math.nan
+
+    def get_variance(self) -> float:
+        if self.count < 2:
+            return math.nan
+        return max(self.squared_deviations, 0.0) / (self.count - 1)
+
+    def get_standard_error(self) -> float:
+        return math.sqrt(self.get_variance() / self.count) if self.count >= 2 else math.nan
+
+
+class RollingStatistics(RunningStatistics):
+    """
+    @param window_length: number of most recent values the statistics are calculated over
+    @param recalculation_interval: number of values after which the moments are recalculated from the window
+    """
+
+    def __init__(self, window_length: int, recalculation_interval: int = 1000) -> None:
+        if window_length < 1:
+            raise ValueError("window length must be at least 1")
+        super().__init__()
+        self.window = np.zeros(window_length, dtype=np.float64)
+        self.recalculation_interval = max(recalculation_interval, window_length)
+        self.head = 0
+        self.number_of_values = 0
+        self.cancellation_ratio = 0.01
+
+    def append(self, value: float) -> None:
+        value = float(value)
+        self.number_of_values += 1
+        if self.count < len(self.window):
+            self.window[self.head] = value
+            self.head = (self.head + 1) % len(self.window)
+            super().append(value)
+            return
+        removed = float(self.window[self.head])
+        self.window[self.head] = value
+        self.head = (self.head + 1) % len(self.window)
+        if self.number_of_values % self.recalculation_interval == 0:
+            self.recalculate()
+            return
+        previous_mean = self.mean
+        previous_squared_deviations = self.squared_deviations
+        self.mean += (value - removed) / self.count
+        self.squared_deviations += (value - removed) * (value - self.mean + removed - previous_mean)
+        if self.squared_deviations < self.cancellation_ratio * previous_squared_deviations:
+            self.recalculate()
+
+    def recalculate(self) -> None:
+        values = self.get_values()
+        self.mean = float(np.mean(values))
+        self.squared_deviations = float(np.sum((values - self.mean) ** 2))
+
+    def get_values(self) -> np.ndarray:
+        """
+        @return: values of the window, oldest first
+        """
+        if self.count < len(self.window):
+            return self.window[:self.count].copy()
+        return np.roll(self.window, -self.head)
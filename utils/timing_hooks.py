@@ -0,0 +1,119 @@
+import cProfile
+import io
+import os
+import pstats
+
+import numpy as np
+
+"""
+Timing hooks are attached to the ParticleFilter and receive the wall time of each stage of an update step:
+motion, weighting, resampling, injection and estimation. A step begins with the motion stage of the filter and ends
+after the position estimate of Model3D, or at the latest when the next step begins.
+
+The StepTimingRecorder keeps the stage durations of the most recent steps in a fixed size ring buffer and summarizes
+them as mean and percentiles. The LatencyProfiler runs cProfile on the step following a step that exceeded the
+latency budget and keeps the resulting statistics.
+"""
+
+FILTER_STAGES = ["motion", "weighting", "resampling", "injection", "estimation"]
+
+
+class TimingHook:
+
+    def begin_step(self, step: int) -> None:
+        pass
+
+    def record_stage(self, stage: str, duration: float) -> None:
+        pass
+
+    def end_step(self, duration: float) -> None:
+        pass
+
+
+class StepTimingRecorder(TimingHook):
+    """
+    @param capacity: number of most recent steps kept in the ring buffer
+    @param stages: names of the recorded stages; stages not listed are only added to the total step duration
+    """
+
+    def __init__(self, capacity: int = 1000, stages: list = None) -> None:
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.stages = list(FILTER_STAGES if stages is None else stages)
+        self.columns = {stage: column for column, stage in enumerate(self.stages + ["total"])}
+        self.durations = np.full((capacity, len(self.columns)), np.nan)
+        self.number_of_steps = 0
+        self.row = 0
+
+    def begin_step(self, step: int) -> None:
+        self.row = self.number_of_steps % len(self.durations)
+        self.durations[self.row] = np.nan
+        self.number_of_steps += 1
+
+    def record_stage(self, stage: str, duration: float) -> None:
+        if stage in self.columns:
+            self.durations[self.row, self.columns[stage]] = duration
+
+    def end_step(self, duration: float) -> None:
+        self.durations[self.row, self.columns["total"]] = duration
+
+    def get_recent_durations(self) -> np.ndarray:
+        """
+        @return: stage durations in seconds of the recorded steps, oldest first, one column per stage and the total
+        """
+        if self.number_of_steps <= len(self.durations):
+            return self.durations[:self.number_of_steps]
+        return np.roll(self.durations, -(self.row + 1), axis=0)
+
+    def summary(self, percentiles: tuple = (50, 90, 99)) -> dict:
+        durations = self.get_recent_durations() * 1000
+        summary = {}
+        for stage, column in self.columns.items():
+            recorded = durations[:, column][~np.isnan(durations[:, column])]
+            summary[stage] = {"count": len(recorded),
+                              "mean_ms": float(np.mean(recorded)) if len(recorded) > 0 else np.nan}
+            for percentile in percentiles:
+                summary[stage]["p" + str(percentile) + "_ms"] = \
+                    float(np.percentile(recorded, percentile)) if len(recorded) > 0 else np.nan
+        return summary
+
+
+class LatencyProfiler(TimingHook):
+    """
+    @param latency_budget: step duration in seconds above which the next step is profiled
+    @param output_directory: if given, the statistics of each profiled step are written there as .prof file
+    @param max_profiles: maximal number of profiled steps kept in memory
+    """
+
+    def __init__(self, latency_budget: float, output_directory: str = None, max_profiles: int = 10) -> None:
+        self.latency_budget = latency_budget
+        self.output_directory = output_directory
+        self.max_profiles = max_profiles
+        self.profiles = []
+        self.profiler = None
+        self.armed = False
+        self.step = 0
+
+    def begin_step(self, step: int) -> None:
+        self.step = step
+        if self.armed:
+            self.armed = False
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def end_step(self, duration: float) -> None:
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.store_profile(self.profiler)
+            self.profiler = None
+        elif duration > self.latency_budget:
+            self.armed = True
+
+    def store_profile(self, profiler: cProfile.Profile) -> None:
+        if self.output_directory is not None:
+            profiler.dump_stats(os.path.join(self.output_directory, "step_" + str(self.step) + ".prof"))
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(30)
+        self.profiles.append({"step": self.step, "report": report.getvalue()})
+        if len(self.profiles) > self.max_profiles:
+            self.profiles.pop(0)
@@ -0,0 +1,198 @@
+import math
+import multiprocessing
+import os
+import pickle
+import weakref
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from utils.particle_filter_component_enums import WeightingExecutorType
+
+"""
+The WeightingExecutor runs the per-particle work of a measurement model on chunks of the particles and merges the
+raw weights of the chunks in particle order. The measurement model passes a chunk function, the state the function
+needs (usually the measurement model itself) and the per-particle inputs, numpy arrays or lists of equal length:
+    raw_weights = executor.map_chunks(function, state, [branches, displacements], arguments=(measurement,))
+calls function(state, branch_chunk, displacement_chunk, measurement) for each chunk.
+- SERIAL calls the function once on all particles.
+- THREAD weights the chunks on a thread pool; the numpy kernels of the batched weighting release the GIL.
+- PROCESS weights the chunks on a process pool. The state is handed to each worker process once, when the pool is
+  started, so changes of the state after the first step do not reach the workers; the per-step measurement is
+  passed as argument. The input arrays are copied into a reused shared memory block, from which the workers read
+  their chunks without pickling them.
+- AUTO uses the serial path below serial_threshold particles, so small runs do not pay the pool overhead, and the
+  thread pool above it.
+The pool and the shared memory block are released by close(), or when the executor is garbage collected or the
+interpreter exits.
+"""
+
+worker_state = None
+worker_blocks = {}
+
+
+def initialize_worker(pickled_state: bytes) -> None:
+    global worker_state
+    worker_state = pickle.loads(pickled_state)
+
+
+def attach_block(name: str) -> shared_memory.SharedMemory:
+    if name not in worker_blocks:
+        for block in worker_blocks.values():
+            block.close()
+        worker_blocks.clear()
+        worker_blocks[name] = shared_memory.SharedMemory(name=name)
+    return worker_blocks[name]
+
+
+def run_chunk(function, inputs: list, start: int, stop: int, arguments: tuple):
+    chunks = []
+    for values in inputs:
+        if isinstance(values, tuple):
+            name, offset, dtype, shape = values
+            array = np.ndarray(shape, dtype=dtype, buffer=attach_block(name).buf, offset=offset)
+            chunks.append(array[start:stop])
+        else:
+            chunks.append(values)
+    return np.array(function(worker_state, *chunks, *arguments), dtype=np.float64)
+
+
+def release_resources(resources: dict) -> None:
+    pool = resources["pool"]
+    resources["pool"] = None
+    if pool is not None:
+        pool.shutdown(wait=True)
+    shared_block = resources["shared_block"]
+    resources["shared_block"] = None
+    if shared_block is not None:
+        shared_block.close()
+        shared_block.unlink()
+
+
+class WeightingExecutor:
+    """
+    @param executor_type: serial, thread pool, process pool or automatic selection
+    @param number_of_workers: number of threads or processes, the number of cores if None
+    @param chunk_size: number of particles per chunk, by default the particles are split evenly over the workers
+    @param serial_threshold: number of particles below which the AUTO executor uses the serial path
+    """
+
+    def __init__(self,
+                 executor_type: WeightingExecutorType = WeightingExecutorType.AUTO,
+                 number_of_workers: int = None,
+                 chunk_size: int = None,
+                 serial_threshold: int = 10_000) -> None:
+        if number_of_workers is not None and number_of_workers < 1:
+            raise ValueError("number of workers must be at least 1")
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError("chunk size must be at least 1")
+        self.executor_type = executor_type
+        self.number_of_workers = number_of_workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.serial_threshold = serial_threshold
+        self.pool_state = None
+        self.resources = {"pool": None, "shared_block": None}
+        self.finalizer = weakref.finalize(self, release_resources, self.resources)
+
+    def __getstate__(self):
+        # a copy of the executor, e.g. in a worker process, starts its own pools
+        state = self.__dict__.copy()
+        del state["resources"]
+        del state["finalizer"]
+        state["pool_state"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.resources = {"pool": None, "shared_block": None}
+        self.finalizer = weakref.finalize(self, release_resources, self.resources)
+
+    def is_serial(self, number_of_particles: int) -> bool:
+        if self.executor_type == WeightingExecutorType.SERIAL:
+            return True
+        if self.executor_type == WeightingExecutorType.AUTO:
+            return number_of_particles < self.serial_threshold
+        return False
+
+    def get_chunk_bounds(self, number_of_particles: int) -> list:
+        chunk_size = self.chunk_size or math.ceil(number_of_particles / self.number_of_workers)
+        return [(start, min(start + chunk_size, number_of_particles))
+                for start in range(0, number_of_particles, max(chunk_size, 1))]
+
+    def get_thread_pool(self) -> ThreadPoolExecutor:
+        if not isinstance(self.resources["pool"], ThreadPoolExecutor):
+            self.close()
+            self.resources["pool"] = ThreadPoolExecutor(max_workers=self.number_of_workers)
+        return self.resources["pool"]
+
+    def get_process_pool(self, state) -> ProcessPoolExecutor:
+        if not isinstance(self.resources["pool"], ProcessPoolExecutor) or self.pool_state is None \
+                or self.pool_state() is not state:
+            self.close()
+            # forked workers must share the resource tracker of this process, otherwise they report the shared
+            # inputs as leaked; the pool only holds a pickled copy of the state, so that it does not keep the
+            # measurement model and this executor alive
+            resource_tracker.ensure_running()
+            self.resources["pool"] = ProcessPoolExecutor(max_workers=self.number_of_workers,
+                                                         mp_context=multiprocessing.get_context(),
+                                                         initializer=initialize_worker, initargs=(pickle.dumps(state),))
+            self.pool_state = weakref.ref(state)
+        return self.resources["pool"]
+
+    def share_inputs(self, inputs: list) -> list:
+        arrays = [values for values in inputs if isinstance(values, np.ndarray)]
+        size = sum(array.nbytes for array in arrays)
+        shared_block = self.resources["shared_block"]
+        if shared_block is None or shared_block.size < size:
+            self.release_shared_block()
+            shared_block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+            self.resources["shared_block"] = shared_block
+        shared_inputs = []
+        offset = 0
+        for values in inputs:
+            if not isinstance(values, np.ndarray):
+                shared_inputs.append(values)
+                continue
+            np.ndarray(values.shape, dtype=values.dtype, buffer=shared_block.buf, offset=offset)[:] = values
+            shared_inputs.append((shared_block.name, offset, values.dtype.str, values.shape))
+            offset += values.nbytes
+        return shared_inputs
+
+    def map_chunks(self, function, state, inputs: list, arguments: tuple = ()) -> np.ndarray:
+        """
+        @param function: chunk function, called as function(state, *input_chunks, *arguments); must be a module or
+        class level function to be sent to worker processes
+        @param state: first argument of the function, e.g. the measurement model
+        @param inputs: per-particle inputs, numpy arrays or lists of equal length
+        @param arguments: further arguments passed unchanged to each chunk
+        @return: concatenated results of the chunks in particle order
+        """
+        number_of_particles = len(inputs[0])
+        if self.is_serial(number_of_particles) or number_of_particles == 0:
+            return np.asarray(function(state, *inputs, *arguments), dtype=np.float64)
+        bounds = self.get_chunk_bounds(number_of_particles)
+        if self.executor_type == WeightingExecutorType.PROCESS:
+            pool = self.get_process_pool(state)
+            shared_inputs = self.share_inputs(inputs)
+            futures = [pool.submit(run_chunk, function,
+                                   [values if isinstance(values, tuple) else values[start:stop]
+                                    for values in shared_inputs],
+                                   start, stop, arguments)
+                       for start, stop in bounds]
+        else:
+            pool = self.get_thread_pool()
+            futures = [pool.submit(function, state, *[values[start:stop] for values in inputs], *arguments)
+                       for start, stop in bounds]
+        return np.concatenate([np.asarray(future.result(), dtype=np.float64) for future in futures])
+
+    def release_shared_block(self) -> None:
+        shared_block = self.resources["shared_block"]
+        self.resources["shared_block"] = None
+        if shared_block is not None:
+            shared_block.close()
+            shared_block.unlink()
+
+    def close(self) -> None:
+        self.pool_state = None
+        release_resources(self.resources)